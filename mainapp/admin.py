@@ -1,14 +1,18 @@
 from django.contrib import admin
 
 from .models import (
-    Category, Product, CartProduct, Cart, Customer, Order)
+    Category, CategoryProductCount, Product, CartProduct, Cart, Customer,
+    Order, OrderLine, PaymentEvent)
 
 admin.site.register(Category)
+admin.site.register(CategoryProductCount)
 admin.site.register(Product)
 admin.site.register(CartProduct)
 admin.site.register(Cart)
 admin.site.register(Customer)
 admin.site.register(Order)
+admin.site.register(OrderLine)
+admin.site.register(PaymentEvent)
 
 admin.site.site_header = 'Интернет магазин'
 admin.site.site_title = 'Сайт интернет магазина'
@@ -1,42 +1,239 @@
+import hashlib
+import json
 from collections import OrderedDict
 
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max, Prefetch
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import (
-    ListAPIView, ListCreateAPIView, RetrieveUpdateAPIView, )
-from rest_framework.pagination import PageNumberPagination
+    ListAPIView, ListCreateAPIView, RetrieveAPIView, RetrieveUpdateAPIView, )
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from .serializers import CategorySerializer, CustomerSerializer
+from specs.models import ProductFeatures
 
-from ..models import Category, Customer
+from .pagination import KeysetPagination
+from .serializers import (
+    CategorySerializer, CustomerSerializer, ProductSerializer)
 
+from ..cache import get_categories_version, get_products_version
+from ..models import Category, Customer, Product
+from ..search import SEARCH_LIMIT, autocomplete, search_products
+from ..utils import with_product_counts
 
-class CategoryPagination(PageNumberPagination):
+# Максимальное кол-во id в одном запросе products/bulk/
+PRODUCTS_BULK_MAX_IDS = 100
+
+
+class CategoryPagination(KeysetPagination):
     """Локальная пагинация для CategoryListAPIView"""
 
     page_size = 2
-    page_size_query_param = 'page_size'
     max_page_size = 10
+    ordering = 'id'
 
     def get_paginated_response(self, data):
         """Кастомный метод пагинации"""
         return Response(OrderedDict([
-            ('object_count', self.page.paginator.count),
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
             ('items', data)
         ]))
 
 
+class NDJSONExportMixin:
+    """
+    Потоковая выгрузка всего списка в формате NDJSON (?export=ndjson).
+    Объекты читаются пачками по id (с prefetch_related на каждую пачку),
+    память не зависит от размера таблицы
+    """
+
+    export_query_param = 'export'
+    export_chunk_size = 1000
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.export_query_param) == 'ndjson':
+            response = StreamingHttpResponse(
+                self.stream_ndjson(), content_type='application/x-ndjson')
+            response['Content-Disposition'] = (
+                'attachment; filename="{}.ndjson"'.format(
+                    self.get_queryset().model._meta.model_name))
+            return response
+        return super().list(request, *args, **kwargs)
+
+    def stream_ndjson(self):
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id')
+        last_id = 0
+        while True:
+            chunk = list(
+                queryset.filter(id__gt=last_id)[:self.export_chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            for data in self.get_serializer(chunk, many=True).data:
+                yield json.dumps(
+                    data, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
 class CategoryAPIView(ListCreateAPIView, RetrieveUpdateAPIView):
     """Создание новой категории и их изменение"""
     serializer_class = CategorySerializer
     pagination_class = CategoryPagination
-    queryset = Category.objects.all()
+    # Счётчик товаров - JOIN с CategoryProductCount, без COUNT на категорию
+    queryset = with_product_counts(Category.objects.all())
     lookup_field = 'id'
 
 
-class CustomersListAPIView(ListAPIView):
-    """Все пользователи"""
+class CustomersListAPIView(NDJSONExportMixin, ListAPIView):
+    """Все пользователи (телефоны и адреса - только для персонала)"""
 
+    permission_classes = (IsAdminUser,)
     serializer_class = CustomerSerializer
-    queryset = Customer.objects.all()
+    # Вложенные заказы одним запросом на страницу, а не на пользователя
+    queryset = Customer.objects.prefetch_related('orders')
+
+
+class ConditionalGetMixin:
+    """
+    Условный GET: ETag и Last-Modified по дате изменения товаров.
+    Если данные не менялись - ответ 304 без сериализации.
+    В ETag входит версия категорий (mainapp.cache): slug категории
+    выводится в товаре, но его изменение не меняет даты товаров
+    """
+
+    def get_conditional_state(self):
+        """(etag, last_modified) для текущего запроса"""
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_conditional_state()
+        # If-Modified-Since - с точностью до секунды, сравнение с дробным
+        # timestamp никогда не даёт 304
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if etag:
+            response['ETag'] = etag
+        if timestamp:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def make_etag(self, *parts):
+        # Выбранные поля и параметры запроса меняют тело ответа
+        parts += (get_categories_version(), self.request.get_full_path())
+        digest = hashlib.md5(
+            ':'.join(str(part) for part in parts).encode()).hexdigest()
+        return quote_etag(digest)
+
+
+class ProductQuerysetMixin:
+    """
+    Товары с категорией и характеристиками specs за фиксированное
+    кол-во запросов. Описание и характеристики загружаются только,
+    если они запрошены через ?fields=
+    """
+
+    serializer_class = ProductSerializer
+
+    def get_queryset(self):
+        queryset = Product.objects.select_related('category')
+        requested = ProductSerializer.get_requested_fields(self.request)
+        if requested is None or 'features' in requested:
+            queryset = queryset.prefetch_related(Prefetch(
+                'productfeatures_set',
+                queryset=ProductFeatures.objects.select_related('feature')))
+        if requested is not None and 'description' not in requested:
+            queryset = queryset.defer('description')
+        return queryset
+
+    def get_list_conditional_state(self, queryset):
+        state = queryset.order_by().aggregate(
+            last_modified=Max('updated_at'), count=Count('id'))
+        # Версия товаров - удаление и добавление товаров
+        etag = self.make_etag(
+            state['count'], state['last_modified'], get_products_version())
+        return etag, state['last_modified']
+
+
+class ProductListAPIView(
+        ConditionalGetMixin, ProductQuerysetMixin, ListAPIView):
+    """Каталог товаров. Фильтр по категории: ?category=<slug>"""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        category = self.request.query_params.get('category')
+        if category:
+            queryset = queryset.filter(category__slug=category)
+        return queryset
+
+    def get_conditional_state(self):
+        return self.get_list_conditional_state(self.get_queryset())
+
+
+class ProductBulkAPIView(
+        ConditionalGetMixin, ProductQuerysetMixin, ListAPIView):
+    """Несколько товаров по id одним запросом: ?ids=1,2,3"""
+
+    pagination_class = None
+
+    def get_ids(self):
+        try:
+            ids = {int(pk) for pk in self.request.query_params.get(
+                'ids', '').split(',') if pk.strip()}
+        except ValueError:
+            raise ValidationError({'ids': 'Ожидается список целых чисел'})
+        if len(ids) > PRODUCTS_BULK_MAX_IDS:
+            raise ValidationError(
+                {'ids': f'Не более {PRODUCTS_BULK_MAX_IDS} id за запрос'})
+        return ids
+
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            id__in=self.get_ids()).order_by('id')
+
+    def get_conditional_state(self):
+        return self.get_list_conditional_state(self.get_queryset())
+
+
+class ProductDetailAPIView(
+        ConditionalGetMixin, ProductQuerysetMixin, RetrieveAPIView):
+    """Детальная информация о товаре"""
+
+    lookup_field = 'slug'
+
+    def get_conditional_state(self):
+        updated_at = get_object_or_404(
+            Product.objects.values_list('updated_at', flat=True),
+            slug=self.kwargs['slug'])
+        return self.make_etag(updated_at), updated_at
+
+
+class ProductSearchAPIView(ProductQuerysetMixin, ListAPIView):
+    """Полнотекстовый поиск товаров по релевантности: ?q=&limit="""
+
+    pagination_class = None
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            return []
+        try:
+            limit = max(1, min(int(self.request.query_params.get(
+                'limit', SEARCH_LIMIT)), SEARCH_LIMIT))
+        except ValueError:
+            limit = SEARCH_LIMIT
+        return search_products(query, limit, super().get_queryset())
+
+
+class AutocompleteAPIView(APIView):
+    """Подсказки по началу названия товара: ?q="""
+
+    def get(self, request, *args, **kwargs):
+        return Response(autocomplete(request.query_params.get('q', '')))
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Пагинация по ключу (курсору) для всех списков API.
+    Без OFFSET и COUNT(*) по всей таблице - скорость не зависит от
+    номера страницы и размера таблицы
+    """
+
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    # Уникальное и неизменяемое поле => стабильный курсор
+    ordering = '-id'
@@ -1,16 +1,20 @@
 from rest_framework import serializers
 
-from ..models import Category, Customer, Order
+from specs.models import ProductFeatures
+
+from ..models import Category, Customer, Order, Product
 
 
 class CategorySerializer(serializers.ModelSerializer):
     """Сериализатор для Категорий"""
     name = serializers.CharField(required=True)
     slug = serializers.SlugField()
+    # Новая категория (ответ на POST) без аннотации => 0 товаров
+    product_count = serializers.IntegerField(read_only=True, default=0)
 
     class Meta:
         model = Category
-        fields = ('id', 'name', 'slug')
+        fields = ('id', 'name', 'slug', 'product_count')
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -32,3 +36,53 @@ class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = '__all__'
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор с выбором полей через query параметр ?fields=a,b,c.
+    Клиент может не передавать тяжёлые поля (например, описание)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context.get('request'))
+        if requested is not None:
+            for field_name in set(self.fields) - requested:
+                self.fields.pop(field_name)
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """Множество запрошенных полей или None, если выбора не было"""
+        if request is None or not request.query_params.get('fields'):
+            return None
+        return {
+            name.strip()
+            for name in request.query_params['fields'].split(',')
+            if name.strip()
+        } & set(cls.Meta.fields)
+
+
+class ProductFeatureSerializer(serializers.ModelSerializer):
+    """Характеристика товара из приложения specs"""
+    name = serializers.CharField(source='feature.feature_name')
+    filter_name = serializers.CharField(source='feature.feature_filter_name')
+    unit = serializers.CharField(source='feature.unit')
+
+    class Meta:
+        model = ProductFeatures
+        fields = ('name', 'filter_name', 'value', 'unit')
+
+
+class ProductSerializer(DynamicFieldsModelSerializer):
+    """Сериализатор для товаров (только чтение)"""
+    category = serializers.SlugRelatedField(slug_field='slug', read_only=True)
+    url = serializers.CharField(source='get_absolute_url', read_only=True)
+    features = ProductFeatureSerializer(
+        source='productfeatures_set', many=True, read_only=True)
+
+    class Meta:
+        model = Product
+        fields = ('id', 'title', 'slug', 'category', 'price', 'description',
+                  'image', 'url', 'updated_at', 'features')
+        read_only_fields = fields
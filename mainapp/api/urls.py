@@ -1,9 +1,20 @@
 from django.urls import path
 
-from .api_views import CategoryAPIView, CustomersListAPIView
+from .api_views import (
+    AutocompleteAPIView, CategoryAPIView, CustomersListAPIView,
+    ProductBulkAPIView, ProductDetailAPIView, ProductListAPIView,
+    ProductSearchAPIView)
 
 urlpatterns = [
     path('categories/<str:id>/', CategoryAPIView.as_view(),
          name='category_list'),
     path('customers/', CustomersListAPIView.as_view(), name='customers_list'),
+    path('search/', ProductSearchAPIView.as_view(), name='search'),
+    path('search/autocomplete/', AutocompleteAPIView.as_view(),
+         name='autocomplete'),
+    path('products/', ProductListAPIView.as_view(), name='products_list'),
+    path('products/bulk/', ProductBulkAPIView.as_view(),
+         name='products_bulk'),
+    path('products/<str:slug>/', ProductDetailAPIView.as_view(),
+         name='product_api_detail'),
 ]
@@ -5,3 +5,6 @@ class MainappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mainapp'
     verbose_name = 'Онлайн Магазин'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - регистрация обработчиков
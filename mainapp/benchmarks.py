@@ -0,0 +1,193 @@
+"""
+Общие функции нагрузочных замеров (команды bench_*).
+Замеры выполняются во временной БД, как у тестов, - рабочие данные
+не затрагиваются.
+
+Сценарии витрины (bench_storefront) выполняются тестовым клиентом Django:
+для каждого шага сценария записываются задержка и кол-во SQL запросов
+"""
+import math
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Category, Customer, Product
+
+# Сценарий -> шаги. Покупка выполняется авторизованным пользователем
+SCENARIOS = {
+    'browse': ('home', 'category', 'product'),
+    'purchase': ('home', 'category', 'product', 'add_to_cart', 'change_qty',
+                 'cart', 'checkout', 'make_order'),
+}
+AUTHENTICATED_SCENARIOS = ('purchase',)
+
+
+@contextmanager
+def benchmark_database(alias=DEFAULT_DB_ALIAS):
+    """
+    Создать временную БД с применёнными миграциями и удалить её на выходе.
+    Для SQLite используется файл, а не память, - иначе потоки замера
+    получат разные БД
+    """
+    connection = connections[alias]
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    temp_dir = None
+    if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+        temp_dir = tempfile.mkdtemp(prefix='benchmark-')
+        test_settings['NAME'] = os.path.join(temp_dir, 'db.sqlite3')
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    try:
+        # Реплики смотрят в рабочую БД - все запросы замера на основную
+        with override_settings(DATABASE_REPLICAS=[]):
+            yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if temp_dir:
+            test_settings.pop('NAME', None)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def percentile(values, percent):
+    """Процентиль (ближайший ранг) по списку значений"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def latency_summary(latencies):
+    """p50/p95/p99/max в миллисекундах"""
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0) * 1000, 2),
+    }
+
+
+def create_catalog(products=48):
+    """Категория с товарами для сценариев (bulk_create, без сигналов)"""
+    category = Category.objects.create(
+        name='Ноутбуки', slug='benchmark-notebooks')
+    Product.objects.bulk_create([
+        Product(category=category, title=f'Ноутбук {i}', slug=f'notebook-{i}',
+                price=1000 + i, description='Описание ' * 20,
+                image=f'mainapp/images/notebook-{i}.jpg')
+        for i in range(products)
+    ])
+    return category, list(Product.objects.filter(category=category))
+
+
+def create_buyer(username='benchmark-buyer'):
+    user = User.objects.create_user(username, first_name='Иван',
+                                    last_name='Иванов')
+    Customer.objects.create(user=user, phone='+70000000000', address='Адрес')
+    return user
+
+
+def scenario_requests(category, product):
+    """Шаг сценария -> (метод, url, данные)"""
+    order_date = (timezone.localdate() + timedelta(days=1)).isoformat()
+    return {
+        'home': ('get', '/', None),
+        'category': ('get', category.get_absolute_url(), None),
+        'product': ('get', product.get_absolute_url(), None),
+        'add_to_cart': ('get', reverse(
+            'add_to_cart', kwargs={'slug': product.slug}), None),
+        'change_qty': ('post', reverse(
+            'change_qty', kwargs={'slug': product.slug}), {'qty': 2}),
+        'cart': ('get', reverse('cart'), None),
+        'checkout': ('get', reverse('checkout'), None),
+        'make_order': ('post', reverse('make_order'), {
+            'first_name': 'Иван', 'last_name': 'Иванов',
+            'phone': '+70000000000', 'address': 'Адрес',
+            'buying_type': 'self', 'order_date': order_date, 'comment': '',
+        }),
+    }
+
+
+def run_scenario(name, iterations, category, products, user=None, warmup=0):
+    """
+    Выполнить сценарий iterations раз (плюс warmup неучитываемых).
+    Вернуть {шаг: [(сек, кол-во запросов, код ответа)]} и общее время, сек
+    """
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    samples = {step: [] for step in SCENARIOS[name]}
+    elapsed = 0.0
+    for iteration in range(warmup + iterations):
+        product = products[iteration % len(products)]
+        requests = scenario_requests(category, product)
+        for step in SCENARIOS[name]:
+            method, url, data = requests[step]
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                duration = time.perf_counter() - started
+            if iteration >= warmup:
+                elapsed += duration
+                samples[step].append(
+                    (duration, len(queries), response.status_code))
+    return samples, elapsed
+
+
+def summarize_scenario(samples, elapsed, iterations):
+    """Отчёт по сценарию: пропускная способность и метрики каждого шага"""
+    steps = {}
+    errors = 0
+    for step, step_samples in samples.items():
+        queries = [sample[1] for sample in step_samples]
+        step_errors = sum(1 for sample in step_samples if sample[2] >= 400)
+        errors += step_errors
+        steps[step] = {
+            'requests': len(step_samples),
+            'errors': step_errors,
+            'queries_avg': round(sum(queries) / max(len(queries), 1), 2),
+            'queries_max': max(queries, default=0),
+            **latency_summary([sample[0] for sample in step_samples]),
+        }
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'throughput_per_s': round(iterations / max(elapsed, 1e-6), 2),
+        'steps': steps,
+    }
+
+
+def compare_reports(baseline, current, max_regression):
+    """
+    Сравнить отчёты. Регрессия - рост числа запросов шага либо рост p95
+    больше чем на max_regression процентов. Вернуть список описаний
+    """
+    regressions = []
+    for scenario, report in current['scenarios'].items():
+        base_steps = baseline.get('scenarios', {}).get(scenario, {}).get(
+            'steps', {})
+        for step, metrics in report['steps'].items():
+            base = base_steps.get(step)
+            if base is None:
+                continue
+            if metrics['queries_max'] > base['queries_max']:
+                regressions.append(
+                    f'{scenario}/{step}: запросов {base["queries_max"]} -> '
+                    f'{metrics["queries_max"]}')
+            if (max_regression is not None and base['p95_ms']
+                    and metrics['p95_ms'] > base['p95_ms']
+                    * (1 + max_regression / 100)):
+                regressions.append(
+                    f'{scenario}/{step}: p95 {base["p95_ms"]} мс -> '
+                    f'{metrics["p95_ms"]} мс')
+    return regressions
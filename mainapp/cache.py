@@ -0,0 +1,125 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Category, Product
+from .utils import with_product_counts
+
+CATEGORIES_VERSION_KEY = 'mainapp:categories:version'
+CATEGORIES_CACHE_KEY = 'mainapp:categories:{}'
+CATEGORIES_CACHE_TIMEOUT = 60 * 60 * 24
+# Версия списка товаров для кэша фрагментов шаблонов ({% cache %}).
+# Карточка и страница товара кэшируются по Product.updated_at
+PRODUCTS_VERSION_KEY = 'mainapp:products:version'
+
+
+class LRUCache:
+    """Небольшой потокобезопасный LRU кэш внутри процесса"""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Локальная копия списка категорий для каждой версии.
+# Старые версии вытесняются сами, т.к. к ним больше не обращаются
+local_categories = LRUCache(maxsize=8)
+
+
+def get_version(key):
+    """Текущая версия набора данных в общем кэше"""
+    version = cache.get(key)
+    if version is None:
+        # Версия от текущего времени => после вытеснения ключа
+        # не переиспользуются номера старых версий
+        cache.add(key, int(time.time()), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(key):
+    """
+    Увеличить версию набора данных. Все процессы увидят новую версию
+    при следующем запросе, устаревшие ключи истекут сами
+    """
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:  # ключа ещё нет (или он вытеснен)
+            cache.set(key, int(time.time()), None)
+
+    # Сбросить только после коммита, иначе параллельный запрос может
+    # закэшировать старые данные под новой версией
+    transaction.on_commit(bump)
+
+
+def get_categories():
+    """
+    Список категорий для навигации, со счётчиком товаров (product_count).
+    Порядок поиска: LRU процесса -> общий кэш -> БД
+    """
+    version = get_version(CATEGORIES_VERSION_KEY)
+    categories = local_categories.get(version)
+    if categories is not None:
+        return categories
+
+    key = CATEGORIES_CACHE_KEY.format(version)
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(with_product_counts(Category.objects.all()))
+        cache.set(key, categories, CATEGORIES_CACHE_TIMEOUT)
+    local_categories.set(version, categories)
+    return categories
+
+
+def get_categories_version():
+    return get_version(CATEGORIES_VERSION_KEY)
+
+
+def invalidate_categories():
+    """Сбросить список категорий во всех процессах"""
+    bump_version(CATEGORIES_VERSION_KEY)
+
+
+def get_products_version():
+    return get_version(PRODUCTS_VERSION_KEY)
+
+
+def invalidate_products():
+    """Сбросить закэшированные списки товаров (главная страница)"""
+    bump_version(PRODUCTS_VERSION_KEY)
+
+
+def invalidate_product_images(image_names):
+    """
+    Изображения товаров получили уменьшенные копии. Карточки, закэшированные
+    до этого с исходным изображением, сбрасываются: ключ их кэша -
+    Product.updated_at, списки товаров - по версии товаров
+    """
+    updated = Product.objects.filter(image__in=list(image_names)).update(
+        updated_at=timezone.now())
+    if updated:
+        invalidate_products()
@@ -0,0 +1,185 @@
+from django.db import transaction
+
+from .models import Cart, CartProduct, Customer
+from .utils import recalc_cart
+
+# Ключ сессии: id корзины и её итоги для шапки страницы
+CART_SESSION_KEY = 'cart'
+
+
+def get_customer(user):
+    """Покупатель для пользователя. Создать, если его ещё нет"""
+    customer = Customer.objects.filter(user=user).first()
+    if not customer:
+        customer = Customer.objects.create(user=user)
+    return customer
+
+
+def get_customer_cart(customer):
+    """Текущая (не оформленная) корзина покупателя"""
+    cart = Cart.objects.filter(owner=customer, in_order=False).first()
+    if not cart:
+        cart = Cart.objects.create(owner=customer)
+    cart.owner = customer
+    return cart
+
+
+def resolve_cart(request):
+    """
+    Найти корзину запроса. Сначала по id из сессии (один запрос),
+    затем поиск/создание корзины покупателя либо новой анонимной корзины
+    """
+    cart_id = request.session.get(CART_SESSION_KEY, {}).get('id')
+    carts = Cart.objects.filter(in_order=False)
+
+    if request.user.is_authenticated:
+        if cart_id:
+            cart = carts.select_related('owner').filter(
+                id=cart_id, owner__user=request.user).first()
+            if cart:
+                return cart
+        return get_customer_cart(get_customer(request.user))
+
+    if cart_id:
+        cart = carts.filter(id=cart_id, owner__isnull=True).first()
+        if cart:
+            return cart
+    return Cart.objects.create(for_anonymous_user=True)
+
+
+def store_cart_in_session(session, cart):
+    """Сохранить id и итоги корзины в сессии (только при изменении)"""
+    data = {
+        'id': cart.id,
+        'total_products': cart.total_products,
+        'final_price': str(cart.final_price),
+    }
+    if session.get(CART_SESSION_KEY) != data:
+        session[CART_SESSION_KEY] = data
+
+
+class LazyCart:
+    """
+    Ленивая корзина. Корзина загружается из БД (resolve) только при
+    обращении к её данным. Кол-во товаров для шапки страницы - одним
+    лёгким запросом по id корзины из сессии.
+    Функциям utils и шаблонам с полными данными корзины передаётся
+    resolve(), шаблонам - сам объект (total_products, final_price, owner)
+    """
+
+    def __init__(self, request):
+        self._request = request
+        self._cart = None
+        self._total_products = None
+
+    def resolve(self):
+        """Корзина запроса (Cart), загружается при первом обращении"""
+        if self._cart is None:
+            self._cart = resolve_cart(self._request)
+        return self._cart
+
+    @property
+    def is_resolved(self):
+        return self._cart is not None
+
+    @property
+    def id(self):
+        return self.resolve().id
+
+    @property
+    def owner(self):
+        return self.resolve().owner
+
+    @property
+    def owner_id(self):
+        return self.resolve().owner_id
+
+    @property
+    def final_price(self):
+        return self.resolve().final_price
+
+    def get_lines(self):
+        return self.resolve().get_lines()
+
+    @property
+    def total_products(self):
+        """
+        Кол-во товаров без загрузки корзины. Итоги в сессии могут
+        устареть (изменения из другой сессии, purge_carts) =>
+        читаются из БД по id корзины из сессии
+        """
+        if self.is_resolved:
+            return self._cart.total_products
+        if self._total_products is None:
+            self._total_products = self._load_total_products()
+        return self._total_products
+
+    def _load_total_products(self):
+        session = self._request.session
+        data = session.get(CART_SESSION_KEY)
+        if not data:
+            return 0
+        carts = Cart.objects.filter(id=data.get('id'), in_order=False)
+        if self._request.user.is_authenticated:
+            carts = carts.filter(owner__user=self._request.user)
+        else:
+            carts = carts.filter(owner__isnull=True)
+        total_products = carts.values_list(
+            'total_products', flat=True).first()
+        if total_products is None:
+            # Корзина удалена, оформлена либо принадлежит другому
+            session.pop(CART_SESSION_KEY, None)
+            return 0
+        if data.get('total_products') != total_products:
+            session[CART_SESSION_KEY] = dict(
+                data, total_products=total_products)
+        return total_products
+
+    def save_to_session(self):
+        """
+        Обновить данные корзины в сессии после обработки запроса.
+        Оформленная корзина, либо корзина другого типа пользователя
+        (вход/выход во время запроса), из сессии удаляется
+        """
+        if not self.is_resolved:
+            return
+        cart = self._cart
+        session = self._request.session
+        is_anonymous_cart = cart.owner_id is None
+        if cart.in_order or (
+                is_anonymous_cart == self._request.user.is_authenticated):
+            session.pop(CART_SESSION_KEY, None)
+            return
+        store_cart_in_session(session, cart)
+
+
+@transaction.atomic
+def merge_carts(source, target):
+    """
+    Перенести позиции анонимной корзины source в корзину покупателя target.
+    Совпадающие товары суммируются, остальные переносятся одним UPDATE
+    """
+    target_lines = {
+        line.product_id: line
+        for line in CartProduct.objects.filter(cart=target)}
+    moved_ids, updated_lines = [], []
+    for line in CartProduct.objects.filter(cart=source).select_related(
+            'product'):
+        existing = target_lines.get(line.product_id)
+        if existing:
+            existing.qty += line.qty
+            existing.final_price = existing.qty * line.product.price
+            updated_lines.append(existing)
+        else:
+            moved_ids.append(line.id)
+
+    CartProduct.objects.bulk_update(updated_lines, ('qty', 'final_price'))
+    CartProduct.objects.filter(id__in=moved_ids).update(
+        cart=target, user=target.owner)
+    Cart.products.through.objects.filter(
+        cart_id=source.id, cartproduct_id__in=moved_ids).update(
+        cart_id=target.id)
+    # Удаляет и оставшиеся (слитые) позиции анонимной корзины
+    source.delete()
+    recalc_cart(target)
+    return target
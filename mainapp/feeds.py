@@ -0,0 +1,165 @@
+"""
+Потоковая генерация sitemap.xml и YML фида товаров (Яндекс.Маркет).
+Генераторы отдают документ частями: товары читаются пачками по id
+(keyset, values_list без создания моделей), характеристики (specs) -
+одним запросом на пачку => память не зависит от размера каталога.
+Используются в представлениях (StreamingHttpResponse) и в команде
+generate_feeds (запись на диск с атомарной заменой файлов)
+"""
+from xml.sax.saxutils import escape, quoteattr
+
+from django.db.models import Max
+from django.urls import reverse
+from django.utils import timezone
+
+from specs.models import ProductFeatures
+from .models import Category, Product
+
+# Максимум URL в одном файле sitemap (ограничение протокола)
+SITEMAP_SHARD_SIZE = 50000
+FEED_CHUNK_SIZE = 1000
+SHOP_NAME = 'Интернет магазин'
+CURRENCY = 'RUR'
+YML_PRODUCT_FIELDS = (
+    'slug', 'title', 'description', 'price', 'image', 'category_id')
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def iter_chunks(queryset, *fields):
+    """Пачки строк (id, *fields) queryset по id (keyset, без OFFSET)"""
+    queryset = queryset.order_by('id').values_list('id', *fields)
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:FEED_CHUNK_SIZE])
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+        yield chunk
+
+
+def url_builder(view_name):
+    """
+    Функция slug -> url, как get_absolute_url моделей (reverse по slug),
+    но шаблон url разбирается один раз, а не на каждый товар.
+    slug - ASCII ([-a-zA-Z0-9_]) => экранирование не требуется
+    """
+    marker = '__slug__'
+    prefix, suffix = reverse(
+        view_name, kwargs={'slug': marker}).split(marker)
+    return lambda slug: f'{prefix}{slug}{suffix}'
+
+
+def sitemap_shard_count():
+    """
+    Кол-во файлов sitemap товаров. Файл n (с 1) содержит товары с id
+    в диапазоне ((n - 1) * SITEMAP_SHARD_SIZE, n * SITEMAP_SHARD_SIZE] =>
+    не больше SITEMAP_SHARD_SIZE URL без подсчёта товаров
+    """
+    max_id = Product.objects.aggregate(Max('id'))['id__max'] or 0
+    return max(1, -(-max_id // SITEMAP_SHARD_SIZE))
+
+
+def sitemap_url(loc, lastmod=None):
+    lastmod = (
+        f'<lastmod>{lastmod.date().isoformat()}</lastmod>' if lastmod else '')
+    return f'<url><loc>{escape(loc)}</loc>{lastmod}</url>\n'
+
+
+def generate_sitemap_index(base_url):
+    """Индекс sitemap: категории + файлы товаров"""
+    yield XML_HEADER
+    yield f'<sitemapindex xmlns="{SITEMAP_NS}">\n'
+    locations = [reverse('sitemap_categories')] + [
+        reverse('sitemap_products', kwargs={'shard': shard})
+        for shard in range(1, sitemap_shard_count() + 1)]
+    for location in locations:
+        yield f'<sitemap><loc>{escape(base_url + location)}</loc></sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def generate_categories_sitemap(base_url):
+    yield XML_HEADER
+    yield f'<urlset xmlns="{SITEMAP_NS}">\n'
+    category_url = url_builder('category_detail')
+    for chunk in iter_chunks(Category.objects.all(), 'slug'):
+        yield ''.join(
+            sitemap_url(base_url + category_url(slug)) for _, slug in chunk)
+    yield '</urlset>\n'
+
+
+def generate_products_sitemap(base_url, shard):
+    """Файл sitemap товаров номер shard (с 1)"""
+    products = Product.objects.filter(
+        id__gt=(shard - 1) * SITEMAP_SHARD_SIZE,
+        id__lte=shard * SITEMAP_SHARD_SIZE)
+    product_url = url_builder('product_detail')
+    yield XML_HEADER
+    yield f'<urlset xmlns="{SITEMAP_NS}">\n'
+    for chunk in iter_chunks(products, 'slug', 'updated_at'):
+        yield ''.join(
+            sitemap_url(base_url + product_url(slug), updated_at)
+            for _, slug, updated_at in chunk)
+    yield '</urlset>\n'
+
+
+def load_params(product_ids):
+    """Характеристики пачки товаров одним запросом: {id: [(имя, ед., знач)]}"""
+    params = {product_id: [] for product_id in product_ids}
+    rows = ProductFeatures.objects.filter(
+        product_id__in=list(params)).order_by(
+        'product_id', 'feature_id').values_list(
+        'product_id', 'feature__feature_name', 'feature__unit', 'value')
+    for product_id, name, unit, value in rows:
+        params[product_id].append((name, unit, value))
+    return params
+
+
+def yml_offer(base_url, row, params, product_url, image_url):
+    """Предложение (offer) из строки YML_PRODUCT_FIELDS и характеристик"""
+    product_id, slug, title, description, price, image, category_id = row
+    lines = [
+        f'<offer id="{product_id}" available="true">',
+        f'<url>{escape(base_url + product_url(slug))}</url>',
+        f'<price>{price}</price>',
+        f'<currencyId>{CURRENCY}</currencyId>',
+        f'<categoryId>{category_id}</categoryId>',
+    ]
+    if image:
+        lines.append(
+            f'<picture>{escape(base_url + image_url(image))}</picture>')
+    lines.append(f'<name>{escape(title)}</name>')
+    if description:
+        lines.append(f'<description>{escape(description)}</description>')
+    for name, unit, value in params:
+        unit = f' unit={quoteattr(unit)}' if unit else ''
+        lines.append(
+            f'<param name={quoteattr(name)}{unit}>{escape(value)}</param>')
+    lines.append('</offer>\n')
+    return '\n'.join(lines)
+
+
+def generate_yml(base_url):
+    """YML каталог: магазин, категории, предложения с характеристиками"""
+    yield XML_HEADER
+    yield '<yml_catalog date="{}">\n<shop>\n'.format(
+        timezone.localtime().strftime('%Y-%m-%d %H:%M'))
+    yield (f'<name>{escape(SHOP_NAME)}</name>\n'
+           f'<company>{escape(SHOP_NAME)}</company>\n'
+           f'<url>{escape(base_url)}/</url>\n'
+           f'<currencies><currency id="{CURRENCY}" rate="1"/></currencies>\n')
+    yield '<categories>\n'
+    for chunk in iter_chunks(Category.objects.all(), 'name'):
+        yield ''.join(
+            f'<category id="{category_id}">{escape(name)}</category>\n'
+            for category_id, name in chunk)
+    yield '</categories>\n<offers>\n'
+    product_url = url_builder('product_detail')
+    image_url = Product._meta.get_field('image').storage.url
+    for chunk in iter_chunks(Product.objects.all(), *YML_PRODUCT_FIELDS):
+        params = load_params(row[0] for row in chunk)
+        yield ''.join(
+            yml_offer(base_url, row, params[row[0]], product_url, image_url)
+            for row in chunk)
+    yield '</offers>\n</shop>\n</yml_catalog>\n'
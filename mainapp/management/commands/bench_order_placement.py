@@ -0,0 +1,147 @@
+import copy
+import queue
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Count
+
+from mainapp.benchmarks import benchmark_database, latency_summary
+from mainapp.models import (
+    Cart, CartProduct, Category, Customer, Order, OrderLine, Product)
+from mainapp.utils import CartAlreadyOrderedError, place_order
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный замер оформления заказов (place_order) во временной БД.
+    Каждая корзина оформляется несколькими параллельными запросами
+    (повторная отправка формы). Проверяется, что на корзину создан ровно
+    один заказ, выводятся задержки и пропускная способность
+    """
+
+    help = 'Замер параллельного оформления заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--carts', type=int, default=200, help='Кол-во корзин')
+        parser.add_argument(
+            '--lines', type=int, default=3, help='Позиций в корзине')
+        parser.add_argument(
+            '--submits', type=int, default=2,
+            help='Параллельных попыток оформить одну корзину')
+        parser.add_argument(
+            '--threads', type=int, default=8, help='Кол-во потоков')
+        parser.add_argument(
+            '--max-p99-ms', type=float,
+            help='Ошибка, если p99 успешного оформления больше')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            carts = self.create_carts(options['carts'], options['lines'])
+            tasks = [copy.copy(cart) for cart in carts
+                     for _ in range(options['submits'])]
+            random.shuffle(tasks)
+            results, elapsed = self.run(tasks, options['threads'])
+            duplicates = (
+                Order.objects.values('cart').annotate(orders=Count('id'))
+                .filter(orders__gt=1).count())
+            orders = Order.objects.count()
+            lines = OrderLine.objects.count()
+
+        placed = [latency for status, latency in results if status == 'placed']
+        rejected = sum(1 for status, _ in results if status == 'rejected')
+        errors = [status for status, _ in results
+                  if status not in ('placed', 'rejected')]
+        summary = latency_summary(placed)
+        self.stdout.write(
+            f'Попыток: {len(results)}, заказов: {orders}, '
+            f'отклонено повторов: {rejected}, ошибок БД: {len(errors)}, '
+            f'позиций заказов: {lines}')
+        self.stdout.write(
+            f'Пропускная способность: {len(placed) / elapsed:.0f} заказов/с, '
+            + ', '.join(f'{key}: {value}' for key, value in summary.items()))
+        for error in sorted(set(errors)):
+            self.stderr.write(error)
+
+        if duplicates or orders != len(carts):
+            raise CommandError(
+                f'Корзин с несколькими заказами: {duplicates}, '
+                f'заказов {orders} при {len(carts)} корзинах')
+        if options['max_p99_ms'] and summary['p99_ms'] > options['max_p99_ms']:
+            raise CommandError(
+                f'p99 {summary["p99_ms"]} мс > {options["max_p99_ms"]} мс')
+        self.stdout.write(self.style.SUCCESS('Повторных заказов нет'))
+
+    def create_carts(self, count, lines_per_cart):
+        """Покупатели с заполненными корзинами (bulk операции, без сигналов)"""
+        category = Category.objects.create(name='Замер', slug='benchmark')
+        Product.objects.bulk_create([
+            Product(category=category, title=f'Товар {i}', slug=f'bench-{i}',
+                    price=100 + i, image='mainapp/images/benchmark.jpg')
+            for i in range(lines_per_cart)
+        ])
+        products = list(Product.objects.filter(category=category))
+        User.objects.bulk_create([
+            User(username=f'bench-{i}') for i in range(count)])
+        users = User.objects.filter(username__startswith='bench-')
+        Customer.objects.bulk_create([
+            Customer(user=user, phone='0') for user in users])
+        customers = list(Customer.objects.order_by('id'))
+        Cart.objects.bulk_create([
+            Cart(owner=customer, total_products=len(products),
+                 final_price=sum(product.price for product in products))
+            for customer in customers])
+        carts = list(Cart.objects.select_related('owner').order_by('id'))
+        CartProduct.objects.bulk_create([
+            CartProduct(user=cart.owner, cart=cart, product=product,
+                        final_price=product.price)
+            for cart in carts for product in products])
+        Cart.products.through.objects.bulk_create([
+            Cart.products.through(cart_id=cart_id, cartproduct_id=line_id)
+            for line_id, cart_id in CartProduct.objects.values_list(
+                'id', 'cart_id')])
+        return carts
+
+    def run(self, tasks, threads):
+        """Выполнить задачи в потоках. Вернуть [(статус, сек)], общее время"""
+        pending = queue.Queue()
+        for task in tasks:
+            pending.put(task)
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        cart = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    order = Order(first_name='Замер', last_name='Замер',
+                                  phone='0')
+                    started = time.perf_counter()
+                    try:
+                        place_order(order, cart)
+                        status = 'placed'
+                    except CartAlreadyOrderedError:
+                        status = 'rejected'
+                    except DatabaseError as error:
+                        status = f'{type(error).__name__}: {error}'
+                    latency = time.perf_counter() - started
+                    with lock:
+                        results.append((status, latency))
+            finally:
+                # У каждого потока своё соединение с БД
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results, max(time.perf_counter() - started, 1e-6)
@@ -0,0 +1,119 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mainapp.benchmarks import (
+    AUTHENTICATED_SCENARIOS, SCENARIOS, benchmark_database, compare_reports,
+    create_buyer, create_catalog, run_scenario, summarize_scenario)
+from mainapp.payments import reset_payment_gateway
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'), cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    """
+    Замер сценариев витрины (главная -> категория -> товар -> корзина ->
+    оформление заказа) тестовым клиентом во временной БД.
+    Отчёт JSON (задержки p50/p95/p99, запросы на шаг, пропускная
+    способность) можно сравнивать между коммитами: --compare
+    """
+
+    help = 'Нагрузочный замер сценариев витрины с отчётом JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', action='append', choices=sorted(SCENARIOS),
+            help='Сценарий (по умолчанию - все)')
+        parser.add_argument(
+            '--iterations', type=int, default=50,
+            help='Кол-во прогонов каждого сценария')
+        parser.add_argument(
+            '--warmup', type=int, default=2,
+            help='Неучитываемых прогонов перед замером')
+        parser.add_argument(
+            '--products', type=int, default=48, help='Товаров в каталоге')
+        parser.add_argument('--output', help='Файл для отчёта JSON')
+        parser.add_argument(
+            '--compare', help='Отчёт JSON предыдущего замера для сравнения')
+        parser.add_argument(
+            '--max-regression', type=float,
+            help='Допустимый рост p95 при сравнении, %%')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenario'] or sorted(SCENARIOS)
+        report = {
+            'meta': {
+                'commit': current_commit(),
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'products': options['products'],
+            },
+            'scenarios': {},
+        }
+
+        # Оплата - локальная заглушка, замер не зависит от сети
+        with override_settings(
+                PAYMENT_GATEWAY='mainapp.payments.FakeGateway',
+                ALLOWED_HOSTS=['testserver']), benchmark_database():
+            reset_payment_gateway()
+            report['meta']['database'] = connection.vendor
+            category, products = create_catalog(options['products'])
+            buyer = create_buyer()
+            for name in scenarios:
+                user = buyer if name in AUTHENTICATED_SCENARIOS else None
+                samples, elapsed = run_scenario(
+                    name, options['iterations'], category, products, user,
+                    options['warmup'])
+                report['scenarios'][name] = summarize_scenario(
+                    samples, elapsed, options['iterations'])
+        reset_payment_gateway()
+
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2,
+                          sort_keys=True)
+                file.write('\n')
+
+        errors = sum(
+            scenario['errors'] for scenario in report['scenarios'].values())
+        if errors:
+            raise CommandError(f'Ответов с ошибкой: {errors}')
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)
+            regressions = compare_reports(
+                baseline, report, options['max_regression'])
+            if regressions:
+                raise CommandError(
+                    'Регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+    def print_report(self, report):
+        for name, scenario in report['scenarios'].items():
+            self.stdout.write(
+                f'{name}: {scenario["throughput_per_s"]} сценариев/с, '
+                f'ошибок: {scenario["errors"]}')
+            for step, metrics in scenario['steps'].items():
+                self.stdout.write(
+                    f'  {step:<12} p50 {metrics["p50_ms"]:>8} мс  '
+                    f'p95 {metrics["p95_ms"]:>8} мс  '
+                    f'p99 {metrics["p99_ms"]:>8} мс  '
+                    f'запросов {metrics["queries_avg"]:>6}')
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from mainapp.models import Cart
+
+
+class Command(BaseCommand):
+    """
+    Сверка итогов корзин (total_products, final_price) с их позициями.
+    Итоги пересчитываются одним агрегирующим запросом на пачку корзин
+    """
+
+    help = 'Проверить (и исправить) итоги корзин'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Записать пересчитанные итоги в расходящиеся корзины')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Кол-во корзин в одной пачке')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = mismatched = 0
+        last_id = 0
+        while True:
+            # Keyset-итерация по id, без OFFSET
+            batch_ids = list(
+                Cart.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:batch_size])
+            if not batch_ids:
+                break
+            last_id = batch_ids[-1]
+            checked += len(batch_ids)
+
+            with transaction.atomic():
+                if options['fix']:
+                    # Блокировка пачки, чтобы не затереть параллельные
+                    # изменения корзин между пересчётом и записью
+                    list(Cart.objects.select_for_update().filter(
+                        id__in=batch_ids).values_list('id', flat=True))
+                mismatched += self.check_batch(batch_ids, options['fix'])
+
+        action = 'исправлено' if options['fix'] else 'расхождений'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено корзин: {checked}, {action}: {mismatched}'))
+
+    def check_batch(self, batch_ids, fix):
+        """Сверить пачку корзин, вернуть кол-во расхождений"""
+        carts = Cart.objects.filter(id__in=batch_ids).annotate(
+            lines=Count('products'),
+            amount=Coalesce(
+                Sum('products__final_price'), Value(0),
+                output_field=DecimalField(max_digits=9, decimal_places=2)),
+        ).filter(~Q(total_products=F('lines')) | ~Q(final_price=F('amount')))
+
+        broken = []
+        for cart in carts:
+            self.stdout.write(
+                f'Корзина №{cart.id}: {cart.total_products} / '
+                f'{cart.final_price} != {cart.lines} / {cart.amount}')
+            cart.total_products, cart.final_price = cart.lines, cart.amount
+            broken.append(cart)
+
+        if fix and broken:
+            Cart.objects.bulk_update(broken, ('total_products', 'final_price'))
+        return len(broken)
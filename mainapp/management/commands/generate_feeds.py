@@ -0,0 +1,83 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from mainapp.feeds import (
+    generate_categories_sitemap, generate_products_sitemap,
+    generate_sitemap_index, generate_yml, sitemap_shard_count)
+
+
+class Command(BaseCommand):
+    """
+    Запись sitemap и YML фида в файлы (для отдачи веб-сервером по тем же
+    путям, что и у представлений). Каждый файл пишется во временный и
+    атомарно заменяет старый => читатели не видят недописанный файл
+    """
+
+    help = 'Сгенерировать sitemap.xml и YML фид товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir', default=str(settings.FEEDS_ROOT),
+            help='Каталог для файлов (по умолчанию settings.FEEDS_ROOT)')
+        parser.add_argument(
+            '--base-url', default=settings.SITE_URL,
+            help='Адрес сайта (по умолчанию settings.SITE_URL)')
+
+    def handle(self, *args, **options):
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        base_url = options['base_url'].rstrip('/')
+        started = time.monotonic()
+
+        shards = sitemap_shard_count()
+        files = [
+            ('yml_feed', {}, generate_yml(base_url)),
+            ('sitemap_categories', {}, generate_categories_sitemap(base_url)),
+        ] + [
+            ('sitemap_products', {'shard': shard},
+             generate_products_sitemap(base_url, shard))
+            for shard in range(1, shards + 1)
+        ] + [
+            # Индекс - последним, когда все его файлы уже на месте
+            ('sitemap', {}, generate_sitemap_index(base_url)),
+        ]
+        for url_name, kwargs, chunks in files:
+            name = reverse(url_name, kwargs=kwargs).lstrip('/')
+            size = self.write_atomic(output_dir / name, chunks)
+            self.stdout.write(f'{name}: {size / 1024:.0f} КБ')
+
+        # Файлы товаров, оставшиеся от прежнего (большего) каталога
+        for path in output_dir.glob('sitemap-products-*.xml'):
+            number = path.stem.rsplit('-', 1)[-1]
+            if number.isdigit() and int(number) > shards:
+                path.unlink()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с'))
+
+    def write_atomic(self, path, chunks):
+        """Записать части во временный файл рядом и заменить им path"""
+        fd, tmp_name = tempfile.mkstemp(
+            dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in chunks:
+                    data = chunk.encode('utf-8')
+                    tmp.write(data)
+                    size += len(data)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            # mkstemp создаёт файл только для владельца
+            os.chmod(tmp_name, 0o644)
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        return size
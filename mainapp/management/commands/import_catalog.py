@@ -0,0 +1,309 @@
+import csv
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from mainapp.cache import invalidate_categories, invalidate_products
+from mainapp.models import Category, Product
+from mainapp.search import index_products
+from mainapp.utils import recount_category_products
+from specs.facets import invalidate_facet_index
+from specs.models import CategoryFeature, FeatureValidator, ProductFeatures
+from specs.numeric import parse_numeric
+
+# Префикс колонок CSV с характеристиками: feature:<feature_filter_name>
+CSV_FEATURE_PREFIX = 'feature:'
+PRODUCT_FIELDS = ('category', 'title', 'description', 'price')
+# Строковые поля строки: (макс. длина по полю модели, обязательное)
+ROW_STRING_FIELDS = {
+    'slug': (Product._meta.get_field('slug').max_length, True),
+    'category': (Category._meta.get_field('slug').max_length, True),
+    'category_name': (Category._meta.get_field('name').max_length, False),
+    'title': (Product._meta.get_field('title').max_length, True),
+    'description': (None, False),
+}
+_price_field = Product._meta.get_field('price')
+PRICE_QUANTUM = Decimal(1).scaleb(-_price_field.decimal_places)
+# Цена меньше PRICE_LIMIT - помещается в max_digits поля
+PRICE_LIMIT = Decimal(10) ** (
+    _price_field.max_digits - _price_field.decimal_places)
+
+
+class Command(BaseCommand):
+    """
+    Потоковый импорт каталога из CSV/JSONL любого размера.
+    Строки читаются пачками, Category/Product/ProductFeatures создаются и
+    обновляются через bulk_create/bulk_update - память не зависит от
+    размера файла.
+
+    Формат строки JSONL:
+        {"category": "notebooks", "category_name": "Ноутбуки",
+         "slug": "...", "title": "...", "price": "999.90",
+         "description": "...", "features": {"ram": "8", ...}}
+    В CSV те же колонки, характеристики - колонки feature:<имя фильтра>
+    """
+
+    help = 'Импорт товаров и характеристик из CSV/JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу, "-" - stdin')
+        parser.add_argument(
+            '--format', choices=('csv', 'jsonl'),
+            help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Кол-во строк в одной транзакции')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'csv' if path.endswith('.csv') else 'jsonl')
+
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        # (category_id, feature_filter_name) -> id характеристики
+        self.features = {}
+        # id характеристики -> единица (для ProductFeatures.numeric_value)
+        self.units = {}
+        features = CategoryFeature.objects.values_list(
+            'id', 'category_id', 'feature_filter_name', 'unit')
+        for pk, category_id, filter_name, unit in features:
+            self.features[(category_id, filter_name)] = pk
+            self.units[pk] = unit
+        # Допустимые значения характеристик (если валидаторы заданы)
+        self.valid_values = {}
+        for feature_id, value in FeatureValidator.objects.values_list(
+                'feature_key_id', 'valid_feature_value'):
+            self.valid_values.setdefault(feature_id, set()).add(value)
+
+        self.touched_categories = set()
+        self.stats = dict.fromkeys(
+            ('rows', 'created', 'updated', 'features', 'skipped',
+             'invalid_values'), 0)
+
+        try:
+            stream = sys.stdin if path == '-' else open(
+                path, encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(f'Не удалось открыть файл: {error}')
+        started = time.monotonic()
+        try:
+            rows = self.read_rows(stream, file_format)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    self.import_batch(batch)
+                self.stats['rows'] += len(batch)
+                self.report(started)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # bulk операции не вызывают сигналы => сбросить кэши вручную
+        invalidate_facet_index(*self.touched_categories)
+        invalidate_products()
+        if self.touched_categories:
+            # Счётчики товаров (и новых категорий) - одним GROUP BY
+            recount_category_products(self.touched_categories)
+            invalidate_categories()
+        self.report(started, final=True)
+
+    def read_rows(self, stream, file_format):
+        """Генератор строк в едином формате (dict с ключом features)"""
+        if file_format == 'jsonl':
+            for line_number, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    self.skip(line_number, 'неверный JSON')
+                    continue
+                if not isinstance(row, dict):
+                    self.skip(line_number, 'строка не объект JSON')
+                    continue
+                row['line'] = line_number
+                yield row
+            return
+
+        reader = csv.DictReader(stream)
+        for line_number, row in enumerate(reader, 2):
+            # Значения без заголовка DictReader кладёт под ключ None
+            if None in row:
+                self.skip(line_number, 'лишние колонки')
+                continue
+            features = {
+                key[len(CSV_FEATURE_PREFIX):]: value
+                for key, value in row.items()
+                if key.startswith(CSV_FEATURE_PREFIX) and value}
+            row = {key: value for key, value in row.items()
+                   if not key.startswith(CSV_FEATURE_PREFIX)}
+            row.update(features=features, line=line_number)
+            yield row
+
+    def skip(self, line_number, reason):
+        self.stats['skipped'] += 1
+        self.stderr.write(f'Строка {line_number}: {reason}')
+
+    def clean_price(self, value):
+        """Цена, которую примет Product.price, иначе None"""
+        try:
+            price = Decimal(str(value))
+            if not price.is_finite():
+                return None
+            price = price.quantize(PRICE_QUANTUM)
+        except InvalidOperation:
+            return None
+        if not 0 <= price < PRICE_LIMIT:
+            return None
+        return price
+
+    def clean_row(self, row):
+        """Проверить строку (изменяется на месте), вернуть причину пропуска"""
+        for field, (max_length, required) in ROW_STRING_FIELDS.items():
+            value = row.get(field)
+            if value in (None, ''):
+                if required:
+                    return 'нет slug, category или title'
+            elif not isinstance(value, str):
+                return f'{field} не строка'
+            elif max_length is not None and len(value) > max_length:
+                return f'{field} длиннее {max_length} символов'
+        features = row.get('features')
+        if features is None:
+            row['features'] = {}
+        elif not isinstance(features, dict):
+            return 'features не объект'
+        price = self.clean_price(row.get('price'))
+        if price is None:
+            return f'неверная цена {row.get("price")}'
+        row['price'] = price
+        return None
+
+    def clean_batch(self, batch):
+        """Проверить строки пачки, вернуть {slug: строка}"""
+        cleaned = {}
+        for row in batch:
+            reason = self.clean_row(row)
+            if reason is not None:
+                self.skip(row['line'], reason)
+                continue
+            # Повтор slug внутри пачки - побеждает последняя строка
+            cleaned[row['slug']] = row
+        return cleaned
+
+    def ensure_categories(self, rows):
+        """Создать отсутствующие категории одним bulk_create"""
+        missing = {}
+        for row in rows:
+            slug = row['category']
+            if slug not in self.categories:
+                missing[slug] = row.get('category_name') or slug
+        if missing:
+            Category.objects.bulk_create(
+                [Category(slug=slug, name=name)
+                 for slug, name in missing.items()])
+            self.categories.update(Category.objects.filter(
+                slug__in=missing).values_list('slug', 'id'))
+
+    def import_batch(self, batch):
+        rows = self.clean_batch(batch)
+        if not rows:
+            return
+        self.ensure_categories(rows.values())
+        now = timezone.now()
+
+        # Товары: обновить существующие, создать новые
+        existing = Product.objects.in_bulk(list(rows), field_name='slug')
+        to_update, to_create = [], []
+        moved = []
+        for slug, row in rows.items():
+            category_id = self.categories[row['category']]
+            self.touched_categories.add(category_id)
+            product = existing.get(slug) or Product(slug=slug)
+            if product.pk and product.category_id != category_id:
+                # Прежняя категория: её счётчик товаров тоже пересчитывается
+                # (recount_category_products), индекс фасетов сбрасывается
+                self.touched_categories.add(product.category_id)
+                moved.append(product.pk)
+            product.category_id = category_id
+            product.title = row['title']
+            product.description = row.get('description') or None
+            product.price = row['price']
+            product.updated_at = now
+            (to_update if product.pk else to_create).append(product)
+
+        Product.objects.bulk_update(to_update, PRODUCT_FIELDS + ('updated_at',))
+        Product.objects.bulk_create(to_create)
+        self.stats['updated'] += len(to_update)
+        self.stats['created'] += len(to_create)
+        if moved:
+            # Характеристики прежней категории товару больше не относятся
+            ProductFeatures.objects.filter(product_id__in=moved).exclude(
+                feature__category_id=F('product__category_id')).delete()
+
+        product_ids = dict(Product.objects.filter(
+            slug__in=list(rows)).values_list('slug', 'id'))
+        self.import_features(rows, product_ids)
+        index_products(Product.objects.filter(
+            id__in=product_ids.values()).only('id', 'title', 'description'))
+
+    def import_features(self, rows, product_ids):
+        """Upsert ProductFeatures для товаров пачки"""
+        existing = {
+            (feature.product_id, feature.feature_id): feature
+            for feature in ProductFeatures.objects.filter(
+                product_id__in=product_ids.values())
+        }
+        to_update, to_create = [], []
+        for slug, row in rows.items():
+            product_id = product_ids[slug]
+            category_id = self.categories[row['category']]
+            for filter_name, value in (row.get('features') or {}).items():
+                value = str(value)
+                feature_id = self.features.get((category_id, filter_name))
+                valid_values = self.valid_values.get(feature_id)
+                if feature_id is None or (
+                        valid_values is not None and value not in valid_values):
+                    self.stats['invalid_values'] += 1
+                    continue
+                feature = existing.get((product_id, feature_id))
+                # bulk операции не вызывают ProductFeatures.save
+                numeric_value = parse_numeric(value, self.units[feature_id])
+                if feature is None:
+                    to_create.append(ProductFeatures(
+                        product_id=product_id, feature_id=feature_id,
+                        value=value, numeric_value=numeric_value))
+                elif (feature.value != value
+                        or feature.numeric_value != numeric_value):
+                    feature.value = value
+                    feature.numeric_value = numeric_value
+                    to_update.append(feature)
+
+        ProductFeatures.objects.bulk_update(
+            to_update, ('value', 'numeric_value'))
+        ProductFeatures.objects.bulk_create(to_create)
+        self.stats['features'] += len(to_update) + len(to_create)
+
+    def report(self, started, final=False):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        stats = self.stats
+        message = (
+            f'Строк: {stats["rows"]} ({stats["rows"] / elapsed:.0f} строк/с), '
+            f'создано: {stats["created"]}, обновлено: {stats["updated"]}, '
+            f'характеристик: {stats["features"]}, '
+            f'пропущено строк: {stats["skipped"]}, '
+            f'отклонено значений характеристик: {stats["invalid_values"]}')
+        if final:
+            self.stdout.write(self.style.SUCCESS(
+                f'Импорт завершён за {elapsed:.1f} с. {message}'))
+        else:
+            self.stdout.write(message)
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from mainapp.payments import PAYMENT_EVENTS_BATCH_SIZE, process_payment_events
+
+
+class Command(BaseCommand):
+    """
+    Обработчик событий платёжной системы (PaymentEvent).
+    Без --once работает постоянно: обрабатывает пачки, пока есть события,
+    затем ждёт --interval секунд. Можно запускать несколько экземпляров
+    """
+
+    help = 'Проверить и применить события платёжной системы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=PAYMENT_EVENTS_BATCH_SIZE,
+            help='Кол-во событий в одной транзакции')
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Пауза, если событий нет, сек')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Обработать доступные события и завершиться')
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                close_old_connections()
+                processed = process_payment_events(options['batch_size'])
+                total += processed
+                if processed:
+                    self.stdout.write(f'Обработано событий: {processed}')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Всего обработано: {total}'))
@@ -0,0 +1,157 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from mainapp.models import Cart, CartProduct, Order
+
+CartLine = Cart.products.through
+PURGED_MODELS = (Cart, CartProduct, CartLine)
+
+
+def relation_size(model):
+    """
+    Размер таблицы вместе с индексами, байт (None, если БД не умеет
+    его сообщить)
+    """
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT pg_total_relation_size(%s)'
+    elif connection.vendor == 'sqlite':
+        sql = ('SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+               '(SELECT name FROM sqlite_master WHERE tbl_name = %s)')
+    else:
+        return None
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            return cursor.fetchone()[0]
+    except DatabaseError:  # SQLite без dbstat
+        return None
+
+
+class Command(BaseCommand):
+    """
+    Удаление брошенных корзин: не оформленных и не изменявшихся дольше
+    --days дней, вместе с их позициями. Также удаляются позиции, не
+    связанные ни с одной корзиной (Cart.products).
+    Корзины перебираются по id (keyset) пачками, каждая пачка удаляется
+    в отдельной короткой транзакции - таблицы надолго не блокируются
+    """
+
+    help = 'Удалить брошенные корзины и позиции без корзины'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help='Удалять корзины, не изменявшиеся дольше, дней')
+        parser.add_argument(
+            '--anonymous-only', action='store_true',
+            help='Только корзины неавторизованных пользователей')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Кол-во корзин (позиций) в одной транзакции')
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help='Пауза между пачками, сек (снизить нагрузку на БД)')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать, ничего не удалять')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--days >= 0, --batch-size >= 1')
+        self.options = options
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        carts = Cart.objects.filter(in_order=False, updated_at__lt=cutoff)
+        if options['anonymous_only']:
+            carts = carts.filter(for_anonymous_user=True)
+        # Корзину с заказом не удалять ни при каких условиях (каскад)
+        carts = carts.filter(~Exists(Order.objects.filter(cart=OuterRef('pk'))))
+
+        # Средний размер строки - для оценки освобождённого места
+        row_sizes = {}
+        for model in PURGED_MODELS:
+            size = relation_size(model)
+            rows = model.objects.count()
+            if size is not None and rows:
+                row_sizes[model._meta.label] = size / rows
+
+        started = time.monotonic()
+        deleted = {model._meta.label: 0 for model in PURGED_MODELS}
+        self.purge(carts, self.delete_carts, deleted)
+        self.purge(CartProduct.objects.all(), self.delete_orphan_lines,
+                   deleted)
+        elapsed = max(time.monotonic() - started, 1e-6)
+
+        total = sum(deleted.values())
+        reclaimed = sum(rows * row_sizes.get(label, 0)
+                        for label, rows in deleted.items())
+        prefix = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            f'{prefix}: корзин {deleted[Cart._meta.label]}, '
+            f'позиций {deleted[CartProduct._meta.label]}, '
+            f'связей {deleted[CartLine._meta.label]}')
+        self.stdout.write(
+            f'Строк: {total} за {elapsed:.1f} с ({total / elapsed:.0f} '
+            f'строк/с), место: ~{reclaimed / 1024 / 1024:.1f} МБ '
+            f'(по среднему размеру строки с индексами)')
+        if reclaimed and not options['dry_run'] and (
+                connection.vendor == 'sqlite'):
+            self.stdout.write(
+                'Место внутри файла БД будет переиспользовано, '
+                'уменьшить сам файл - VACUUM')
+
+    def purge(self, queryset, delete_batch, deleted):
+        """Keyset-перебор queryset по id, delete_batch(ids) на пачку"""
+        batch_size = self.options['batch_size']
+        last_id = 0
+        while True:
+            batch_ids = list(
+                queryset.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:batch_size])
+            if not batch_ids:
+                return
+            last_id = batch_ids[-1]
+            for label, rows in delete_batch(batch_ids).items():
+                deleted[label] = deleted.get(label, 0) + rows
+            if self.options['sleep']:
+                time.sleep(self.options['sleep'])
+
+    def delete_carts(self, batch_ids):
+        """
+        Удалить пачку корзин. Условия проверяются повторно под блокировкой:
+        корзину могли изменить или начать оформлять после выборки
+        """
+        cutoff = timezone.now() - timedelta(days=self.options['days'])
+        carts = Cart.objects.filter(
+            id__in=batch_ids, in_order=False, updated_at__lt=cutoff).filter(
+            ~Exists(Order.objects.filter(cart=OuterRef('pk'))))
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                # Корзины, занятые другими транзакциями, - в следующий раз
+                carts = Cart.objects.filter(id__in=list(
+                    carts.select_for_update(skip_locked=True)
+                    .values_list('id', flat=True)))
+            if self.options['dry_run']:
+                ids = list(carts.values_list('id', flat=True))
+                return {
+                    Cart._meta.label: len(ids),
+                    CartProduct._meta.label: CartProduct.objects.filter(
+                        cart_id__in=ids).count(),
+                    CartLine._meta.label: CartLine.objects.filter(
+                        cart_id__in=ids).count(),
+                }
+            return carts.delete()[1]
+
+    def delete_orphan_lines(self, batch_ids):
+        """Удалить позиции пачки, не входящие ни в одну корзину"""
+        lines = CartProduct.objects.filter(id__in=batch_ids).filter(
+            ~Exists(CartLine.objects.filter(cartproduct_id=OuterRef('pk'))))
+        with transaction.atomic():
+            if self.options['dry_run']:
+                return {CartProduct._meta.label: lines.count()}
+            return lines.delete()[1]
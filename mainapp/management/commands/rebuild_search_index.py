@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mainapp.models import Product
+from mainapp.search import get_search_backend, index_products
+
+
+class Command(BaseCommand):
+    """Полная перестройка полнотекстового индекса товаров"""
+
+    help = 'Перестроить поисковый индекс товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        products = Product.objects.only(
+            'id', 'title', 'description').order_by('id')
+        indexed = last_id = 0
+        with transaction.atomic():
+            get_search_backend().clear()
+            while True:
+                batch = list(
+                    products.filter(id__gt=last_id)[:options['batch_size']])
+                if not batch:
+                    break
+                index_products(batch)
+                last_id = batch[-1].id
+                indexed += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано товаров: {indexed}'))
@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from mainapp.cache import invalidate_product_images
+from mainapp.models import Product
+from mainapp.thumbnails import generate_thumbnails_safe
+
+
+class Command(BaseCommand):
+    """
+    Создание копий изображений для всех товаров пулом процессов.
+    Ресайз упирается в CPU, поэтому используются процессы, а не потоки
+    """
+
+    help = 'Создать уменьшенные копии изображений товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Кол-во процессов (по умолчанию - кол-во CPU)')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать уже существующие копии')
+        parser.add_argument('--chunk-size', type=int, default=16)
+
+    def handle(self, *args, **options):
+        names = list(
+            Product.objects.exclude(image='').exclude(image__isnull=True)
+            .values_list('image', flat=True).distinct())
+        # Рабочие процессы не используют БД - не передавать им соединения
+        connections.close_all()
+
+        started = time.monotonic()
+        created = 0
+        changed = []
+        with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                initializer=django.setup) as executor:
+            generate = partial(generate_thumbnails_safe, force=options['force'])
+            counts = executor.map(
+                generate, names, chunksize=options['chunk_size'])
+            for name, count in zip(names, counts):
+                created += count
+                if count:
+                    changed.append(name)
+        # Закэшированные карточки этих товаров выводят исходное изображение
+        invalidate_product_images(changed)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Изображений: {len(names)}, создано копий: {created} '
+            f'за {elapsed:.1f} с'))
@@ -0,0 +1,318 @@
+import functools
+import logging
+import mimetypes
+import os
+import posixpath
+import random
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from time import perf_counter
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.db import connections
+from django.http import FileResponse
+from django.template.base import Node, Template
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from .routers import primary_pinned, primary_written
+
+timing_logger = logging.getLogger('mainapp.timing')
+
+# Файлы с хэшем в имени не меняются - кэшировать на год
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Остальные файлы - проверять при каждом обращении (ответ 304)
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+# Кодировка -> расширение сжатой копии, в порядке предпочтения
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Cookie закрепления чтения за основной БД после записи
+PRIMARY_PIN_COOKIE = 'db_primary'
+
+
+def parse_accept_encoding(header):
+    """Кодировки из Accept-Encoding, допустимые для клиента (q > 0)"""
+    encodings = set()
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        quality = params.strip().replace(' ', '')
+        if quality in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if encoding:
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class StaticFilesMiddleware:
+    """
+    Отдача собранной статики (STATIC_ROOT) без внешнего веб-сервера.
+    Выбирает сжатую копию по Accept-Encoding, отвечает 304 на условные
+    запросы, для файлов из манифеста ставит кэширование 'immutable'.
+    Отсутствующие файлы передаются дальше (статика в режиме отладки)
+    """
+
+    def __init__(self, get_response):
+        if not settings.STATIC_ROOT or not settings.STATIC_URL.startswith('/'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.root = str(settings.STATIC_ROOT)
+        self.immutable_names = set(
+            getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if (request.method in ('GET', 'HEAD')
+                and request.path.startswith(self.prefix)):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def find_file(self, name, accepted):
+        """Путь к лучшей доступной копии файла и её кодировка"""
+        for encoding, extension in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            path = safe_join(self.root, name + extension)
+            if os.path.isfile(path):
+                return path, encoding
+        path = safe_join(self.root, name)
+        return (path, None) if os.path.isfile(path) else (None, None)
+
+    def serve(self, request, name):
+        name = posixpath.normpath(unquote(name)).lstrip('/')
+        if name.endswith(tuple(extension for _, extension in ENCODINGS)):
+            return None
+        accepted = parse_accept_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        try:
+            path, encoding = self.find_file(name, accepted)
+        except (SuspiciousFileOperation, ValueError):
+            # Путь за пределами STATIC_ROOT
+            return None
+        if path is None:
+            return None
+
+        stat = os.stat(path)
+        etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}-{encoding or "id"}"'
+        cache_control = (IMMUTABLE_CACHE_CONTROL if name in self.immutable_names
+                         else REVALIDATE_CACHE_CONTROL)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(stat.st_mtime))
+        if response is None:
+            content_type, _ = mimetypes.guess_type(name)
+            response = FileResponse(
+                open(path, 'rb'),
+                content_type=content_type or 'application/octet-stream')
+            del response['Content-Disposition']
+            if encoding:
+                response['Content-Encoding'] = encoding
+            response['Last-Modified'] = http_date(stat.st_mtime)
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+# Метрики текущего запроса (None - запрос не замеряется)
+request_timing = ContextVar('request_timing', default=None)
+
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+# Глубина поиска узла шаблона в стеке вызовов
+TEMPLATE_FRAME_DEPTH = 60
+
+
+class RequestTiming:
+    """Метрики одного запроса"""
+
+    def __init__(self):
+        self.queries = []  # (sql, сек, место в шаблоне или None)
+        self.template_time = 0.0
+        self.template_depth = 0
+        # Время SQL внутри рендера шаблонов (учитывается только в db)
+        self.template_db_time = 0.0
+
+    @property
+    def db_time(self):
+        return sum(duration for _, duration, _ in self.queries)
+
+
+def query_shape(sql):
+    """SQL без списков параметров и чисел - одинаковый для запросов N+1"""
+    return NUMBER_RE.sub('N', IN_LIST_RE.sub('(%s...)', sql))
+
+
+def template_location():
+    """'шаблон:строка' узла шаблона, который выполняет запрос"""
+    frame = sys._getframe(2)
+    for _ in range(TEMPLATE_FRAME_DEPTH):
+        if frame is None:
+            break
+        node = frame.f_locals.get('self')
+        # type(), а не isinstance(): isinstance загружает ленивые объекты
+        # (request.user), что само выполняет запросы
+        if issubclass(type(node), Node) and getattr(node, 'token', None):
+            origin = getattr(node, 'origin', None)
+            name = (origin.template_name or origin.name) if origin else '?'
+            return f'{name}:{node.token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+def record_query(execute, sql, params, many, context):
+    timing = request_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = perf_counter() - started
+        location = None
+        if timing.template_depth:
+            timing.template_db_time += duration
+            location = template_location()
+        timing.queries.append((sql, duration, location))
+
+
+def instrument_templates():
+    """
+    Учитывать время рендера шаблонов. Вне замеряемых запросов обёртка
+    только проверяет request_timing
+    """
+    if getattr(Template.render, 'timed', False):
+        return
+    original_render = Template.render
+
+    @functools.wraps(original_render)
+    def render(self, context):
+        timing = request_timing.get()
+        if timing is None:
+            return original_render(self, context)
+        timing.template_depth += 1
+        started = perf_counter()
+        try:
+            return original_render(self, context)
+        finally:
+            timing.template_depth -= 1
+            # Вложенные шаблоны (include) входят во время внешнего
+            if not timing.template_depth:
+                timing.template_time += perf_counter() - started
+
+    render.timed = True
+    Template.render = render
+
+
+class RequestTimingMiddleware:
+    """
+    Замер запросов: кол-во и время SQL, время шаблонов и представления.
+    Результат - журнал медленных запросов (логгер mainapp.timing),
+    предупреждения о повторяющихся запросах одного вида (возможный N+1)
+    с местом в шаблоне и заголовок Server-Timing (только при DEBUG или
+    для персонала: раскрывает устройство сайта). Замеряется доля запросов
+    REQUEST_TIMING_SAMPLE_RATE (0 - middleware отключается полностью)
+    """
+
+    def __init__(self, get_response):
+        self.sample_rate = settings.REQUEST_TIMING_SAMPLE_RATE
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = settings.REQUEST_TIMING_SLOW_MS
+        self.n_plus_one_threshold = settings.REQUEST_TIMING_N_PLUS_ONE_THRESHOLD
+        instrument_templates()
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timing = RequestTiming()
+        token = request_timing.set(timing)
+        started = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(record_query))
+                response = self.get_response(request)
+        finally:
+            request_timing.reset(token)
+        total = perf_counter() - started
+
+        db_time = timing.db_time
+        template_time = max(timing.template_time - timing.template_db_time, 0)
+        view_time = max(total - db_time - template_time, 0)
+        if self.show_server_timing(request):
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={db_time * 1000:.1f};'
+                f'desc="SQL: {len(timing.queries)}"',
+                f'tpl;dur={template_time * 1000:.1f}',
+                f'view;dur={view_time * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ))
+        if total * 1000 >= self.slow_ms:
+            timing_logger.warning(
+                'Медленный запрос %s %s: %.0f мс, SQL: %d (%.0f мс), '
+                'шаблоны: %.0f мс', request.method, request.path,
+                total * 1000, len(timing.queries), db_time * 1000,
+                template_time * 1000)
+        self.report_n_plus_one(request, timing)
+        return response
+
+    @staticmethod
+    def show_server_timing(request):
+        # request.user к этому моменту установлен AuthenticationMiddleware
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or bool(user and user.is_staff)
+
+    def report_n_plus_one(self, request, timing):
+        shapes = Counter(query_shape(sql) for sql, _, _ in timing.queries)
+        for shape, count in shapes.items():
+            if count < self.n_plus_one_threshold:
+                continue
+            locations = Counter(
+                location for sql, _, location in timing.queries
+                if location and query_shape(sql) == shape)
+            location = (locations.most_common(1)[0][0] if locations
+                        else 'вне шаблона')
+            timing_logger.warning(
+                'Возможный N+1 в %s %s: %d одинаковых запросов (%s): %s',
+                request.method, request.path, count, location, shape[:300])
+
+
+class PrimaryPinningMiddleware:
+    """
+    "Чтение своих записей" при чтении каталога с реплик (mainapp.routers).
+    После запроса с записью в БД (и после любого POST) клиент получает
+    cookie на REPLICA_PIN_SECONDS, пока она есть - каталог читается
+    с основной БД. Без реплик middleware отключается
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', ()):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = settings.REPLICA_PIN_SECONDS
+
+    def __call__(self, request):
+        pinned_token = primary_pinned.set(
+            PRIMARY_PIN_COOKIE in request.COOKIES)
+        written_token = primary_written.set(False)
+        try:
+            response = self.get_response(request)
+            written = primary_written.get()
+        finally:
+            primary_pinned.reset(pinned_token)
+            primary_written.reset(written_token)
+        if written or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE, '1', max_age=self.pin_seconds,
+                httponly=True, samesite='Lax')
+        return response
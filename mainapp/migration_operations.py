@@ -0,0 +1,71 @@
+"""
+Операции миграций для построения индексов без блокировки записи.
+На PostgreSQL индексы строятся CREATE INDEX CONCURRENTLY, на остальных
+БД - как обычные AddIndex/AddConstraint.
+CONCURRENTLY не выполняется внутри транзакции => у миграции с этими
+операциями должно быть atomic = False
+"""
+from django.db.migrations.operations import AddConstraint, AddIndex
+
+
+def _concurrently(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+class AddIndexConcurrently(AddIndex):
+    """AddIndex, на PostgreSQL - CREATE INDEX CONCURRENTLY"""
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if _concurrently(schema_editor):
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if _concurrently(schema_editor):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+    def describe(self):
+        return super().describe() + ' (concurrently)'
+
+
+class AddUniqueConstraintConcurrently(AddConstraint):
+    """
+    AddConstraint для UniqueConstraint по полям. На PostgreSQL уникальный
+    индекс строится CONCURRENTLY, затем становится ограничением
+    (ADD CONSTRAINT ... USING INDEX - короткая блокировка без проверки
+    таблицы)
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if not _concurrently(schema_editor):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state)
+        quote = schema_editor.quote_name
+        name = quote(self.constraint.name)
+        table = quote(model._meta.db_table)
+        columns = ', '.join(
+            quote(model._meta.get_field(field).column)
+            for field in self.constraint.fields)
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX CONCURRENTLY {name} ON {table} ({columns})')
+        schema_editor.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX '
+            f'{name}')
+
+    def describe(self):
+        return super().describe() + ' (concurrently)'
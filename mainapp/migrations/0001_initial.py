@@ -0,0 +1,129 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_products', models.PositiveIntegerField(default=0, verbose_name='Количество уникальных товаров')),
+                ('final_price', models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Общая цена')),
+                ('in_order', models.BooleanField(default=False, verbose_name='Корзина используется')),
+                ('for_anonymous_user', models.BooleanField(default=False, verbose_name='Пользователь авторизован')),
+            ],
+            options={
+                'verbose_name': 'Корзина',
+                'verbose_name_plural': 'Корзины',
+            },
+        ),
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Имя категории')),
+                ('slug', models.SlugField(unique=True)),
+            ],
+            options={
+                'verbose_name': 'Категория',
+                'verbose_name_plural': 'Категории',
+                'ordering': ('name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone', models.CharField(blank=True, max_length=20, null=True, verbose_name='Номер телефона')),
+                ('address', models.CharField(blank=True, max_length=255, null=True, verbose_name='Адрес')),
+            ],
+            options={
+                'verbose_name': 'Пользователь',
+                'verbose_name_plural': 'Пользователи',
+            },
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255, verbose_name='Наименование')),
+                ('description', models.TextField(null=True, verbose_name='Описание')),
+                ('image', models.ImageField(blank=True, null=True, upload_to='mainapp/images', verbose_name='Изображение товара')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Цена')),
+                ('slug', models.SlugField(unique=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Товар',
+                'verbose_name_plural': 'Товары',
+            },
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=60, verbose_name='Имя')),
+                ('last_name', models.CharField(max_length=60, verbose_name='Фамилия')),
+                ('phone', models.CharField(max_length=20, verbose_name='Телефон')),
+                ('address', models.CharField(blank=True, max_length=1024, null=True, verbose_name='Адрес')),
+                ('status', models.CharField(choices=[('new', 'Новый заказ'), ('in_progress', 'Заказ в обработке'), ('is_ready', 'Заказ готов'), ('completed', 'Заказ выполнен'), ('payed', 'Заказ оплачен')], default='new', max_length=15, verbose_name='Статус заказа')),
+                ('buying_type', models.CharField(choices=[('self', 'Самовывоз'), ('delivery', 'Доставка')], default='self', max_length=15, verbose_name='Тип заказа')),
+                ('comment', models.TextField(blank=True, null=True, verbose_name='Комментарий к заказу')),
+                ('created_at', models.DateTimeField(auto_now=True, verbose_name='Дата создания заказа')),
+                ('order_date', models.DateField(default=django.utils.timezone.now, verbose_name='Дата получения заказа')),
+                ('cart', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='mainapp.cart', verbose_name='Корзина')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_orders', to='mainapp.customer', verbose_name='Покупатель')),
+            ],
+            options={
+                'verbose_name': 'Заказ',
+                'verbose_name_plural': 'Заказы',
+            },
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='orders',
+            field=models.ManyToManyField(blank=True, related_name='related_customer', to='mainapp.Order', verbose_name='Заказы покупателя'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.CreateModel(
+            name='CartProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('qty', models.PositiveIntegerField(default=1, verbose_name='Количество')),
+                ('final_price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Общая цена')),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_products', to='mainapp.cart', verbose_name='Корзина')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.product', verbose_name='Товар')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.customer', verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Продуктовая корзина',
+                'verbose_name_plural': 'Продуктовые корзины',
+            },
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='owner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='mainapp.customer', verbose_name='Владелец'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='products',
+            field=models.ManyToManyField(blank=True, related_name='related_cart', to='mainapp.CartProduct', verbose_name='Продукты'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_existing_orders(apps, schema_editor):
+    """Снимки позиций для уже оформленных заказов"""
+    Order = apps.get_model('mainapp', 'Order')
+    OrderLine = apps.get_model('mainapp', 'OrderLine')
+    CartProduct = apps.get_model('mainapp', 'CartProduct')
+    cart_to_order = dict(
+        Order.objects.filter(cart__isnull=False).values_list('cart_id', 'id'))
+    batch = []
+    lines = CartProduct.objects.filter(
+        cart_id__in=list(cart_to_order)).select_related('product')
+    for line in lines.iterator():
+        batch.append(OrderLine(
+            order_id=cart_to_order[line.cart_id], product_id=line.product_id,
+            title=line.product.title, price=line.product.price,
+            qty=line.qty, final_price=line.final_price))
+        if len(batch) >= 1000:
+            OrderLine.objects.bulk_create(batch)
+            batch = []
+    OrderLine.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0002_cartproduct_user_nullable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255, verbose_name='Наименование')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Цена за единицу')),
+                ('qty', models.PositiveIntegerField(verbose_name='Количество')),
+                ('final_price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Общая цена')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='mainapp.order', verbose_name='Заказ')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='mainapp.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Позиция заказа',
+                'verbose_name_plural': 'Позиции заказов',
+            },
+        ),
+        migrations.RunPython(
+            snapshot_existing_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+# Выражения совпадают с PG_SEARCH_VECTOR/PG_TITLE_VECTOR в mainapp.search
+PG_SEARCH_INDEX = (
+    "CREATE INDEX IF NOT EXISTS mainapp_product_search_gin "
+    "ON mainapp_product USING GIN (("
+    "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'B')))")
+PG_TITLE_INDEX = (
+    "CREATE INDEX IF NOT EXISTS mainapp_product_title_gin "
+    "ON mainapp_product USING GIN (to_tsvector('simple', coalesce(title, '')))")
+SQLITE_FTS_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS mainapp_product_fts USING fts5("
+    "title, description, title_prefix, "
+    "tokenize = 'unicode61 remove_diacritics 2')")
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(PG_SEARCH_INDEX)
+        schema_editor.execute(PG_TITLE_INDEX)
+    elif vendor == 'sqlite':
+        # Таблица создаётся пустой: индекс существующих товаров строит
+        # rebuild_search_index тем же стеммером, что и поиск
+        # (предупреждение после migrate - mainapp.signals)
+        schema_editor.execute(SQLITE_FTS_TABLE)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS mainapp_product_search_gin')
+        schema_editor.execute('DROP INDEX IF EXISTS mainapp_product_title_gin')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS mainapp_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0004_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:07
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='Id события')),
+                ('event_type', models.CharField(max_length=100, verbose_name='Тип события')),
+                ('payload', models.TextField(verbose_name='Тело запроса')),
+                ('signature', models.CharField(blank=True, max_length=1024, verbose_name='Подпись')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает обработки'), ('processed', 'Обработано'), ('ignored', 'Не требует обработки'), ('failed', 'Ошибка')], default='pending', max_length=15, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Кол-во попыток обработки')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата обработки')),
+            ],
+            options={
+                'verbose_name': 'Событие платёжной системы',
+                'verbose_name_plural': 'События платёжной системы',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_intent_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True, verbose_name='Id платежа (PaymentIntent)'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='mainapp_pay_status_cf9b41_idx'),
+        ),
+    ]
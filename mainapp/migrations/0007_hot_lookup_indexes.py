@@ -0,0 +1,65 @@
+# Generated by Django 3.2.6 on 2026-10-18 21:15
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+from mainapp.migration_operations import (
+    AddIndexConcurrently, AddUniqueConstraintConcurrently)
+
+
+def merge_duplicate_cart_products(apps, schema_editor):
+    """
+    Слить повторные позиции одного товара в корзине (гонки get_or_create)
+    в позицию с наименьшим id и пересчитать итоги затронутых корзин
+    """
+    Cart = apps.get_model('mainapp', 'Cart')
+    CartProduct = apps.get_model('mainapp', 'CartProduct')
+    duplicates = CartProduct.objects.values('cart_id', 'product_id').annotate(
+        lines=Count('id'), first_id=Min('id'), qty_sum=Sum('qty'),
+        price_sum=Sum('final_price')).filter(lines__gt=1)
+    cart_ids = set()
+    for row in duplicates:
+        CartProduct.objects.filter(id=row['first_id']).update(
+            qty=row['qty_sum'], final_price=row['price_sum'])
+        CartProduct.objects.filter(
+            cart_id=row['cart_id'], product_id=row['product_id']).exclude(
+            id=row['first_id']).delete()
+        cart_ids.add(row['cart_id'])
+    for cart in Cart.objects.filter(id__in=cart_ids):
+        totals = cart.products.aggregate(
+            models.Sum('final_price'), models.Count('id'))
+        cart.final_price = totals['final_price__sum'] or 0
+        cart.total_products = totals['id__count']
+        cart.save(update_fields=('final_price', 'total_products'))
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY (PostgreSQL) - вне транзакции
+    atomic = False
+
+    dependencies = [
+        ('mainapp', '0006_payment_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_cart_products, migrations.RunPython.noop,
+            atomic=True),
+        AddIndexConcurrently(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('in_order', False)), fields=['owner'], name='cart_owner_open_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('for_anonymous_user', True), ('in_order', False)), fields=['id'], name='cart_anonymous_open_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['customer', '-created_at', '-id'], name='order_customer_created_idx'),
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='cartproduct',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartproduct_cart_product_uniq'),
+        ),
+    ]
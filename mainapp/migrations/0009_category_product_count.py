@@ -0,0 +1,37 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_category_products(apps, schema_editor):
+    """Заполнить счётчики одним GROUP BY запросом"""
+    Category = apps.get_model('mainapp', 'Category')
+    CategoryProductCount = apps.get_model('mainapp', 'CategoryProductCount')
+    counts = Category.objects.order_by().annotate(
+        models.Count('product')).values_list('id', 'product__count')
+    CategoryProductCount.objects.bulk_create(
+        CategoryProductCount(category_id=category_id, count=count)
+        for category_id, count in counts)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0008_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryProductCount',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='product_counter', serialize=False, to='mainapp.category', verbose_name='Категория')),
+                ('count', models.IntegerField(default=0, verbose_name='Кол-во товаров')),
+            ],
+            options={
+                'verbose_name': 'Счётчик товаров категории',
+                'verbose_name_plural': 'Счётчики товаров категорий',
+            },
+        ),
+        migrations.RunPython(
+            count_category_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0009_category_product_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='payment_intent_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Id платежа'),
+        ),
+    ]
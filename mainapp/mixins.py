@@ -1,25 +1,16 @@
 from django.views.generic import View
 
-from .models import Cart, Customer
+from .cart import LazyCart
 
 
 class CartMixin(View):
-    """Генерация новой корзины либо поиск уже имеющейся"""
+    """
+    Корзина запроса. Загружается из БД только при обращении к ней,
+    id корзины и её итоги хранятся в сессии
+    """
 
     def dispatch(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            customer = Customer.objects.filter(user=request.user).first()
-            if not customer:  # создание нового пользователя
-                customer = Customer.objects.create(user=request.user)
-
-            # Процесс поиска или создания корзины
-            cart = Cart.objects.filter(owner=customer, in_order=False).first()
-            if not cart:  # создание новой
-                cart = Cart.objects.create(owner=customer)
-        else:  # корзина для неавторизованного пользователя (заглушка)
-            cart = Cart.objects.filter(for_anonymous_user=True).first()
-            if not cart:  # создание новой
-                cart = Cart.objects.create(for_anonymous_user=True)
-
-        self.cart = cart
-        return super(CartMixin, self).dispatch(request, *args, **kwargs)
+        self.cart = LazyCart(request)
+        response = super(CartMixin, self).dispatch(request, *args, **kwargs)
+        self.cart.save_to_session()
+        return response
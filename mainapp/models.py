@@ -30,6 +30,26 @@ class Category(models.Model):
         ordering = ('name',)
 
 
+class CategoryProductCount(models.Model):
+    """
+    Счётчик товаров категории. Меняется на +-1 при создании, удалении
+    и смене категории товара (mainapp.signals), полный пересчёт -
+    utils.recount_category_products. Отдельная таблица => изменение
+    категории в админке не перезаписывает счётчик
+    """
+    category = models.OneToOneField(
+        Category, verbose_name='Категория', primary_key=True,
+        related_name='product_counter', on_delete=models.CASCADE)
+    count = models.IntegerField(verbose_name='Кол-во товаров', default=0)
+
+    def __str__(self):
+        return f'{self.category_id}: {self.count}'
+
+    class Meta:
+        verbose_name = 'Счётчик товаров категории'
+        verbose_name_plural = 'Счётчики товаров категорий'
+
+
 class Product(models.Model):
     """Товар"""
 
@@ -43,6 +63,10 @@ class Product(models.Model):
     price = models.DecimalField(
         verbose_name='Цена', max_digits=9, decimal_places=2)
     slug = models.SlugField(unique=True)
+    # Меняется при любом изменении товара и его характеристик (specs).
+    # Используется для ETag/Last-Modified и инвалидации кэша
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения', auto_now=True)
 
     def get_model_name(self):
         return self.__class__.__name__.lower()
@@ -63,8 +87,10 @@ class CartProduct(models.Model):
     Продуктовая корзина - промежуточный объект.
     Объект который положим в корзину.
     """
+    # Пусто для позиций анонимной корзины
     user = models.ForeignKey(
-        'Customer', verbose_name='Пользователь', on_delete=models.CASCADE)
+        'Customer', verbose_name='Пользователь', on_delete=models.CASCADE,
+        null=True, blank=True)
     cart = models.ForeignKey(
         'Cart', verbose_name='Корзина', on_delete=models.CASCADE,
         related_name='related_products')
@@ -85,6 +111,14 @@ class CartProduct(models.Model):
     class Meta:
         verbose_name = 'Продуктовая корзина'
         verbose_name_plural = 'Продуктовые корзины'
+        # Один товар - одна позиция корзины (в т.ч. анонимной, где user
+        # пуст). Индекс ограничения используется и поиском позиции
+        # по (user, cart, product)
+        constraints = [
+            models.UniqueConstraint(
+                fields=('cart', 'product'),
+                name='cartproduct_cart_product_uniq'),
+        ]
 
 
 class Cart(models.Model):
@@ -104,17 +138,45 @@ class Cart(models.Model):
     # -телем и её может использовать, в дальнейшем, только данный пользователь
     in_order = models.BooleanField(
         verbose_name='Корзина используется', default=False)
-    # Корзина 'заглушка' для неавторизованных пользователей => код не ломается
+    # Корзина неавторизованного пользователя. Своя для каждой сессии,
+    # id хранится в сессии и при входе сливается с корзиной покупателя
     for_anonymous_user = models.BooleanField(
         verbose_name='Пользователь авторизован', default=False)
+    # Дата последнего изменения состава корзины. Неоформленные корзины,
+    # которые давно не менялись, удаляет команда purge_carts
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения', auto_now=True)
+    # Текущий PaymentIntent корзины (payments.get_payment_intent). В БД,
+    # а не только в кэше - заказ с оплатой онлайн без него не создаётся
+    payment_intent_id = models.CharField(
+        verbose_name='Id платежа', max_length=255, null=True, blank=True)
 
     def __str__(self):
         return 'Корзина №{}, владелец {}'.format(
             str(self.id), self.owner)
 
+    def get_lines(self):
+        """
+        Позиции корзины вместе с товарами для вывода в шаблоне.
+        Один запрос, независимо от кол-ва позиций (url изображения
+        строится из имени файла, без обращения к БД)
+        """
+        return list(
+            self.products.select_related('product').order_by('id'))
+
     class Meta:
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
+        # Частичные индексы только по неоформленным корзинам: условие
+        # in_order=False Django записывает как NOT "in_order", по такому
+        # условию обычный индекс (owner, in_order) SQLite не использует
+        indexes = [
+            models.Index(fields=('owner',), condition=models.Q(in_order=False),
+                         name='cart_owner_open_idx'),
+            models.Index(fields=('id',), condition=models.Q(
+                for_anonymous_user=True, in_order=False),
+                name='cart_anonymous_open_idx'),
+        ]
 
 
 class Customer(models.Model):
@@ -163,6 +225,14 @@ class Order(models.Model):
         (BUYING_TYPE_DELIVERY, 'Доставка'),
     )
 
+    # Допустимые переходы: новый статус -> статусы, из которых он возможен
+    STATUS_TRANSITIONS = {
+        STATUS_PAYED: (STATUS_NEW,),
+        STATUS_IN_PROGRESS: (STATUS_NEW, STATUS_PAYED),
+        STATUS_READY: (STATUS_IN_PROGRESS,),
+        STATUS_COMPLETED: (STATUS_READY,),
+    }
+
     cart = models.ForeignKey(
         Cart, verbose_name='Корзина', on_delete=models.CASCADE,
         null=True, blank=True)
@@ -182,18 +252,138 @@ class Order(models.Model):
         default=BUYING_TYPE_SELF)
     comment = models.TextField(
         verbose_name='Комментарий к заказу', null=True, blank=True)
+    # auto_now_add: ключ страниц истории заказов (get_keyset_page)
+    # не должен меняться при смене статуса
     created_at = models.DateTimeField(
-        verbose_name='Дата создания заказа', auto_now=True)
+        verbose_name='Дата создания заказа', auto_now_add=True)
     order_date = models.DateField(
         verbose_name='Дата получения заказа', default=timezone.now)
+    # Заказ с онлайн оплатой становится оплаченным по событию платёжной
+    # системы (PaymentEvent), а не по запросу браузера
+    payment_intent_id = models.CharField(
+        verbose_name='Id платежа (PaymentIntent)', max_length=255,
+        null=True, blank=True, db_index=True)
 
     def __str__(self):
         return 'Заказ №{}, от пользователя {}'.format(
             str(self.id), self.customer)
 
+    # Итоги заказа - по снимкам позиций OrderLine, а не по корзине: цены
+    # товаров могут измениться после заказа. Используют prefetch_related
+    # ('lines'), если он был
+    @property
+    def total_products(self):
+        return sum(line.qty for line in self.lines.all())
+
+    @property
+    def final_price(self):
+        return sum(line.final_price for line in self.lines.all())
+
+    @classmethod
+    def transition(cls, queryset, status):
+        """
+        Перевести заказы в статус одним UPDATE. Заказы, для которых переход
+        недопустим (в т.ч. уже в этом статусе), не меняются => повторный
+        вызов безопасен. Вернуть кол-во изменённых заказов
+        """
+        return queryset.filter(
+            status__in=cls.STATUS_TRANSITIONS[status]).update(status=status)
+
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        # Заказы покупателя в профиле (get_keyset_page)
+        indexes = [
+            models.Index(fields=('customer', '-created_at', '-id'),
+                         name='order_customer_created_idx'),
+        ]
+
+
+class OrderLine(models.Model):
+    """
+    Позиция заказа. Неизменяемый снимок позиции корзины на момент заказа:
+    история заказов не меняется при изменении цены или удалении товара
+    """
+    order = models.ForeignKey(
+        Order, verbose_name='Заказ', on_delete=models.CASCADE,
+        related_name='lines')
+    product = models.ForeignKey(
+        Product, verbose_name='Товар', on_delete=models.SET_NULL,
+        null=True, blank=True)
+    title = models.CharField(verbose_name='Наименование', max_length=255)
+    price = models.DecimalField(
+        verbose_name='Цена за единицу', max_digits=9, decimal_places=2)
+    qty = models.PositiveIntegerField(verbose_name='Количество')
+    final_price = models.DecimalField(
+        verbose_name='Общая цена', max_digits=9, decimal_places=2)
+
+    @classmethod
+    def snapshot(cls, order, cart, lines=None):
+        """
+        Скопировать позиции корзины в заказ (два запроса).
+        lines - уже выбранные позиции с товарами (по умолчанию все позиции)
+        """
+        lines = cart.get_lines() if lines is None else lines
+        return cls.objects.bulk_create([
+            cls(order=order, product=line.product, title=line.product.title,
+                price=line.product.price, qty=line.qty,
+                final_price=line.final_price)
+            for line in lines
+        ])
+
+    def __str__(self):
+        return '{} x {} (заказ №{})'.format(self.title, self.qty, self.order_id)
+
+    class Meta:
+        verbose_name = 'Позиция заказа'
+        verbose_name_plural = 'Позиции заказов'
+
+
+class PaymentEvent(models.Model):
+    """
+    Событие платёжной системы (webhook). При приёме событие только
+    записывается, проверку подписи и изменение заказов выполняет
+    команда process_payment_events пачками
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSED = 'processed'
+    STATUS_IGNORED = 'ignored'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Ожидает обработки'),
+        (STATUS_PROCESSED, 'Обработано'),
+        (STATUS_IGNORED, 'Не требует обработки'),
+        (STATUS_FAILED, 'Ошибка'),
+    )
+
+    event_id = models.CharField(
+        verbose_name='Id события', max_length=255, unique=True)
+    event_type = models.CharField(verbose_name='Тип события', max_length=100)
+    # Исходное тело запроса - подпись проверяется по нему
+    payload = models.TextField(verbose_name='Тело запроса')
+    signature = models.CharField(
+        verbose_name='Подпись', max_length=1024, blank=True)
+    status = models.CharField(
+        verbose_name='Статус', max_length=15, choices=STATUS_CHOICES,
+        default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(
+        verbose_name='Кол-во попыток обработки', default=0)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    received_at = models.DateTimeField(
+        verbose_name='Дата получения', auto_now_add=True)
+    next_attempt_at = models.DateTimeField(
+        verbose_name='Следующая попытка', default=timezone.now)
+    processed_at = models.DateTimeField(
+        verbose_name='Дата обработки', null=True, blank=True)
+
+    def __str__(self):
+        return 'Событие {} ({})'.format(self.event_id, self.event_type)
+
+    class Meta:
+        verbose_name = 'Событие платёжной системы'
+        verbose_name_plural = 'События платёжной системы'
+        indexes = [models.Index(fields=('status', 'next_attempt_at'))]
 
 # Функционал ниже реализован в отдельном приложении 'specs'
 # class ProductFeatures(models.Model):
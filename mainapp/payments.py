@@ -0,0 +1,440 @@
+"""
+Онлайн оплата. Платёжный шлюз подключается настройкой PAYMENT_GATEWAY:
+StripeGateway - Stripe, FakeGateway - локальная заглушка без сети
+(разработка, нагрузочное тестирование, генератор событий для тестов).
+
+PaymentIntent создаётся один раз на корзину и сумму и хранится в кэше,
+его id - в корзине (Cart.payment_intent_id).
+Повторная загрузка страницы оформления переиспользует его, при изменении
+суммы существующий PaymentIntent обновляется. Обращение к шлюзу выполняется
+в фоновом потоке - страница не ждёт ответа платёжной системы.
+
+События платёжной системы (webhook) только записываются в PaymentEvent,
+проверяет и применяет их пачками process_payment_events
+"""
+import hashlib
+import hmac
+import json
+import logging
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Lock, RLock
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Cart, Order, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_INTENT_CACHE_KEY = 'mainapp:payment_intent:{}'
+# Счётчик попыток создать/изменить PaymentIntent корзины
+PAYMENT_INTENT_REVISION_KEY = 'mainapp:payment_intent_revision:{}'
+# Ключи идемпотентности Stripe хранятся 24 часа
+PAYMENT_INTENT_CACHE_TIMEOUT = 60 * 60 * 24
+PAYMENT_CURRENCY = 'rub'
+# Сколько ждать ответа шлюза при запросе client_secret со страницы, сек
+PAYMENT_INTENT_WAIT_TIMEOUT = 15
+
+PAYMENT_SUCCEEDED_EVENT = 'payment_intent.succeeded'
+PAYMENT_EVENTS_BATCH_SIZE = 100
+# Событие об оплате может прийти раньше, чем браузер создаст заказ -
+# такие события обрабатываются повторно с растущей задержкой
+PAYMENT_EVENT_MAX_ATTEMPTS = 8
+PAYMENT_EVENT_RETRY_DELAY = 5
+
+# Статусы, после которых PaymentIntent нельзя использовать для оплаты
+PAYMENT_INTENT_FINAL_STATUSES = ('succeeded', 'canceled')
+
+PaymentIntent = namedtuple(
+    'PaymentIntent', ('id', 'client_secret', 'amount', 'status'))
+
+
+class PaymentGatewayError(Exception):
+    """Ошибка платёжного шлюза"""
+
+
+class PaymentGateway:
+    """Интерфейс платёжного шлюза. Суммы - целые числа в копейках"""
+
+    def create_intent(self, amount, currency, idempotency_key, metadata=None):
+        raise NotImplementedError
+
+    def update_intent(self, intent_id, amount, idempotency_key):
+        raise NotImplementedError
+
+    def retrieve_intent(self, intent_id):
+        raise NotImplementedError
+
+    def parse_event(self, payload, signature):
+        """
+        Проверить подпись события (формат заголовка Stripe-Signature)
+        и вернуть его данные. Время подписи не проверяется - событие
+        могло долго ждать в очереди, повторы отсекает уникальный id события
+        """
+        try:
+            stripe.WebhookSignature.verify_header(
+                payload, signature, settings.PAYMENT_WEBHOOK_SECRET)
+            return json.loads(payload)
+        except (stripe.error.SignatureVerificationError, ValueError) as error:
+            raise PaymentGatewayError(str(error)) from error
+
+
+class StripeGateway(PaymentGateway):
+
+    def __init__(self):
+        self.api_key = settings.STRIPE_SECRET_KEY
+
+    @staticmethod
+    def _to_intent(intent):
+        return PaymentIntent(
+            intent.id, intent.client_secret, intent.amount, intent.status)
+
+    def create_intent(self, amount, currency, idempotency_key, metadata=None):
+        try:
+            return self._to_intent(stripe.PaymentIntent.create(
+                api_key=self.api_key, idempotency_key=idempotency_key,
+                amount=amount, currency=currency, metadata=metadata or {}))
+        except stripe.error.StripeError as error:
+            raise PaymentGatewayError(str(error)) from error
+
+    def update_intent(self, intent_id, amount, idempotency_key):
+        try:
+            return self._to_intent(stripe.PaymentIntent.modify(
+                intent_id, api_key=self.api_key,
+                idempotency_key=idempotency_key, amount=amount))
+        except stripe.error.StripeError as error:
+            raise PaymentGatewayError(str(error)) from error
+
+    def retrieve_intent(self, intent_id):
+        try:
+            return self._to_intent(stripe.PaymentIntent.retrieve(
+                intent_id, api_key=self.api_key))
+        except stripe.error.StripeError as error:
+            raise PaymentGatewayError(str(error)) from error
+
+
+class FakeGateway(PaymentGateway):
+    """
+    Шлюз в памяти процесса. Повторяет идемпотентность Stripe:
+    повторный запрос с тем же ключом возвращает тот же результат
+    """
+
+    def __init__(self):
+        self.intents = {}
+        self.responses = {}
+        self.calls = 0
+        self._lock = Lock()
+
+    def _idempotent(self, idempotency_key, operation):
+        with self._lock:
+            self.calls += 1
+            if idempotency_key not in self.responses:
+                self.responses[idempotency_key] = operation()
+            return self.responses[idempotency_key]
+
+    def create_intent(self, amount, currency, idempotency_key, metadata=None):
+        def create():
+            intent_id = f'pi_fake_{uuid.uuid4().hex[:24]}'
+            intent = PaymentIntent(
+                intent_id, f'{intent_id}_secret_{uuid.uuid4().hex[:16]}',
+                amount, 'requires_payment_method')
+            self.intents[intent_id] = intent
+            return intent
+        return self._idempotent(idempotency_key, create)
+
+    def update_intent(self, intent_id, amount, idempotency_key):
+        def update():
+            intent = self.intents.get(intent_id)
+            if intent is None or intent.status == 'succeeded':
+                raise PaymentGatewayError(
+                    f'PaymentIntent {intent_id} не может быть изменён')
+            intent = intent._replace(amount=amount)
+            self.intents[intent_id] = intent
+            return intent
+        return self._idempotent(idempotency_key, update)
+
+    def retrieve_intent(self, intent_id):
+        with self._lock:
+            self.calls += 1
+            if intent_id not in self.intents:
+                raise PaymentGatewayError(f'PaymentIntent {intent_id} не найден')
+            return self.intents[intent_id]
+
+    def make_event(self, intent_id, event_type=PAYMENT_SUCCEEDED_EVENT):
+        """
+        Событие webhook для PaymentIntent, подписанное так же, как его
+        подписывает Stripe. Вернуть (тело запроса, заголовок подписи)
+        """
+        if event_type == PAYMENT_SUCCEEDED_EVENT and intent_id in self.intents:
+            with self._lock:
+                self.intents[intent_id] = self.intents[intent_id]._replace(
+                    status='succeeded')
+        payload = json.dumps({
+            'id': f'evt_fake_{uuid.uuid4().hex[:24]}',
+            'type': event_type,
+            'data': {'object': {'id': intent_id, 'object': 'payment_intent'}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(
+            settings.PAYMENT_WEBHOOK_SECRET.encode(),
+            f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return payload, f't={timestamp},v1={signature}'
+
+
+_gateway = None
+_gateway_lock = Lock()
+
+
+def get_payment_gateway():
+    """Шлюз из настройки PAYMENT_GATEWAY (один экземпляр на процесс)"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = import_string(settings.PAYMENT_GATEWAY)()
+        return _gateway
+
+
+def reset_payment_gateway():
+    """Создать шлюз заново при следующем обращении (смена настроек, тесты)"""
+    global _gateway
+    with _gateway_lock:
+        _gateway = None
+
+
+def cart_amount(cart):
+    """Сумма корзины в копейках (Stripe принимает только int)"""
+    return int(cart.final_price * 100)
+
+
+def next_intent_revision(cart_id):
+    """
+    Номер новой попытки изменить PaymentIntent корзины - часть ключа
+    идемпотентности. Ключ с суммой без номера повторялся бы при возврате
+    к прежней сумме (A -> B -> A -> B), и Stripe вернул бы сохранённый
+    ответ вместо изменения. После вытеснения счётчик начинается
+    от текущего времени => номера не повторяются
+    """
+    key = PAYMENT_INTENT_REVISION_KEY.format(cart_id)
+    cache.add(key, int(time.time() * 1000), PAYMENT_INTENT_CACHE_TIMEOUT)
+    try:
+        return cache.incr(key)
+    except ValueError:  # ключ вытеснен между add и incr
+        revision = int(time.time() * 1000)
+        cache.set(key, revision, PAYMENT_INTENT_CACHE_TIMEOUT)
+        return revision
+
+
+def _load_stored_intent(gateway, cart_id):
+    """
+    (id из Cart.payment_intent_id, PaymentIntent или None). None - если
+    его нет в шлюзе, либо он уже оплачен или отменён
+    """
+    intent_id = Cart.objects.filter(pk=cart_id).values_list(
+        'payment_intent_id', flat=True).first()
+    if not intent_id:
+        return None, None
+    try:
+        intent = gateway.retrieve_intent(intent_id)
+    except PaymentGatewayError:
+        return intent_id, None
+    if intent.status in PAYMENT_INTENT_FINAL_STATUSES:
+        return intent_id, None
+    return intent_id, intent
+
+
+def _update_intent(gateway, cart_id, intent_id, amount):
+    """Изменить сумму PaymentIntent. None - изменить нельзя (оплачен)"""
+    revision = next_intent_revision(cart_id)
+    try:
+        return gateway.update_intent(
+            intent_id, amount, f'{intent_id}-{revision}-{amount}')
+    except PaymentGatewayError:
+        return None
+
+
+def get_payment_intent(cart_id, amount):
+    """
+    PaymentIntent для корзины и суммы. Сначала из кэша процесса, затем
+    сохранённый в корзине (кэш у каждого процесса свой и может быть
+    вытеснен), при другой сумме - обновление существующего, иначе создание
+    нового. Ключ идемпотентности уникален для попытки: повтор запроса
+    к шлюзу (сетевая ошибка) не создаёт лишний PaymentIntent, а новая
+    попытка не получает сохранённый ответ старой
+    """
+    key = PAYMENT_INTENT_CACHE_KEY.format(cart_id)
+    gateway = get_payment_gateway()
+    current = cache.get(key)
+    if current is not None and current.amount == amount:
+        return current
+    if current is None:
+        stored_id, current = _load_stored_intent(gateway, cart_id)
+    else:
+        stored_id = current.id
+
+    intent = None
+    if current is not None and current.amount == amount:
+        intent = current
+    elif current is not None:
+        intent = _update_intent(gateway, cart_id, current.id, amount)
+    if intent is None:
+        intent = gateway.create_intent(
+            amount, PAYMENT_CURRENCY,
+            f'cart-{cart_id}-{next_intent_revision(cart_id)}-{amount}',
+            metadata={'cart_id': cart_id})
+        # Условная запись: если другой процесс уже сохранил свой
+        # PaymentIntent, используется он, иначе браузер и заказ получили бы
+        # разные id и событие об оплате не нашло бы заказ
+        updated = Cart.objects.filter(
+            pk=cart_id, payment_intent_id=stored_id).update(
+            payment_intent_id=intent.id)
+        if not updated:
+            _, stored = _load_stored_intent(gateway, cart_id)
+            if stored is not None and stored.amount != amount:
+                stored = _update_intent(gateway, cart_id, stored.id, amount)
+            if stored is not None:
+                intent = stored
+    cache.set(key, intent, PAYMENT_INTENT_CACHE_TIMEOUT)
+    return intent
+
+
+def forget_payment_intent(cart_id):
+    """Удалить PaymentIntent корзины из кэша (корзина оформлена)"""
+    cache.delete(PAYMENT_INTENT_CACHE_KEY.format(cart_id))
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.PAYMENT_GATEWAY_WORKERS,
+    thread_name_prefix='payments')
+# (id корзины, сумма) -> Future выполняемого запроса к шлюзу
+_pending = {}
+# RLock: callback может выполниться сразу, ещё под блокировкой
+_pending_lock = RLock()
+
+
+def _run_in_worker(function, *args):
+    """
+    Выполнить функцию в потоке пула. Соединения с БД потока закрываются
+    так же, как в конце запроса: по CONN_MAX_AGE и после ошибок
+    """
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+def _forget_pending(request_key):
+    with _pending_lock:
+        _pending.pop(request_key, None)
+
+
+def prepare_payment_intent(cart_id, amount):
+    """
+    Запустить получение PaymentIntent в фоне и сразу вернуть Future.
+    Одновременные запросы для одной корзины и суммы ждут один Future
+    """
+    request_key = (cart_id, amount)
+    with _pending_lock:
+        future = _pending.get(request_key)
+        if future is None:
+            future = _executor.submit(
+                _run_in_worker, get_payment_intent, cart_id, amount)
+            _pending[request_key] = future
+            future.add_done_callback(lambda _: _forget_pending(request_key))
+    return future
+
+
+def wait_payment_intent(cart_id, amount, timeout=PAYMENT_INTENT_WAIT_TIMEOUT):
+    """
+    Дождаться PaymentIntent, запущенного prepare_payment_intent.
+    Любая ошибка фоновой задачи (в т.ч. БД) - PaymentGatewayError
+    """
+    try:
+        return prepare_payment_intent(cart_id, amount).result(timeout)
+    except FutureTimeoutError:
+        raise PaymentGatewayError('Платёжная система не ответила вовремя')
+    except PaymentGatewayError:
+        raise
+    except Exception as error:
+        logger.exception('Ошибка получения PaymentIntent корзины %s', cart_id)
+        raise PaymentGatewayError('Не удалось подготовить оплату') from error
+
+
+def enqueue_payment_event(payload, signature):
+    """
+    Записать событие webhook в очередь. Повторная доставка того же события
+    игнорируется. Вернуть False, если тело запроса не похоже на событие
+    """
+    try:
+        data = json.loads(payload)
+        event_id, event_type = str(data['id']), str(data['type'])
+    except (ValueError, KeyError, TypeError):
+        return False
+    PaymentEvent.objects.bulk_create([PaymentEvent(
+        event_id=event_id, event_type=event_type, payload=payload,
+        signature=signature)], ignore_conflicts=True)
+    return True
+
+
+def process_payment_events(batch_size=PAYMENT_EVENTS_BATCH_SIZE):
+    """
+    Проверить и применить пачку ожидающих событий в одной транзакции.
+    Несколько обработчиков не мешают друг другу (SKIP LOCKED).
+    Вернуть кол-во взятых в обработку событий
+    """
+    gateway = get_payment_gateway()
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            PaymentEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=PaymentEvent.STATUS_PENDING,
+                    next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size])
+        # id PaymentIntent -> события об успешной оплате
+        payments = {}
+        for event in events:
+            event.attempts += 1
+            try:
+                data = gateway.parse_event(event.payload, event.signature)
+                if data.get('type') == PAYMENT_SUCCEEDED_EVENT:
+                    intent_id = data['data']['object']['id']
+                    payments.setdefault(intent_id, []).append(event)
+                else:
+                    event.status = PaymentEvent.STATUS_IGNORED
+            except (PaymentGatewayError, KeyError, TypeError) as error:
+                event.status = PaymentEvent.STATUS_FAILED
+                event.error = f'Неверное событие: {error}'
+
+        if payments:
+            orders = Order.objects.filter(payment_intent_id__in=payments)
+            Order.transition(orders, Order.STATUS_PAYED)
+            known_intents = set(
+                orders.values_list('payment_intent_id', flat=True))
+            for intent_id, intent_events in payments.items():
+                for event in intent_events:
+                    if intent_id in known_intents:
+                        event.status = PaymentEvent.STATUS_PROCESSED
+                    elif event.attempts >= PAYMENT_EVENT_MAX_ATTEMPTS:
+                        event.status = PaymentEvent.STATUS_FAILED
+                        event.error = f'Нет заказа для платежа {intent_id}'
+                    else:
+                        event.error = 'Заказ для платежа ещё не создан'
+                        event.next_attempt_at = now + timedelta(
+                            seconds=PAYMENT_EVENT_RETRY_DELAY
+                            * 2 ** (event.attempts - 1))
+
+        for event in events:
+            if event.status != PaymentEvent.STATUS_PENDING:
+                event.processed_at = now
+        PaymentEvent.objects.bulk_update(events, (
+            'status', 'attempts', 'error', 'next_attempt_at', 'processed_at'))
+    return len(events)
@@ -0,0 +1,111 @@
+"""
+Маршрутизация запросов между основной БД и репликами.
+Чтение каталога (Category, Product, приложение specs) выполняется
+на репликах (settings.DATABASE_REPLICAS), всё остальное (корзины,
+заказы, сессии) и любая запись - на основной БД.
+
+"Чтение своих записей": после записи чтение каталога закрепляется
+за основной БД до конца запроса, а PrimaryPinningMiddleware продлевает
+закрепление на settings.REPLICA_PIN_SECONDS через cookie.
+Реплика, отстающая больше чем на settings.REPLICA_MAX_LAG секунд,
+не используется
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Модели, которые читаются с реплик: 'app_label' либо 'app_label.model'
+REPLICA_MODELS = ('mainapp.category', 'mainapp.product', 'specs')
+# Как часто проверять отставание реплики, сек
+REPLICA_LAG_CHECK_INTERVAL = 1.0
+
+# Чтение закреплено за основной БД: недавно была запись (cookie)
+primary_pinned = ContextVar('primary_pinned', default=False)
+# Была запись в текущем запросе (либо в потоке вне запроса)
+primary_written = ContextVar('primary_written', default=False)
+
+# alias -> (время проверки, отставание в секундах)
+_replica_lag = {}
+
+PG_REPLICA_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(
+            EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+
+def pin_primary():
+    """Закрепить чтение за основной БД (до конца запроса)"""
+    primary_written.set(True)
+
+
+def measure_replica_lag(alias):
+    """
+    Отставание реплики, сек. Для SQLite (локально реплика - та же БД
+    под другим алиасом) всегда 0. Недоступная реплика - бесконечность
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(PG_REPLICA_LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError:
+        connection.close()
+        return float('inf')
+
+
+class PrimaryReplicaRouter:
+    """Роутер БД: каталог - с реплик, остальное - основная БД"""
+
+    def replicas(self):
+        return getattr(settings, 'DATABASE_REPLICAS', ())
+
+    def replica_lag(self, alias):
+        """Отставание реплики с кэшированием на REPLICA_LAG_CHECK_INTERVAL"""
+        now = time.monotonic()
+        checked_at, lag = _replica_lag.get(alias, (None, None))
+        if checked_at is None or now - checked_at > REPLICA_LAG_CHECK_INTERVAL:
+            lag = measure_replica_lag(alias)
+            _replica_lag[alias] = (now, lag)
+        return lag
+
+    def is_replicated(self, model):
+        opts = model._meta
+        return (opts.app_label in REPLICA_MODELS
+                or opts.label_lower in REPLICA_MODELS)
+
+    def db_for_read(self, model, **hints):
+        if (not self.is_replicated(model) or primary_pinned.get()
+                or primary_written.get()):
+            return DEFAULT_DB_ALIAS
+        # В транзакции основной БД читать то же, что видит транзакция
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        max_lag = getattr(settings, 'REPLICA_MAX_LAG', None)
+        replicas = [
+            alias for alias in self.replicas()
+            if max_lag is None or self.replica_lag(alias) <= max_lag]
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная БД
+        databases = {DEFAULT_DB_ALIAS, *self.replicas()}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит с основной БД
+        return db not in self.replicas()
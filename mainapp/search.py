@@ -0,0 +1,180 @@
+"""
+Полнотекстовый поиск товаров.
+SQLite - виртуальная таблица FTS5 с основами слов (stemmer.py),
+PostgreSQL - tsvector с конфигурацией 'russian' и GIN индексом по выражению
+"""
+from django.db import connection
+
+from .cache import LRUCache, bump_version, get_version
+from .models import Product
+from .stemmer import stem_text, tokenize
+
+SEARCH_VERSION_KEY = 'mainapp:search:version'
+AUTOCOMPLETE_LIMIT = 10
+SEARCH_LIMIT = 50
+
+# Подсказки для популярных префиксов, ключ - (версия индекса, префикс)
+autocomplete_cache = LRUCache(maxsize=1024)
+
+FTS_TABLE = 'mainapp_product_fts'
+# Выражения должны совпадать с выражениями GIN индексов в миграции
+PG_SEARCH_VECTOR = (
+    "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'B')")
+PG_TITLE_VECTOR = "to_tsvector('simple', coalesce(title, ''))"
+
+
+class SQLiteSearchBackend:
+    """Поиск через FTS5. Индекс обновляется при сохранении товара"""
+
+    def index_products(self, products):
+        rows = [
+            (product.id, stem_text(product.title),
+             stem_text(product.description), ' '.join(tokenize(product.title)))
+            for product in products
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, '
+                f'title_prefix) VALUES (%s, %s, %s, %s)', rows)
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(pk,) for pk in product_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def needs_rebuild(self):
+        """Индекс пуст, а товары есть (например, после миграции)"""
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT 1 FROM {FTS_TABLE} LIMIT 1')
+            indexed = cursor.fetchone() is not None
+        return not indexed and Product.objects.exists()
+
+    def search(self, query, limit):
+        terms = stem_text(query).split()
+        if not terms:
+            return []
+        # Каждое слово в кавычках => спецсимволы FTS5 не интерпретируются.
+        # Совпадение в названии весит больше, чем в описании
+        match = ' '.join(f'"{term}"' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, 10.0, 1.0, 0.0) LIMIT %s',
+                [match, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+    def autocomplete(self, prefix, limit):
+        terms = tokenize(prefix)
+        if not terms:
+            return []
+        match = ' '.join(f'"{term}"' for term in terms[:-1])
+        match = f'title_prefix : ({match} "{terms[-1]}"*)'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY rank LIMIT %s', [match, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """
+    Поиск через tsvector. GIN индексы по выражениям обновляются самой БД,
+    отдельное обслуживание индекса не требуется
+    """
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def needs_rebuild(self):
+        return False
+
+    def search(self, query, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id FROM mainapp_product, '
+                f"plainto_tsquery('russian', %s) AS query "
+                f'WHERE ({PG_SEARCH_VECTOR}) @@ query '
+                f'ORDER BY ts_rank({PG_SEARCH_VECTOR}, query) DESC, id '
+                f'LIMIT %s', [query, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+    def autocomplete(self, prefix, limit):
+        terms = tokenize(prefix)
+        if not terms:
+            return []
+        # Слова содержат только \w => безопасно для to_tsquery
+        query = ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id FROM mainapp_product '
+                f"WHERE {PG_TITLE_VECTOR} @@ to_tsquery('simple', %s) "
+                f'ORDER BY title LIMIT %s', [query, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SQLiteSearchBackend()
+
+
+def _products_by_ids(product_ids, queryset=None):
+    """Товары в порядке релевантности"""
+    queryset = Product.objects.all() if queryset is None else queryset
+    products = queryset.in_bulk(product_ids)
+    return [products[pk] for pk in product_ids if pk in products]
+
+
+def search_products(query, limit=SEARCH_LIMIT, queryset=None):
+    """Товары, отсортированные по релевантности"""
+    return _products_by_ids(
+        get_search_backend().search(query, limit), queryset)
+
+
+def autocomplete(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """Подсказки по началу названия: [{'title', 'slug', 'url'}]"""
+    prefix = ' '.join(tokenize(prefix))
+    key = (get_version(SEARCH_VERSION_KEY), prefix, limit)
+    suggestions = autocomplete_cache.get(key)
+    if suggestions is None:
+        products = _products_by_ids(
+            get_search_backend().autocomplete(prefix, limit),
+            Product.objects.only('id', 'title', 'slug'))
+        suggestions = [
+            {'title': product.title, 'slug': product.slug,
+             'url': product.get_absolute_url()}
+            for product in products
+        ]
+        autocomplete_cache.set(key, suggestions)
+    return suggestions
+
+
+def search_index_needs_rebuild():
+    """Нужно выполнить rebuild_search_index"""
+    return get_search_backend().needs_rebuild()
+
+
+def index_products(products):
+    """Обновить индекс для товаров (после сохранения или bulk импорта)"""
+    get_search_backend().index_products(products)
+    bump_version(SEARCH_VERSION_KEY)
+
+
+def remove_products(product_ids):
+    get_search_backend().remove_products(product_ids)
+    bump_version(SEARCH_VERSION_KEY)
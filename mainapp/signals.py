@@ -0,0 +1,131 @@
+import logging
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete, post_migrate, post_save, pre_save)
+from django.dispatch import receiver
+
+from .cache import (
+    invalidate_categories, invalidate_product_images, invalidate_products)
+from .cart import (
+    CART_SESSION_KEY, get_customer, get_customer_cart, merge_carts,
+    store_cart_in_session)
+from .models import Cart, Category, CategoryProductCount, Product
+from .search import (
+    index_products, remove_products, search_index_needs_rebuild)
+from .thumbnails import generate_thumbnails_safe
+from .utils import change_category_product_count
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_categories_cache(sender, instance, **kwargs):
+    """Сброс кэша навигации (в т.ч. NewCategoryView и CategoryAPIView)"""
+    invalidate_categories()
+
+
+@receiver(post_save, sender=Category)
+def create_category_counter(sender, instance, created, **kwargs):
+    if created:
+        CategoryProductCount.objects.get_or_create(category=instance)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, **kwargs):
+    """
+    Запомнить прежние категорию и изображение товара: для счётчиков
+    товаров и индекса фасетов (specs) прежней категории, и чтобы
+    создавать копии только для нового изображения
+    """
+    instance._old_category_id = instance._old_image = None
+    if instance.pk:
+        instance._old_category_id, instance._old_image = (
+            Product.objects.filter(pk=instance.pk).values_list(
+                'category_id', 'image').first() or (None, None))
+
+
+@receiver(post_save, sender=Product)
+def count_category_product(sender, instance, created, **kwargs):
+    old_category_id = getattr(instance, '_old_category_id', None)
+    if created:
+        change_category_product_count(instance.category_id, 1)
+    elif old_category_id and old_category_id != instance.category_id:
+        change_category_product_count(old_category_id, -1)
+        change_category_product_count(instance.category_id, 1)
+    else:
+        return
+    invalidate_categories()
+
+
+@receiver(post_delete, sender=Product)
+def uncount_category_product(sender, instance, **kwargs):
+    change_category_product_count(instance.category_id, -1)
+    invalidate_categories()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_products_cache(sender, instance, **kwargs):
+    invalidate_products()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Обновить полнотекстовый индекс товара"""
+    index_products([instance])
+
+
+@receiver(post_save, sender=Product)
+def create_product_thumbnails(sender, instance, **kwargs):
+    """
+    Копии нового изображения - после коммита и только при смене
+    изображения (существующие копии не пересоздаются)
+    """
+    image_name = instance.image.name
+    if image_name and image_name != getattr(instance, '_old_image', None):
+        def generate():
+            if generate_thumbnails_safe(image_name):
+                invalidate_product_images([image_name])
+
+        transaction.on_commit(generate)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+@receiver(post_migrate)
+def check_search_index(sender, app_config, using, **kwargs):
+    """
+    Миграция создаёт пустой индекс (0005) - напомнить о его наполнении,
+    если в каталоге уже есть товары
+    """
+    if app_config.label == 'mainapp' and using == 'default' and (
+            search_index_needs_rebuild()):
+        logger.warning(
+            'Поисковый индекс товаров пуст: выполните '
+            'manage.py rebuild_search_index')
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """
+    Слить анонимную корзину сессии с корзиной покупателя при входе.
+    Корзина покупателя сохраняется в сессии и без анонимной корзины -
+    иначе на новом устройстве шапка показывает пустую корзину
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    cart_id = request.session.pop(CART_SESSION_KEY, {}).get('id')
+    cart = get_customer_cart(get_customer(user))
+    anonymous_cart = None
+    if cart_id:
+        anonymous_cart = Cart.objects.filter(
+            id=cart_id, owner__isnull=True, in_order=False).first()
+    if anonymous_cart is not None:
+        merge_carts(anonymous_cart, cart)
+    store_cart_in_session(request.session, cart)
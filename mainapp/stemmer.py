@@ -0,0 +1,130 @@
+"""
+Стеммер для русского языка (алгоритм Snowball/Porter).
+Используется полнотекстовым поиском на SQLite, где FTS5 не умеет
+морфологию русского языка. На PostgreSQL стемминг выполняет
+конфигурация 'russian'
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (
+    ('в', 'вши', 'вшись'),
+    ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'),
+)
+REFLEXIVE = ((), ('ся', 'сь'))
+ADJECTIVE = ((), (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им',
+    'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая',
+    'яя', 'ою', 'ею'))
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет',
+     'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй',
+     'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют',
+     'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+NOUN = ((), (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я'))
+DERIVATIONAL = ((), ('ост', 'ость'))
+SUPERLATIVE = ((), ('ейш', 'ейше'))
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+
+def _strip(word, endings):
+    """
+    Удалить самое длинное из окончаний. Окончания первой группы
+    должны следовать за 'а' или 'я' (сама буква остаётся).
+    Вернуть слово без окончания или None
+    """
+    after_a, plain = endings
+    for ending in sorted(after_a + plain, key=len, reverse=True):
+        if not word.endswith(ending):
+            continue
+        stem = word[:-len(ending)]
+        if ending in plain:
+            return stem
+        if stem.endswith(('а', 'я')):
+            return stem
+        return None
+    return None
+
+
+def _regions(word):
+    """Начала областей RV и R2"""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def stem(word):
+    """Основа русского слова"""
+    word = word.lower().replace('ё', 'е')
+    rv, r2 = _regions(word)
+    prefix, rest = word[:rv], word[rv:]
+
+    # Шаг 1
+    stemmed = _strip(rest, PERFECTIVE_GERUND)
+    if stemmed is None:
+        reflexive = _strip(rest, REFLEXIVE)
+        if reflexive is not None:
+            rest = reflexive
+        adjective = _strip(rest, ADJECTIVE)
+        if adjective is not None:
+            stemmed = _strip(adjective, PARTICIPLE)
+            stemmed = adjective if stemmed is None else stemmed
+        else:
+            stemmed = _strip(rest, VERB)
+            if stemmed is None:
+                stemmed = _strip(rest, NOUN)
+        stemmed = rest if stemmed is None else stemmed
+    rest = stemmed
+
+    # Шаг 2
+    if rest.endswith('и'):
+        rest = rest[:-1]
+
+    # Шаг 3 (окончание должно лежать в R2)
+    derivational = _strip(rest, DERIVATIONAL)
+    if derivational is not None and len(prefix) + len(derivational) >= r2:
+        rest = derivational
+
+    # Шаг 4
+    if rest.endswith('нн'):
+        rest = rest[:-1]
+    else:
+        superlative = _strip(rest, SUPERLATIVE)
+        if superlative is not None:
+            rest = superlative[:-1] if superlative.endswith(
+                'нн') else superlative
+        elif rest.endswith('ь'):
+            rest = rest[:-1]
+    return prefix + rest
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре, 'ё' заменена на 'е'"""
+    return WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def stem_text(text):
+    """Текст из основ слов (латиница и числа не изменяются)"""
+    return ' '.join(
+        stem(token) if CYRILLIC_RE.search(token) else token
+        for token in tokenize(text))
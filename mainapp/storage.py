@@ -0,0 +1,62 @@
+"""
+Хранилище статики: имена файлов с хэшем содержимого (манифест)
+и заранее сжатые копии .gz/.br, которые отдаёт StaticFilesMiddleware
+"""
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Расширение копии -> функция сжатия
+COMPRESSORS = {'.gz': lambda content: gzip.compress(content, 9, mtime=0)}
+if brotli is not None:
+    COMPRESSORS['.br'] = lambda content: brotli.compress(
+        content, quality=11)
+
+COMPRESSIBLE_EXTENSIONS = (
+    '.css', '.js', '.map', '.svg', '.json', '.xml', '.txt', '.html', '.ttf',
+    '.eot', '.ico')
+# Файлы меньше этого размера не сжимаются - выигрыш меньше заголовков
+MIN_COMPRESS_SIZE = 256
+# Сжатая копия сохраняется, только если она заметно меньше оригинала
+MAX_COMPRESS_RATIO = 0.95
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Сжимаются и исходные имена, и имена с хэшем
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        for extension, compressor in COMPRESSORS.items():
+            compressed = compressor(content)
+            compressed_name = name + extension
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            if len(compressed) <= len(content) * MAX_COMPRESS_RATIO:
+                self._save(compressed_name, ContentFile(compressed))
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Статика ещё не собрана (разработка, тесты) - исходное имя
+            if self.hashed_files:
+                raise
+            return name
@@ -0,0 +1,83 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from specs.models import ProductFeatures
+
+register = template.Library()
+
+PRODUCT_SPEC_CACHE_KEY = 'mainapp:product_spec:{}:{}'
+PRODUCT_SPEC_CACHE_TIMEOUT = 60 * 60 * 24
+PRODUCT_SPEC_TEMPLATE = 'mainapp/include/product_specification.html'
+
+
+def spec_cache_key(product):
+    """
+    Ключ HTML характеристик товара. updated_at меняется при изменении
+    характеристик товара (specs.signals) => старый ключ просто истекает
+    """
+    updated_at = product.updated_at.timestamp() if product.updated_at else 0
+    return PRODUCT_SPEC_CACHE_KEY.format(product.pk, updated_at)
+
+
+def display_value(value, unit):
+    """Значение с единицей, если единица ещё не указана в значении"""
+    if unit and unit.lower() not in value.lower():
+        return f'{value} {unit}'
+    return value
+
+
+def load_specifications(products):
+    """Характеристики товаров одним запросом: {id товара: [(имя, значение)]}"""
+    specifications = {product.pk: [] for product in products}
+    rows = ProductFeatures.objects.filter(
+        product_id__in=list(specifications)).order_by(
+        'product_id', 'feature_id').values_list(
+        'product_id', 'feature__feature_name', 'value', 'feature__unit')
+    for product_id, name, value, unit in rows:
+        specifications[product_id].append((name, display_value(value, unit)))
+    return specifications
+
+
+def render_specification(product, specification):
+    html = render_to_string(
+        PRODUCT_SPEC_TEMPLATE, {'specification': specification})
+    cache.set(spec_cache_key(product), html, PRODUCT_SPEC_CACHE_TIMEOUT)
+    return html
+
+
+def prefetch_specifications(products):
+    """
+    Подготовить HTML характеристик для списка товаров перед выводом
+    {% product_spec %}: закэшированное берётся одним get_many, для
+    остальных товаров характеристики загружаются одним запросом
+    """
+    products = list(products)
+    keys = {spec_cache_key(product): product for product in products}
+    cached = cache.get_many(list(keys))
+    missing = [product for key, product in keys.items() if key not in cached]
+    specifications = load_specifications(missing) if missing else {}
+    for key, product in keys.items():
+        if key in cached:
+            product._specification_html = cached[key]
+        else:
+            product._specification_html = render_specification(
+                product, specifications[product.pk])
+    return products
+
+
+@register.simple_tag
+def product_spec(product):
+    """
+    Таблица характеристик товара (specs) с единицами измерения.
+    Для списков товаров вызвать prefetch_specifications, иначе -
+    кэш либо один запрос на товар
+    """
+    html = getattr(product, '_specification_html', None)
+    if html is None:
+        html = cache.get(spec_cache_key(product))
+    if html is None:
+        html = render_specification(
+            product, load_specifications([product])[product.pk])
+    return mark_safe(html)
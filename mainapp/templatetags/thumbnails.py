@@ -0,0 +1,37 @@
+from django import template
+from django.utils.html import format_html
+
+from mainapp.thumbnails import (
+    THUMBNAIL_WIDTHS, thumbnail_url, thumbnails_exist)
+
+register = template.Library()
+
+
+def _srcset(image_name, extension):
+    return ', '.join(
+        f'{thumbnail_url(image_name, width, extension)} {width}w'
+        for width in THUMBNAIL_WIDTHS)
+
+
+@register.simple_tag
+def responsive_image(image, css_class='', sizes='100vw', alt=''):
+    """
+    <picture> с копиями изображения: WebP для поддерживающих браузеров,
+    JPEG - для остальных. Браузер выбирает ширину по sizes.
+    Пока копий нет (не созданы либо ошибка создания) - исходное изображение
+    """
+    if not image:
+        return ''
+    if not thumbnails_exist(image.name):
+        return format_html(
+            '<img class="{}" src="{}" alt="{}" loading="lazy">',
+            css_class, image.url, alt)
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img class="{}" src="{}" srcset="{}" sizes="{}" alt="{}" '
+        'loading="lazy">'
+        '</picture>',
+        _srcset(image.name, 'webp'), sizes,
+        css_class, thumbnail_url(image.name, THUMBNAIL_WIDTHS[-1], 'jpg'),
+        _srcset(image.name, 'jpg'), sizes, alt)
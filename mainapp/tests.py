@@ -0,0 +1,1470 @@
+import gzip
+import json
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .benchmarks import (
+    AUTHENTICATED_SCENARIOS, SCENARIOS, create_buyer, create_catalog,
+    run_scenario)
+from .middleware import (
+    IMMUTABLE_CACHE_CONTROL, PRIMARY_PIN_COOKIE, REVALIDATE_CACHE_CONTROL,
+    PrimaryPinningMiddleware, StaticFilesMiddleware)
+from . import feeds
+from .api.api_views import CustomersListAPIView
+from .cache import (
+    CATEGORIES_VERSION_KEY, LRUCache, bump_version, get_categories,
+    get_version, invalidate_product_images, local_categories)
+from .cart import merge_carts
+from .models import (
+    Cart, CartProduct, Category, CategoryProductCount, Customer, Order,
+    OrderLine, PaymentEvent, Product)
+from .payments import (
+    PaymentGatewayError, get_payment_gateway, get_payment_intent,
+    process_payment_events, reset_payment_gateway, wait_payment_intent)
+from .routers import PrimaryReplicaRouter, primary_pinned, primary_written
+from .search import (
+    autocomplete_cache, get_search_backend, search_index_needs_rebuild)
+from .signals import check_search_index
+from .stemmer import stem, stem_text
+from .templatetags.specifications import prefetch_specifications
+from .thumbnails import generate_thumbnails, thumbnail_name
+from .utils import (
+    CartAlreadyOrderedError, CartUpdateConflictError, add_to_cart,
+    change_cart_qty, get_keyset_page, place_order, recount_category_products,
+    remove_from_cart)
+from specs.facets import get_facet_index
+from specs.models import CategoryFeature, ProductFeatures
+
+
+class CartQueryBudgetTest(TestCase):
+    """Кол-во запросов страницы корзины не зависит от кол-ва позиций"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        Product.objects.bulk_create([
+            Product(category=cls.category, title=f'Товар {i}', price=10,
+                    slug=f'product-{i}', image='mainapp/images/product.jpg')
+            for i in range(200)
+        ])
+        cls.products = list(Product.objects.order_by('id'))
+
+    def fill_cart(self, count):
+        """Анонимная корзина сессии клиента с count позициями"""
+        self.client.get('/cart/')  # создать корзину сессии
+        cart = Cart.objects.get(id=self.client.session['cart']['id'])
+        CartProduct.objects.bulk_create([
+            CartProduct(cart=cart, product=product, final_price=product.price)
+            for product in self.products[:count]
+        ])
+        cart.products.add(*CartProduct.objects.filter(cart=cart))
+        cart.total_products = count
+        cart.save()
+        return cart
+
+    def count_queries(self, url):
+        self.client.get(url)  # синхронизировать итоги корзины в сессии
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_cart_page_queries_are_constant(self):
+        self.fill_cart(1)
+        one_line = self.count_queries('/cart/')
+
+        self.client.cookies.clear()
+        self.fill_cart(200)
+        self.assertEqual(self.count_queries('/cart/'), one_line)
+        response = self.client.get('/cart/')
+        self.assertEqual(len(response.context['cart_lines']), 200)
+
+
+@override_settings(PAYMENT_GATEWAY='mainapp.payments.FakeGateway')
+class PaymentEventsTest(TestCase):
+    """Webhook только ставит событие в очередь, заказ меняет обработчик"""
+
+    def setUp(self):
+        reset_payment_gateway()
+        self.addCleanup(reset_payment_gateway)
+        self.gateway = get_payment_gateway()
+        user = User.objects.create_user('buyer')
+        self.customer = Customer.objects.create(user=user, phone='123')
+        self.intent = self.gateway.create_intent(1000, 'rub', 'cart-1-1000')
+
+    def create_order(self, intent_id):
+        return Order.objects.create(
+            customer=self.customer, first_name='Имя', last_name='Фамилия',
+            phone='123', payment_intent_id=intent_id)
+
+    def post_event(self, payload, signature):
+        return self.client.post(
+            '/payments/webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature)
+
+    def test_webhook_enqueues_and_worker_marks_order_payed(self):
+        order = self.create_order(self.intent.id)
+        payload, signature = self.gateway.make_event(self.intent.id)
+        self.assertEqual(self.post_event(payload, signature).status_code, 200)
+        # Повторная доставка того же события не создаёт дубль
+        self.post_event(payload, signature)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_NEW)
+
+        self.assertEqual(process_payment_events(), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_PAYED)
+        self.assertEqual(
+            PaymentEvent.objects.get().status, PaymentEvent.STATUS_PROCESSED)
+
+    def test_repeated_payment_does_not_roll_back_status(self):
+        order = self.create_order(self.intent.id)
+        self.post_event(*self.gateway.make_event(self.intent.id))
+        process_payment_events()
+        Order.transition(Order.objects.filter(id=order.id),
+                         Order.STATUS_IN_PROGRESS)
+
+        self.post_event(*self.gateway.make_event(self.intent.id))
+        process_payment_events()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_IN_PROGRESS)
+
+    def test_invalid_signature_is_rejected(self):
+        order = self.create_order(self.intent.id)
+        payload, _ = self.gateway.make_event(self.intent.id)
+        self.post_event(payload, 't=1,v1=forged')
+        process_payment_events()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_NEW)
+        self.assertEqual(
+            PaymentEvent.objects.get().status, PaymentEvent.STATUS_FAILED)
+
+    def test_event_before_order_is_retried(self):
+        self.post_event(*self.gateway.make_event(self.intent.id))
+        process_payment_events()
+        event = PaymentEvent.objects.get()
+        self.assertEqual(event.status, PaymentEvent.STATUS_PENDING)
+        self.assertGreater(event.next_attempt_at, timezone.now())
+
+        order = self.create_order(self.intent.id)
+        PaymentEvent.objects.update(next_attempt_at=timezone.now())
+        process_payment_events()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_PAYED)
+
+
+@override_settings(PAYMENT_GATEWAY='mainapp.payments.FakeGateway')
+class PaymentIntentTest(TestCase):
+    """PaymentIntent корзины следует за суммой корзины"""
+
+    def setUp(self):
+        cache.clear()
+        reset_payment_gateway()
+        self.addCleanup(reset_payment_gateway)
+        self.gateway = get_payment_gateway()
+
+    def test_amount_returning_to_previous_value(self):
+        intent = get_payment_intent(1, 1000)
+        for amount in (2000, 1000, 2000):
+            cached = get_payment_intent(1, amount)
+            self.assertEqual(cached.id, intent.id)
+            self.assertEqual(cached.amount, amount)
+            self.assertEqual(self.gateway.intents[intent.id].amount, amount)
+        self.assertEqual(len(self.gateway.intents), 1)
+
+    def test_paid_intent_is_replaced(self):
+        intent = get_payment_intent(1, 1000)
+        self.gateway.make_event(intent.id)
+        new_intent = get_payment_intent(1, 2000)
+        self.assertNotEqual(new_intent.id, intent.id)
+        self.assertEqual(get_payment_intent(1, 1000).id, new_intent.id)
+        self.assertEqual(self.gateway.intents[new_intent.id].amount, 1000)
+
+    def login_with_cart(self):
+        user = User.objects.create_user('buyer', first_name='Имя')
+        customer = Customer.objects.create(user=user, phone='123')
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        product = Product.objects.create(
+            category=category, title='Ноутбук', slug='notebook', price=100,
+            image='mainapp/images/product.jpg')
+        cart = Cart.objects.create(owner=customer)
+        add_to_cart(cart, product)
+        self.client.force_login(user)
+        return cart
+
+    def test_cache_miss_uses_intent_from_db(self):
+        cart = self.login_with_cart()
+        intent = get_payment_intent(cart.id, 1000)
+        # Другой воркер: в его кэше PaymentIntent нет
+        cache.clear()
+        self.assertEqual(get_payment_intent(cart.id, 1000), intent)
+        cache.clear()
+        updated = get_payment_intent(cart.id, 2000)
+        self.assertEqual((updated.id, updated.amount), (intent.id, 2000))
+        self.assertEqual(len(self.gateway.intents), 1)
+
+        self.gateway.intents[intent.id] = updated._replace(status='canceled')
+        cache.clear()
+        new_intent = get_payment_intent(cart.id, 2000)
+        self.assertNotEqual(new_intent.id, intent.id)
+        self.assertEqual(
+            Cart.objects.get(id=cart.id).payment_intent_id, new_intent.id)
+
+    def test_concurrent_create_keeps_stored_intent(self):
+        cart = self.login_with_cart()
+        other = self.gateway.create_intent(1000, 'rub', 'other-worker')
+        create_intent = self.gateway.create_intent
+
+        def create_after_other_worker(*args, **kwargs):
+            # Другой воркер успел сохранить свой PaymentIntent
+            Cart.objects.filter(pk=cart.id).update(payment_intent_id=other.id)
+            return create_intent(*args, **kwargs)
+
+        with mock.patch.object(
+                self.gateway, 'create_intent', create_after_other_worker):
+            intent = get_payment_intent(cart.id, 2000)
+        self.assertEqual((intent.id, intent.amount), (other.id, 2000))
+        self.assertEqual(
+            Cart.objects.get(id=cart.id).payment_intent_id, other.id)
+
+    def test_worker_closes_old_connections(self):
+        worker = mock.Mock()
+        worker.get_payment_intent.return_value = 'intent'
+        with mock.patch('mainapp.payments.close_old_connections',
+                        worker.close_old_connections):
+            with mock.patch('mainapp.payments.get_payment_intent',
+                            worker.get_payment_intent):
+                self.assertEqual(wait_payment_intent(2, 1000), 'intent')
+        self.assertEqual(
+            [call[0] for call in worker.mock_calls],
+            ['close_old_connections', 'get_payment_intent',
+             'close_old_connections'])
+
+    def test_worker_errors_become_gateway_errors(self):
+        cart = self.login_with_cart()
+        with mock.patch('mainapp.payments.get_payment_intent',
+                        side_effect=DatabaseError('нет соединения')):
+            with self.assertLogs('mainapp.payments', 'ERROR'):
+                with self.assertRaises(PaymentGatewayError):
+                    wait_payment_intent(cart.id, 1000)
+                response = self.client.get(reverse('payment_intent'))
+        self.assertEqual(response.status_code, 502)
+
+    def test_online_order_uses_intent_from_db(self):
+        cart = self.login_with_cart()
+        intent = get_payment_intent(cart.id, 10000)
+        # Кэш процесса потерял PaymentIntent (вытеснение, другой воркер)
+        cache.clear()
+        response = self.client.post('/payed-online-order/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            Order.objects.get(cart=cart).payment_intent_id, intent.id)
+
+    def test_online_order_without_intent_is_rejected(self):
+        cart = self.login_with_cart()
+        response = self.client.post('/payed-online-order/')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.filter(cart=cart).exists())
+        self.assertFalse(Cart.objects.get(id=cart.id).in_order)
+
+
+class PlaceOrderTest(TestCase):
+    """Корзина оформляется в заказ только один раз"""
+
+    def test_second_submit_is_rejected(self):
+        user = User.objects.create_user('buyer')
+        customer = Customer.objects.create(user=user, phone='123')
+        cart = Cart.objects.create(owner=customer)
+
+        order = place_order(
+            Order(first_name='Имя', last_name='Фамилия', phone='123'), cart)
+        self.assertEqual(order.customer, customer)
+        with self.assertRaises(CartAlreadyOrderedError):
+            place_order(Order(first_name='Имя', last_name='Фамилия',
+                              phone='123'), Cart.objects.get(id=cart.id))
+        self.assertEqual(Order.objects.filter(cart=cart).count(), 1)
+        self.assertTrue(Cart.objects.get(id=cart.id).in_order)
+
+    def test_ordered_cart_is_not_changed(self):
+        user = User.objects.create_user('buyer')
+        customer = Customer.objects.create(user=user, phone='123')
+        cart = Cart.objects.create(owner=customer)
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        product, other = [
+            Product.objects.create(
+                category=category, title='Ноутбук', slug=slug, price=100,
+                image='mainapp/images/product.jpg')
+            for slug in ('notebook', 'other')]
+        add_to_cart(cart, product)
+        # Корзина оформлена параллельным запросом
+        place_order(Order(first_name='Имя', last_name='Фамилия',
+                          phone='123'), Cart.objects.get(id=cart.id))
+
+        for change in (lambda: add_to_cart(cart, other),
+                       lambda: add_to_cart(cart, product),
+                       lambda: change_cart_qty(cart, product, 3),
+                       lambda: remove_from_cart(cart, product)):
+            with self.assertRaises(CartAlreadyOrderedError):
+                change()
+        self.assertEqual(
+            list(CartProduct.objects.filter(cart=cart).values_list(
+                'product_id', 'qty')), [(product.id, 1)])
+        self.assertEqual(
+            Cart.objects.values_list('total_products', 'final_price').get(
+                id=cart.id), (1, Decimal(100)))
+
+
+class ProfileOrdersTest(TestCase):
+    """История заказов: снимки позиций, постраничный вывод по ключу"""
+
+    def setUp(self):
+        user = User.objects.create_user('buyer', password='secret')
+        self.customer = Customer.objects.create(user=user, phone='123')
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        self.product = Product.objects.create(
+            category=category, title='Ноутбук', slug='notebook', price=100,
+            image='mainapp/images/product.jpg')
+        self.client.force_login(user)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(
+                customer=self.customer, first_name='Имя',
+                last_name='Фамилия', phone='123')
+            OrderLine.objects.create(
+                order=order, product=self.product, title='Ноутбук',
+                price=100, qty=2, final_price=200)
+
+    def count_queries(self):
+        self.client.get(reverse('profile'))  # синхронизировать сессию
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_queries_are_constant(self):
+        self.create_orders(1)
+        one_order = self.count_queries()
+        self.create_orders(9)
+        self.assertEqual(self.count_queries(), one_order)
+
+    def test_totals_come_from_snapshot(self):
+        self.create_orders(1)
+        Product.objects.filter(id=self.product.id).update(price=999)
+        response = self.client.get(reverse('profile'))
+        order = response.context['orders'][0]
+        self.assertEqual(
+            (order.total_products, order.final_price), (2, Decimal(200)))
+        self.assertContains(response, '<strong>200,00</strong> руб.')
+        self.assertNotContains(response, '999')
+
+    def test_status_change_keeps_page_order(self):
+        self.create_orders(3)
+        first, second, third = Order.objects.order_by('id')
+        second.status = Order.STATUS_IN_PROGRESS
+        second.save()
+
+        orders = Order.objects.filter(customer=self.customer)
+        page, cursor = get_keyset_page(orders, None, 2)
+        self.assertEqual(page, [third, second])
+        page, cursor = get_keyset_page(orders, cursor, 2)
+        self.assertEqual((page, cursor), ([first], None))
+
+
+@override_settings(PAYMENT_GATEWAY='mainapp.payments.FakeGateway')
+class StorefrontScenariosTest(TestCase):
+    """Сценарии bench_storefront проходят без ошибок"""
+
+    def setUp(self):
+        reset_payment_gateway()
+        self.addCleanup(reset_payment_gateway)
+
+    def test_scenarios_complete(self):
+        category, products = create_catalog(products=3)
+        buyer = create_buyer()
+        for name in SCENARIOS:
+            user = buyer if name in AUTHENTICATED_SCENARIOS else None
+            samples, _ = run_scenario(name, 2, category, products, user)
+            for step, step_samples in samples.items():
+                for _, _, status_code in step_samples:
+                    self.assertLess(status_code, 400, f'{name}/{step}')
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class HotLookupIndexesTest(TestCase):
+    """Частые выборки используют составные индексы (по плану EXPLAIN)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        cls.product = Product.objects.create(
+            category=category, title='Товар', slug='product', price=10,
+            image='mainapp/images/product.jpg')
+        cls.feature = CategoryFeature.objects.create(
+            category=category, feature_name='Память',
+            feature_filter_name='ram')
+        cls.customer = Customer.objects.create(
+            user=User.objects.create_user('buyer'), phone='123')
+        cls.cart = Cart.objects.create(owner=cls.customer)
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # На маленьких таблицах планировщик выбирает Seq Scan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def index_names(self, model, name):
+        """
+        Имена, под которыми индекс name может быть в плане. Индекс
+        ограничения UNIQUE в SQLite называется sqlite_autoindex_<таблица>_N
+        """
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, table)
+        self.assertIn(name, constraints)
+        if connection.vendor == 'sqlite' and not constraints[name]['index']:
+            return {f'sqlite_autoindex_{table}_'}
+        return {name}
+
+    def assertUsesIndex(self, queryset, name):
+        plan = queryset.explain()
+        names = self.index_names(queryset.model, name)
+        self.assertTrue(any(name in plan for name in names),
+                        f'Индекс {name} не используется:\n{plan}')
+
+    def test_cart_lookups(self):
+        self.assertUsesIndex(
+            Cart.objects.filter(owner=self.customer, in_order=False),
+            'cart_owner_open_idx')
+        self.assertUsesIndex(
+            Cart.objects.filter(for_anonymous_user=True, in_order=False,
+                                id__gt=0).order_by('id'),
+            'cart_anonymous_open_idx')
+        self.assertUsesIndex(
+            CartProduct.objects.filter(
+                user=self.customer, cart=self.cart, product=self.product),
+            'cartproduct_cart_product_uniq')
+
+    def test_profile_orders(self):
+        self.assertUsesIndex(
+            Order.objects.filter(customer=self.customer).order_by(
+                '-created_at', '-id'),
+            'order_customer_created_idx')
+
+    def test_product_features(self):
+        self.assertUsesIndex(
+            ProductFeatures.objects.filter(feature=self.feature, value='8'),
+            'features_feature_value_idx')
+        self.assertUsesIndex(
+            ProductFeatures.objects.filter(
+                product=self.product, feature=self.feature),
+            'features_product_feature_idx')
+
+    def test_duplicate_cart_product_is_rejected(self):
+        CartProduct.objects.create(cart=self.cart, product=self.product)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartProduct.objects.create(cart=self.cart, product=self.product)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'],
+                   REPLICA_MAX_LAG=None, REPLICA_PIN_SECONDS=5)
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    """Каталог читается с реплик, кроме чтения после записи"""
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        for var in (primary_pinned, primary_written):
+            self.addCleanup(var.reset, var.set(False))
+
+    def test_catalog_reads_go_to_replicas(self):
+        for model in (Category, Product, ProductFeatures):
+            self.assertIn(self.router.db_for_read(model),
+                          ('replica1', 'replica2'))
+        for model in (Cart, CartProduct, Order, User):
+            self.assertEqual(self.router.db_for_read(model), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'mainapp'))
+
+    def test_reads_after_write_go_to_primary(self):
+        self.assertEqual(self.router.db_for_write(Cart), 'default')
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_lagging_replica_is_skipped(self):
+        lags = {'replica1': 30.0, 'replica2': 0.5}
+        self.router.replica_lag = lags.get
+        with self.settings(REPLICA_MAX_LAG=5):
+            self.assertEqual(self.router.db_for_read(Product), 'replica2')
+            lags['replica2'] = float('inf')
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_pinning_middleware(self):
+        def view(request):
+            if request.method == 'POST':
+                self.router.db_for_write(Cart)
+            return HttpResponse(self.router.db_for_read(Product))
+
+        middleware = PrimaryPinningMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.get('/'))
+        self.assertNotEqual(response.content, b'default')
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+        response = middleware(factory.post('/'))
+        self.assertEqual(response.content, b'default')
+        self.assertEqual(response.cookies[PRIMARY_PIN_COOKIE]['max-age'], 5)
+
+        request = factory.get('/')
+        request.COOKIES[PRIMARY_PIN_COOKIE] = '1'
+        response = middleware(request)
+        self.assertEqual(response.content, b'default')
+        # Закрепление не продлевается запросами без записи
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+        self.assertFalse(primary_written.get())
+
+
+class FragmentCacheTest(TestCase):
+    """Список товаров главной страницы кэшируется и сбрасывается"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        self.products = [
+            Product.objects.create(
+                category=category, title=f'Товар {i}', slug=f'product-{i}',
+                price=10, image='mainapp/images/product.jpg')
+            for i in range(3)]
+
+    def test_cached_home_page_does_not_query_products(self):
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertContains(response, 'Товар 2')
+        self.assertFalse([query for query in queries
+                          if 'mainapp_product' in query['sql']])
+
+    def test_product_change_invalidates_fragments(self):
+        product = self.products[0]
+        self.client.get('/')
+        self.client.get(product.get_absolute_url())
+        product.title = 'Новое название'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertContains(self.client.get('/'), 'Новое название')
+        self.assertContains(
+            self.client.get(product.get_absolute_url()), 'Новое название')
+
+    def test_features_change_invalidates_product_page(self):
+        product = self.products[0]
+        self.client.get(product.get_absolute_url())
+        feature = CategoryFeature.objects.create(
+            category=product.category, feature_name='Память',
+            feature_filter_name='ram')
+        old_updated_at = Product.objects.get(pk=product.pk).updated_at
+        ProductFeatures.objects.create(
+            product=product, feature=feature, value='8')
+        self.assertGreater(
+            Product.objects.get(pk=product.pk).updated_at, old_updated_at)
+
+
+class PurgeCartsTest(TestCase):
+    """purge_carts удаляет только брошенные корзины и позиции без корзины"""
+
+    def test_purge(self):
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        product = Product.objects.create(
+            category=category, title='Товар', slug='product', price=10,
+            image='mainapp/images/product.jpg')
+        customer = Customer.objects.create(
+            user=User.objects.create_user('buyer'), phone='123')
+        abandoned, recent, ordered = (
+            Cart.objects.create(for_anonymous_user=True),
+            Cart.objects.create(for_anonymous_user=True),
+            Cart.objects.create(owner=customer))
+        for cart in (abandoned, recent, ordered):
+            add_to_cart(cart, product)
+        place_order(Order(first_name='Имя', last_name='Фамилия',
+                          phone='123'), ordered)
+        # Позиция без связи Cart.products (в корзине не видна)
+        CartProduct.objects.create(cart=recent, product=Product.objects.create(
+            category=category, title='Товар 2', slug='product-2', price=20,
+            image='mainapp/images/product.jpg'))
+        Cart.objects.filter(id__in=(abandoned.id, ordered.id)).update(
+            updated_at=timezone.now() - timedelta(days=31))
+
+        out = StringIO()
+        call_command('purge_carts', days=30, batch_size=1, stdout=out)
+        self.assertIn('корзин 1, позиций 2, связей 1', out.getvalue())
+        self.assertEqual(
+            set(Cart.objects.values_list('id', flat=True)),
+            {recent.id, ordered.id})
+        self.assertEqual(CartProduct.objects.count(), 2)
+
+
+class ProductSpecTagTest(TestCase):
+    """{% product_spec %}: один запрос на список, кэш до изменения"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        ram = CategoryFeature.objects.create(
+            category=category, feature_name='Память',
+            feature_filter_name='ram', unit='ГБ')
+        cpu = CategoryFeature.objects.create(
+            category=category, feature_name='Процессор',
+            feature_filter_name='cpu')
+        for i in range(3):
+            product = Product.objects.create(
+                category=category, title=f'Ноутбук {i}', slug=f'notebook-{i}',
+                price=100, image='mainapp/images/product.jpg')
+            ProductFeatures.objects.create(
+                product=product, feature=ram, value=str(8 * (i + 1)))
+            ProductFeatures.objects.create(
+                product=product, feature=cpu, value='Intel Core i5')
+        self.template = Template(
+            '{% load specifications %}'
+            '{% for product in products %}{% product_spec product %}'
+            '{% endfor %}')
+
+    def test_list_is_rendered_with_one_query(self):
+        products = list(Product.objects.order_by('id'))
+        with self.assertNumQueries(1):
+            prefetch_specifications(products)
+            html = self.template.render(Context({'products': products}))
+        self.assertIn('24 ГБ', html)
+        self.assertIn('Intel Core i5', html)
+
+        products = list(Product.objects.order_by('id'))
+        with self.assertNumQueries(0):
+            prefetch_specifications(products)
+
+    def test_feature_change_invalidates_html(self):
+        product = Product.objects.order_by('id').first()
+        render = Template('{% load specifications %}{% product_spec product %}')
+        self.assertIn('8 ГБ', render.render(Context({'product': product})))
+        feature = ProductFeatures.objects.get(
+            product=product, feature__feature_filter_name='ram')
+        feature.value = '12'
+        feature.save()
+        product.refresh_from_db()
+        self.assertIn('12 ГБ', render.render(Context({'product': product})))
+
+
+class CategoryProductCountTest(TestCase):
+    """Счётчики товаров категорий без COUNT на каждый запрос"""
+
+    def setUp(self):
+        cache.clear()
+        local_categories.clear()
+        self.notebooks = Category.objects.create(
+            name='Ноутбуки', slug='notebooks')
+        self.smartphones = Category.objects.create(
+            name='Смартфоны', slug='smartphones')
+        self.products = [
+            Product.objects.create(
+                category=self.notebooks, title=f'Ноутбук {i}',
+                slug=f'notebook-{i}', price=10,
+                image='mainapp/images/product.jpg')
+            for i in range(3)]
+
+    def counts(self):
+        return dict(CategoryProductCount.objects.values_list(
+            'category__slug', 'count'))
+
+    def test_counter_follows_products(self):
+        self.assertEqual(self.counts(), {'notebooks': 3, 'smartphones': 0})
+        product = self.products[0]
+        product.category = self.smartphones
+        product.save()
+        self.products[1].delete()
+        self.assertEqual(self.counts(), {'notebooks': 1, 'smartphones': 1})
+
+    def test_listings_do_not_aggregate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].delete()
+        with CaptureQueriesContext(connection) as queries:
+            categories = {
+                category.slug: category.product_count
+                for category in get_categories()}
+            response = self.client.get('/api/categories/all/')
+        self.assertEqual(categories, {'notebooks': 2, 'smartphones': 0})
+        self.assertEqual(
+            {row['slug']: row['product_count']
+             for row in response.json()['items']},
+            categories)
+        self.assertFalse(
+            [query for query in queries if 'COUNT(' in query['sql']])
+        self.assertContains(self.client.get('/'), 'badge-pill">2</span>')
+
+    def test_recount(self):
+        CategoryProductCount.objects.filter(
+            category=self.notebooks).update(count=10)
+        CategoryProductCount.objects.filter(
+            category=self.smartphones).delete()
+        self.assertEqual(recount_category_products(), 2)
+        self.assertEqual(self.counts(), {'notebooks': 3, 'smartphones': 0})
+        self.assertEqual(recount_category_products(), 0)
+
+
+class FeedsTest(TestCase):
+    """Потоковые sitemap и YML фид"""
+
+    def setUp(self):
+        category = Category.objects.create(
+            name='Ноутбуки & планшеты', slug='notebooks')
+        ram = CategoryFeature.objects.create(
+            category=category, feature_name='Память',
+            feature_filter_name='ram', unit='ГБ')
+        self.products = [
+            Product.objects.create(
+                category=category, title=f'Ноутбук <{i}>',
+                slug=f'notebook-{i}', price=100, image='mainapp/images/product.jpg')
+            for i in range(5)]
+        ProductFeatures.objects.create(
+            product=self.products[0], feature=ram, value='16')
+
+    def get_xml(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return ElementTree.fromstring(b''.join(response.streaming_content))
+
+    def locations(self, root):
+        return [element.text for element in root.iter(
+            f'{{{feeds.SITEMAP_NS}}}loc')]
+
+    @mock.patch.object(feeds, 'SITEMAP_SHARD_SIZE', 2)
+    def test_sitemap_shards(self):
+        shards = feeds.sitemap_shard_count()
+        index = self.locations(self.get_xml('/sitemap.xml'))
+        self.assertEqual(len(index), shards + 1)
+        self.assertEqual(index[0], 'http://testserver/sitemap-categories.xml')
+
+        urls = []
+        for shard in range(1, shards + 1):
+            shard_urls = self.locations(
+                self.get_xml(f'/sitemap-products-{shard}.xml'))
+            self.assertLessEqual(len(shard_urls), 2)
+            urls += shard_urls
+        self.assertEqual(
+            sorted(urls),
+            sorted(f'http://testserver{product.get_absolute_url()}'
+                   for product in self.products))
+        self.assertEqual(
+            self.client.get(f'/sitemap-products-{shards + 1}.xml').status_code,
+            404)
+
+    def test_yml_feed(self):
+        with mock.patch.object(feeds, 'FEED_CHUNK_SIZE', 2):
+            root = self.get_xml('/yml.xml')
+        self.assertEqual(
+            root.find('shop/categories/category').text, 'Ноутбуки & планшеты')
+        offers = root.findall('shop/offers/offer')
+        self.assertEqual(len(offers), 5)
+        offer = root.find(f'shop/offers/offer[@id="{self.products[0].id}"]')
+        self.assertEqual(offer.find('name').text, 'Ноутбук <0>')
+        param = offer.find('param')
+        self.assertEqual(
+            (param.get('name'), param.get('unit'), param.text),
+            ('Память', 'ГБ', '16'))
+
+    def test_generate_feeds_command(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            stale = Path(output_dir, 'sitemap-products-99.xml')
+            stale.write_text('')
+            call_command(
+                'generate_feeds', output_dir=output_dir,
+                base_url='https://shop.example/', stdout=StringIO())
+            names = sorted(path.name for path in Path(output_dir).iterdir())
+            self.assertEqual(names, [
+                'sitemap-categories.xml', 'sitemap-products-1.xml',
+                'sitemap.xml', 'yml.xml'])
+            index = ElementTree.parse(Path(output_dir, 'sitemap.xml'))
+            self.assertIn(
+                'https://shop.example/sitemap-products-1.xml',
+                self.locations(index.getroot()))
+
+
+class ConditionalGetTest(TestCase):
+    """API товаров отвечает 304, пока данные не менялись"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(
+            name='Ноутбуки', slug='notebooks')
+        Product.objects.create(
+            category=self.category, title='Ноутбук', slug='notebook',
+            price=100, image='mainapp/images/product.jpg')
+
+    def test_etag_and_if_modified_since(self):
+        for url in ('/api/products/', '/api/products/notebook/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                    304)
+                self.assertEqual(self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+                ).status_code, 304)
+
+    def test_category_change_changes_etag(self):
+        etag = self.client.get('/api/products/')['ETag']
+        self.category.slug = 'laptops'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['category'], 'laptops')
+
+
+class ThumbnailsTest(TestCase):
+    """Копии изображений товаров"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = Category.objects.create(
+            name='Ноутбуки', slug='notebooks')
+
+    def create_product(self, slug='notebook'):
+        buffer = BytesIO()
+        Image.new('RGB', (1000, 500), 'red').save(buffer, 'JPEG')
+        product = Product(
+            category=self.category, title='Ноутбук', slug=slug, price=100)
+        product.image.save('x.jpg', ContentFile(buffer.getvalue()), save=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        return product
+
+    def render(self, product):
+        return Template(
+            '{% load thumbnails %}{% responsive_image product.image %}'
+        ).render(Context({'product': product}))
+
+    def test_names_do_not_collide(self):
+        names = {thumbnail_name(name, 400, 'webp')
+                 for name in ('a/x.jpg', 'b/x.jpg', 'x.png', 'x.jpg')}
+        self.assertEqual(len(names), 4)
+
+    def test_generated_on_image_change_only(self):
+        product = self.create_product()
+        self.assertIn('/thumbs/', self.render(product))
+        # Карточки с исходным изображением сбрасываются
+        self.assertGreater(
+            Product.objects.get(pk=product.pk).updated_at, product.updated_at)
+        generate_path = 'mainapp.signals.generate_thumbnails_safe'
+        with mock.patch(generate_path) as generate:
+            product.title = 'Новое название'
+            with self.captureOnCommitCallbacks(execute=True):
+                product.save()
+            generate.assert_not_called()
+
+    def test_cached_card_is_refreshed(self):
+        cache.clear()
+        with mock.patch('mainapp.signals.generate_thumbnails_safe',
+                        return_value=0):
+            product = self.create_product()
+        card = Template('{% include "mainapp/include/product_card.html" %}')
+
+        def render_card():
+            product = Product.objects.get(slug='notebook')
+            return card.render(Context({'product': product}))
+
+        self.assertNotIn('/thumbs/', render_card())
+        # Копии созданы позже (rebuild_thumbnails или фоновая задача)
+        generate_thumbnails(product.image.name)
+        self.assertNotIn('/thumbs/', render_card())
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            invalidate_product_images([product.image.name])
+        self.assertEqual(len(callbacks), 1)  # версия списков товаров
+        self.assertIn('/thumbs/', render_card())
+
+    def test_fallback_to_original_image(self):
+        with mock.patch('mainapp.signals.generate_thumbnails_safe'):
+            product = self.create_product()
+        html = self.render(product)
+        self.assertNotIn('/thumbs/', html)
+        self.assertIn(f'src="{product.image.url}"', html)
+
+
+class LazyCartTest(TestCase):
+    """Корзина в шапке страницы без загрузки корзины, слияние при входе"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        self.products = [
+            Product.objects.create(
+                category=category, title=f'Ноутбук {i}', slug=f'notebook-{i}',
+                price=100, image='mainapp/images/product.jpg')
+            for i in range(2)]
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.customer = Customer.objects.create(user=self.user, phone='123')
+
+    def assertBadge(self, response, total_products):
+        self.assertContains(
+            response, f'badge-danger">{total_products}</span>')
+
+    def test_page_without_cart_does_not_create_it(self):
+        self.assertBadge(self.client.get('/'), 0)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_login_on_new_device_shows_customer_cart(self):
+        cart = Cart.objects.create(owner=self.customer)
+        for product in self.products:
+            add_to_cart(cart, product)
+        self.client.login(username='buyer', password='secret')
+        self.assertEqual(self.client.session['cart']['id'], cart.id)
+        self.assertBadge(self.client.get('/'), 2)
+
+    def test_stale_session_totals(self):
+        self.client.get('/cart/')
+        cart = Cart.objects.get(id=self.client.session['cart']['id'])
+        # Изменение из другой сессии
+        add_to_cart(cart, self.products[0])
+        self.assertBadge(self.client.get('/'), 1)
+        # Корзину удалил purge_carts
+        cart.delete()
+        self.assertBadge(self.client.get('/'), 0)
+        self.assertNotIn('cart', self.client.session)
+
+    def test_login_merges_anonymous_cart(self):
+        self.client.get('/cart/')
+        anonymous_cart = Cart.objects.get(
+            id=self.client.session['cart']['id'])
+        for product in self.products:
+            add_to_cart(anonymous_cart, product)
+        cart = Cart.objects.create(owner=self.customer)
+        add_to_cart(cart, self.products[0])
+
+        self.client.login(username='buyer', password='secret')
+        self.assertFalse(Cart.objects.filter(id=anonymous_cart.id).exists())
+        cart.refresh_from_db()
+        self.assertEqual(
+            dict(cart.products.values_list('product__slug', 'qty')),
+            {'notebook-0': 2, 'notebook-1': 1})
+        self.assertEqual((cart.total_products, cart.final_price), (2, 300))
+        self.assertBadge(self.client.get('/'), 2)
+
+    def test_merge_carts_moves_lines(self):
+        source = Cart.objects.create(for_anonymous_user=True)
+        target = Cart.objects.create(owner=self.customer)
+        add_to_cart(source, self.products[1])
+        merge_carts(source, target)
+        line = target.products.get()
+        self.assertEqual(
+            (line.cart_id, line.user_id), (target.id, self.customer.id))
+
+
+class ImportCatalogTest(TestCase):
+    """Импорт каталога: неверные строки пропускаются, импорт продолжается"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def run_import(self, name, content):
+        path = Path(self.tmp.name, name)
+        path.write_text(content, encoding='utf-8')
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', str(path), stdout=stdout, stderr=stderr)
+        return stderr.getvalue()
+
+    def test_invalid_jsonl_rows_are_skipped(self):
+        valid = {'category': 'notebooks', 'category_name': 'Ноутбуки',
+                 'slug': 'ok', 'title': 'Ноутбук', 'price': '999.90'}
+        rows = [
+            '[1]', '"x"', '{broken',
+            json.dumps(dict(valid, slug='bad-features', features=[1])),
+            json.dumps(dict(valid, slug='nan', price='NaN')),
+            json.dumps(dict(valid, slug='inf', price='Infinity')),
+            json.dumps(dict(valid, slug='huge', price='1e7')),
+            json.dumps(dict(valid, slug='negative', price='-1')),
+            json.dumps(dict(valid, slug='title', title={'ru': 'Ноутбук'})),
+            json.dumps(dict(valid, slug='x' * 51)),
+            json.dumps(valid),
+        ]
+        errors = self.run_import('catalog.jsonl', '\n'.join(rows))
+        self.assertEqual(len(errors.splitlines()), len(rows) - 1)
+        self.assertEqual(
+            list(Product.objects.values_list('slug', 'price')),
+            [('ok', Decimal('999.90'))])
+
+    def test_csv_row_with_extra_columns_is_skipped(self):
+        errors = self.run_import('catalog.csv', (
+            'category,slug,title,price,feature:ram\n'
+            'notebooks,a,Ноутбук A,100,8\n'
+            'notebooks,b,Ноутбук B,100,8,лишнее\n'))
+        self.assertIn('Строка 3: лишние колонки', errors)
+        self.assertEqual(
+            list(Product.objects.values_list('slug', flat=True)), ['a'])
+
+    def test_moved_product(self):
+        notebooks = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        ram = CategoryFeature.objects.create(
+            category=notebooks, feature_name='Память',
+            feature_filter_name='ram')
+        product = Product.objects.create(
+            category=notebooks, title='Ноутбук', slug='device', price=100,
+            image='mainapp/images/product.jpg')
+        ProductFeatures.objects.create(product=product, feature=ram, value='8')
+        self.assertEqual(
+            get_facet_index(notebooks).filter({'ram': {'8'}})[0],
+            {product.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.run_import('catalog.jsonl', json.dumps({
+                'category': 'tablets', 'slug': 'device', 'title': 'Планшет',
+                'price': '100'}))
+        self.assertFalse(ProductFeatures.objects.filter(product=product))
+        # Счётчик прежней категории пересчитан вместе с новой
+        tablets = Category.objects.get(slug='tablets')
+        self.assertEqual(
+            dict(CategoryProductCount.objects.values_list(
+                'category_id', 'count')),
+            {notebooks.id: 0, tablets.id: 1})
+        self.assertEqual(
+            get_facet_index(notebooks).filter({'ram': {'8'}})[0], set())
+
+
+class SearchTest(TestCase):
+    """Полнотекстовый поиск: стемминг, релевантность, подсказки"""
+
+    def setUp(self):
+        autocomplete_cache.clear()
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        self.case = Product.objects.create(
+            category=category, title='Чехол', slug='case', price=10,
+            description='Подходит для ноутбуков',
+            image='mainapp/images/product.jpg')
+        self.notebook = Product.objects.create(
+            category=category, title='Ноутбук игровой', slug='notebook',
+            price=100, image='mainapp/images/product.jpg')
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, 200)
+        return [product['slug'] for product in response.json()]
+
+    def test_stemmer(self):
+        self.assertEqual(stem('ноутбуки'), stem('ноутбуков'))
+        self.assertEqual(stem('игровой'), stem('игровые'))
+        self.assertEqual(stem_text('Ёлка iPhone 15'), 'елк iphone 15')
+
+    def test_title_match_ranks_higher(self):
+        self.assertEqual(self.search(q='ноутбуки'), ['notebook', 'case'])
+        self.assertEqual(self.search(q='чехол'), ['case'])
+        self.assertEqual(self.search(q='"ноутбук*'), ['notebook', 'case'])
+
+    def test_rebuild_after_migration(self):
+        self.assertFalse(search_index_needs_rebuild())
+        # Миграция 0005 создаёт пустой индекс
+        get_search_backend().clear()
+        self.assertTrue(search_index_needs_rebuild())
+        with self.assertLogs('mainapp.signals', 'WARNING') as logs:
+            check_search_index(
+                sender=None, app_config=apps.get_app_config('mainapp'),
+                using='default')
+        self.assertIn('rebuild_search_index', logs.output[0])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertFalse(search_index_needs_rebuild())
+        self.assertEqual(self.search(q='ноутбуки'), ['notebook', 'case'])
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(self.search(q='ноутбуки', limit=-1), ['notebook'])
+        self.assertEqual(self.search(q='ноутбуки', limit=0), ['notebook'])
+        self.assertEqual(
+            self.search(q='ноутбуки', limit='x'), ['notebook', 'case'])
+
+    def test_autocomplete(self):
+        response = self.client.get(
+            reverse('autocomplete'), {'q': 'Ноутбук иг'})
+        self.assertEqual(
+            [item['slug'] for item in response.json()], ['notebook'])
+        response = self.client.get(reverse('autocomplete'), {'q': 'ч'})
+        self.assertEqual(
+            [item['slug'] for item in response.json()], ['case'])
+
+
+class RequestTimingTest(TestCase):
+    """Server-Timing только для персонала или при DEBUG, выборка запросов"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', is_staff=True)
+
+    def get(self):
+        response = self.client.get(reverse('base'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_header_hidden_from_visitors(self):
+        self.assertNotIn('Server-Timing', self.get())
+        with self.settings(DEBUG=True):
+            self.assertIn('total;dur=', self.get()['Server-Timing'])
+
+    def test_header_shown_to_staff(self):
+        self.client.force_login(self.staff)
+        self.assertIn('db;dur=', self.get()['Server-Timing'])
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0.5)
+    def test_sampling(self):
+        self.client.force_login(self.staff)
+        with mock.patch('mainapp.middleware.random.random', return_value=0.9):
+            self.assertNotIn('Server-Timing', self.get())
+        with mock.patch('mainapp.middleware.random.random', return_value=0.1):
+            self.assertIn('Server-Timing', self.get())
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_disabled(self):
+        self.client.force_login(self.staff)
+        self.assertNotIn('Server-Timing', self.get())
+
+    @override_settings(REQUEST_TIMING_SLOW_MS=0)
+    def test_slow_request_is_logged(self):
+        with self.assertLogs('mainapp.timing', 'WARNING') as logs:
+            self.get()
+        self.assertIn('Медленный запрос GET /', logs.output[0])
+
+
+class CartTotalsTest(TestCase):
+    """Итоги корзины меняются дельтой в БД, сверка check_cart_totals"""
+
+    def setUp(self):
+        user = User.objects.create_user('buyer')
+        self.customer = Customer.objects.create(user=user, phone='123')
+        self.cart = Cart.objects.create(owner=self.customer)
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        self.first, self.second = [
+            Product.objects.create(
+                category=category, title=f'Ноутбук {i}', slug=f'notebook-{i}',
+                price=price, image='mainapp/images/product.jpg')
+            for i, price in enumerate((100, 250))]
+
+    def assertTotals(self, total_products, final_price):
+        self.assertEqual(
+            Cart.objects.values_list('total_products', 'final_price').get(
+                id=self.cart.id), (total_products, Decimal(final_price)))
+
+    def test_concurrent_changes_are_summed(self):
+        # Два запроса с одной и той же (устаревшей) корзиной
+        stale = Cart.objects.get(id=self.cart.id)
+        add_to_cart(self.cart, self.first)
+        add_to_cart(stale, self.second)
+        self.assertEqual(
+            (stale.total_products, stale.final_price), (2, Decimal(350)))
+        change_cart_qty(stale, self.first, 3)
+        remove_from_cart(self.cart, self.second)
+        self.assertTotals(1, 300)
+
+    def test_conflict_after_attempts(self):
+        add_to_cart(self.cart, self.first)
+        get = QuerySet.get
+
+        def stale_get(queryset, *args, **kwargs):
+            # Позицию каждый раз успевают изменить параллельно
+            cart_product = get(queryset, *args, **kwargs)
+            cart_product.final_price += 1
+            return cart_product
+
+        with mock.patch.object(QuerySet, 'get', stale_get):
+            with self.assertRaises(CartUpdateConflictError):
+                change_cart_qty(self.cart, self.first, 5)
+        self.assertTotals(1, 100)
+
+    def test_conflict_shows_message(self):
+        self.client.force_login(self.customer.user)
+        with mock.patch('mainapp.views.change_cart_qty',
+                        side_effect=CartUpdateConflictError):
+            response = self.client.post(
+                reverse('change_qty', kwargs={'slug': 'notebook-0'}),
+                {'qty': 2}, follow=True)
+        self.assertRedirects(response, '/cart/')
+        self.assertContains(response, 'Корзина изменена в другой вкладке')
+
+    def test_check_cart_totals(self):
+        add_to_cart(self.cart, self.first)
+        Cart.objects.filter(id=self.cart.id).update(
+            total_products=5, final_price=1)
+        stdout = StringIO()
+        call_command('check_cart_totals', stdout=stdout)
+        self.assertIn(f'Корзина №{self.cart.id}: 5 / 1', stdout.getvalue())
+        self.assertTotals(5, 1)
+
+        call_command('check_cart_totals', '--fix', stdout=StringIO())
+        self.assertTotals(1, 100)
+        stdout = StringIO()
+        call_command('check_cart_totals', stdout=stdout)
+        self.assertIn('расхождений: 0', stdout.getvalue())
+
+
+class CategoryRangesTest(TestCase):
+    """Границы диапазонов на странице категории выводятся без экспоненты"""
+
+    def setUp(self):
+        cache.clear()
+        local_categories.clear()
+        self.category = Category.objects.create(
+            name='Ноутбуки', slug='notebooks')
+        disk = CategoryFeature.objects.create(
+            category=self.category, feature_name='Диск',
+            feature_filter_name='disk', unit='МБ')
+        for i, value in enumerate(('1234567', '2500000.5')):
+            product = Product.objects.create(
+                category=self.category, title=f'Ноутбук {i}',
+                slug=f'notebook-{i}', price=10,
+                image='mainapp/images/product.jpg')
+            ProductFeatures.objects.create(
+                product=product, feature=disk, value=value)
+
+    def test_bounds(self):
+        response = self.client.get(
+            self.category.get_absolute_url(),
+            {'disk_min': '1234567', 'disk_max': '2500000,5'})
+        self.assertContains(response, 'placeholder="от 1234567"')
+        self.assertContains(response, 'placeholder="до 2500000.5"')
+        self.assertContains(response, 'value="1234567"')
+        self.assertContains(response, 'value="2500000.5"')
+        self.assertNotContains(response, 'e+06')
+
+    def test_invalid_bound_is_not_rendered(self):
+        response = self.client.get(
+            self.category.get_absolute_url(), {'disk_min': '<b>'})
+        self.assertNotContains(response, '<b>')
+        self.assertContains(response, 'name="disk_min"')
+
+
+class StaticFilesTest(SimpleTestCase):
+    """Сжатые копии статики, выбор кодировки и кэширование"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        source, self.root = Path(tmp.name, 'src'), Path(tmp.name, 'root')
+        (source / 'css').mkdir(parents=True)
+        self.content = b'body { color: red; }\n' * 50
+        (source / 'css' / 'site.css').write_bytes(self.content)
+        # Без статики приложений (admin) - только каталог теста
+        settings = self.settings(
+            STATIC_ROOT=self.root, STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=[
+                'django.contrib.staticfiles.finders.FileSystemFinder'])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.hashed = staticfiles_storage.stored_name('css/site.css')
+        self.middleware = StaticFilesMiddleware(
+            lambda request: HttpResponse('app'))
+
+    def get(self, name, **headers):
+        response = self.middleware(RequestFactory().get(
+            f'/static/{name}', **headers))
+        self.addCleanup(response.close)
+        return response
+
+    def test_compressed_copies(self):
+        self.assertNotEqual(self.hashed, 'css/site.css')
+        for name in ('css/site.css', self.hashed):
+            self.assertEqual(gzip.decompress(
+                (self.root / f'{name}.gz').read_bytes()), self.content)
+
+    def test_encoding_negotiation(self):
+        # Копия .br создаётся только при установленном brotli
+        (self.root / f'{self.hashed}.br').write_bytes(b'br')
+        for accept_encoding, encoding in (
+                ('gzip, deflate, br', 'br'),
+                ('br;q=0, gzip', 'gzip'),
+                ('gzip;q=0.5', 'gzip'),
+                ('identity', None),
+                ('', None)):
+            response = self.get(
+                self.hashed, HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get('Content-Encoding'), encoding)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+        response = self.get(self.hashed)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_cache_headers(self):
+        response = self.get(self.hashed)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        response = self.get('css/site.css')
+        self.assertEqual(response['Cache-Control'], REVALIDATE_CACHE_CONTROL)
+
+        etag = self.get(self.hashed)['ETag']
+        response = self.get(self.hashed, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+    def test_other_requests_are_passed_on(self):
+        for name in (f'{self.hashed}.gz', 'missing.css', '../../etc/passwd'):
+            self.assertEqual(self.get(name).content, b'app')
+
+
+class APIPaginationTest(TestCase):
+    """Курсор списков API и потоковая выгрузка NDJSON"""
+
+    def setUp(self):
+        self.category = Category.objects.create(
+            name='Ноутбуки', slug='notebooks')
+        self.products = [
+            self.create_product(f'notebook-{i}') for i in range(5)]
+
+    def create_product(self, slug):
+        return Product.objects.create(
+            category=self.category, title='Ноутбук', slug=slug, price=100,
+            image='mainapp/images/product.jpg')
+
+    def create_customers(self, count, orders):
+        for i in range(count):
+            user = User.objects.create_user(f'buyer-{i}')
+            customer = Customer.objects.create(user=user, phone='123')
+            customer.orders.add(*[
+                Order.objects.create(
+                    customer=customer, first_name='Имя',
+                    last_name='Фамилия', phone='123')
+                for _ in range(orders)])
+
+    def test_cursor_is_stable(self):
+        response = self.client.get(reverse('products_list'), {'page_size': 2})
+        slugs = [product['slug'] for product in response.json()['results']]
+        # Новые товары не сдвигают следующие страницы
+        self.create_product('new')
+        next_url = response.json()['next']
+        while next_url:
+            data = self.client.get(next_url).json()
+            slugs += [product['slug'] for product in data['results']]
+            next_url = data['next']
+        self.assertEqual(
+            slugs, [product.slug for product in reversed(self.products)])
+
+    def test_customers_are_staff_only(self):
+        self.create_customers(1, orders=0)
+        for params in ({}, {'export': 'ndjson'}):
+            response = self.client.get(reverse('customers_list'), params)
+            self.assertEqual(response.status_code, 403)
+        self.client.force_login(User.objects.get(username='buyer-0'))
+        response = self.client.get(
+            reverse('customers_list'), {'export': 'ndjson'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_page_queries_are_constant(self):
+        def count_queries(page_size):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    reverse('products_list'), {'page_size': page_size})
+            self.assertEqual(len(response.json()['results']), page_size)
+            return len(queries)
+
+        self.assertEqual(count_queries(1), count_queries(5))
+
+    @mock.patch.object(CustomersListAPIView, 'export_chunk_size', 2)
+    def test_ndjson_export(self):
+        def export():
+            response = self.client.get(
+                reverse('customers_list'), {'export': 'ndjson'})
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            with CaptureQueriesContext(connection) as queries:
+                lines = b''.join(response.streaming_content).splitlines()
+            return [json.loads(line) for line in lines], len(queries)
+
+        self.create_customers(3, orders=1)
+        self.client.force_login(
+            User.objects.create_user('staff', is_staff=True))
+        customers, one_order = export()
+        self.assertEqual(
+            [customer['id'] for customer in customers],
+            list(Customer.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(len(customers[0]['orders']), 1)
+
+        # Запросы - на пачку, а не на покупателя или заказ
+        Customer.objects.all().delete()
+        User.objects.filter(is_staff=False).delete()
+        self.create_customers(4, orders=3)
+        customers, many_orders = export()
+        self.assertEqual(len(customers), 4)
+        self.assertEqual(len(customers[0]['orders']), 3)
+        self.assertEqual(many_orders, one_order)
+
+
+class VersionedCacheTest(TestCase):
+    """LRU кэш процесса и версии наборов данных в общем кэше"""
+
+    def setUp(self):
+        cache.clear()
+        local_categories.clear()
+
+    def test_lru_eviction(self):
+        lru = LRUCache(maxsize=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)  # 'a' - последний использованный
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+        lru.set('a', 10)
+        lru.set('d', 4)
+        self.assertEqual(
+            [lru.get(key, 'нет') for key in 'acd'], [10, 'нет', 4])
+        lru.clear()
+        self.assertIsNone(lru.get('a'))
+
+    def test_bump_applies_on_commit(self):
+        version = get_version(CATEGORIES_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(CATEGORIES_VERSION_KEY)
+            self.assertEqual(get_version(CATEGORIES_VERSION_KEY), version)
+        self.assertEqual(get_version(CATEGORIES_VERSION_KEY), version + 1)
+
+    def test_bump_is_dropped_on_rollback(self):
+        version = get_version(CATEGORIES_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    bump_version(CATEGORIES_VERSION_KEY)
+                    raise IntegrityError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_version(CATEGORIES_VERSION_KEY), version)
+
+    def test_evicted_version_is_recreated(self):
+        version = get_version(CATEGORIES_VERSION_KEY)
+        cache.delete(CATEGORIES_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(CATEGORIES_VERSION_KEY)
+        self.assertGreaterEqual(get_version(CATEGORIES_VERSION_KEY), version)
+
+    def test_categories_change_after_commit(self):
+        Category.objects.create(name='Ноутбуки', slug='notebooks')
+        self.assertEqual(len(get_categories()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Смартфоны', slug='smartphones')
+            # До коммита - прежний список (из LRU процесса)
+            self.assertEqual(len(get_categories()), 1)
+        self.assertEqual(
+            [category.slug for category in get_categories()],
+            ['notebooks', 'smartphones'])
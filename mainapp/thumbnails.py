@@ -0,0 +1,88 @@
+"""
+Уменьшенные копии изображений товаров (WebP и JPEG нескольких размеров).
+Создаются при загрузке изображения и командой rebuild_thumbnails
+"""
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Ширина копий в пикселях (меньшие изображения не увеличиваются)
+THUMBNAIL_WIDTHS = (200, 400, 800)
+# Расширение файла -> (формат Pillow, параметры сохранения)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+THUMBNAILS_DIR = 'mainapp/thumbs'
+
+
+def thumbnail_name(image_name, width, extension):
+    """
+    Имя файла копии в хранилище: полный путь изображения с его
+    расширением => у a/x.jpg, b/x.jpg и x.png разные копии
+    """
+    return f'{THUMBNAILS_DIR}/{width}/{image_name}.{extension}'
+
+
+def thumbnail_url(image_name, width, extension):
+    return default_storage.url(thumbnail_name(image_name, width, extension))
+
+
+def thumbnail_targets(image_name):
+    """(ширина, расширение, имя файла) всех копий в порядке создания"""
+    return [
+        (width, extension, thumbnail_name(image_name, width, extension))
+        for width in THUMBNAIL_WIDTHS for extension in THUMBNAIL_FORMATS
+    ]
+
+
+def thumbnails_exist(image_name):
+    """Копии созданы: последняя по порядку создания копия уже есть"""
+    return default_storage.exists(thumbnail_targets(image_name)[-1][2])
+
+
+def generate_thumbnails(image_name, force=False):
+    """
+    Создать все копии изображения. Существующие копии пропускаются,
+    если не указан force. Вернуть кол-во созданных файлов
+    """
+    targets = thumbnail_targets(image_name)
+    if not force:
+        targets = [target for target in targets
+                   if not default_storage.exists(target[2])]
+    if not targets:
+        return 0
+
+    with default_storage.open(image_name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+
+    created = 0
+    for width, extension, name in targets:
+        pil_format, save_options = THUMBNAIL_FORMATS[extension]
+        thumbnail = image.copy()
+        thumbnail.thumbnail((width, width * 4), Image.LANCZOS)
+        if pil_format == 'JPEG' and thumbnail.mode != 'RGB':
+            thumbnail = thumbnail.convert('RGB')
+        buffer = BytesIO()
+        thumbnail.save(buffer, pil_format, **save_options)
+        # Хранилище не перезаписывает файлы, а переименовывает новый
+        default_storage.delete(name)
+        default_storage.save(name, ContentFile(buffer.getvalue()))
+        created += 1
+    return created
+
+
+def generate_thumbnails_safe(image_name, force=False):
+    """generate_thumbnails без исключений (для сигналов и пула процессов)"""
+    try:
+        return generate_thumbnails(image_name, force)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        logger.warning(
+            'Не удалось создать копии изображения %s: %s', image_name, error)
+        return 0
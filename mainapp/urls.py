@@ -4,15 +4,21 @@ from django.contrib.auth.views import LogoutView
 from .views import (
     LoginView, RegistrationView, ProfileView, BaseView, ProductDetailView,
     CategoryDetailView, CartView, AddToCartView, DeleteFromCartView, ChangeQTYView,
-    CheckoutView, MakeOrderView, PayedOnlineOrderView,
+    CheckoutView, PaymentIntentView, MakeOrderView, PayedOnlineOrderView,
+    PaymentWebhookView, SitemapIndexView, CategoriesSitemapView,
+    ProductsSitemapView, YMLFeedView,
 )
 
 urlpatterns = [
     # Оформление, отправка и оплата заказа
     path('checkout/', CheckoutView.as_view(), name='checkout'),
+    path('checkout/payment-intent/', PaymentIntentView.as_view(),
+         name='payment_intent'),
     path('make-order/', MakeOrderView.as_view(), name='make_order'),
     path('payed-online-order/', PayedOnlineOrderView.as_view(),
          name='payed_online_order'),
+    path('payments/webhook/', PaymentWebhookView.as_view(),
+         name='payment_webhook'),
 
     # Корзина. Добавление/удаление товаров. Кол-во единиц одного товара.
     path('cart/', CartView.as_view(), name='cart'),
@@ -30,6 +36,14 @@ urlpatterns = [
     path('products/<str:slug>/', ProductDetailView.as_view(),
          name='product_detail'),
 
+    # sitemap и фид товаров. Имена совпадают с файлами generate_feeds
+    path('sitemap.xml', SitemapIndexView.as_view(), name='sitemap'),
+    path('sitemap-categories.xml', CategoriesSitemapView.as_view(),
+         name='sitemap_categories'),
+    path('sitemap-products-<int:shard>.xml', ProductsSitemapView.as_view(),
+         name='sitemap_products'),
+    path('yml.xml', YMLFeedView.as_view(), name='yml_feed'),
+
     # Главная страница. Авторизация, регистрация, профиль пользователя
     path('profile/', ProfileView.as_view(), name='profile'),
     path('registration/', RegistrationView.as_view(), name='registration'),
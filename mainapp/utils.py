@@ -1,5 +1,18 @@
-from django.db import models
+from datetime import datetime
+
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Cart, CartProduct, Category, CategoryProductCount, Customer, OrderLine)
+
+# Кол-во заказов на странице профиля
+ORDERS_PAGE_SIZE = 20
+# Кол-во попыток изменить позицию корзины при параллельных изменениях
+CART_UPDATE_ATTEMPTS = 3
 
 
 def get_product_url(obj, view_name):
@@ -18,8 +31,53 @@ def get_models_for_count(*model_names):
     return [models.Count(model_name) for model_name in model_names]
 
 
+def with_product_counts(categories):
+    """
+    Категории со счётчиком товаров (product_count) из CategoryProductCount -
+    один JOIN, без агрегации при каждом запросе
+    """
+    return categories.annotate(
+        product_count=Coalesce('product_counter__count', 0))
+
+
+def change_category_product_count(category_id, delta):
+    """Изменить счётчик товаров категории на дельту одним UPDATE"""
+    CategoryProductCount.objects.filter(category_id=category_id).update(
+        count=F('count') + delta)
+
+
+def recount_category_products(category_ids=None):
+    """
+    Пересчитать счётчики товаров категорий (все либо category_ids)
+    одним GROUP BY запросом. Вернуть кол-во изменённых счётчиков
+    """
+    categories = Category.objects.order_by().annotate(
+        *get_models_for_count('product'))
+    if category_ids is not None:
+        categories = categories.filter(id__in=list(category_ids))
+    counts = dict(categories.values_list('id', 'product__count'))
+    counters = CategoryProductCount.objects.in_bulk(list(counts))
+    to_update, to_create = [], []
+    for category_id, count in counts.items():
+        counter = counters.get(category_id)
+        if counter is None:
+            to_create.append(
+                CategoryProductCount(category_id=category_id, count=count))
+        elif counter.count != count:
+            counter.count = count
+            to_update.append(counter)
+    with transaction.atomic():
+        CategoryProductCount.objects.bulk_update(to_update, ('count',))
+        CategoryProductCount.objects.bulk_create(
+            to_create, ignore_conflicts=True)
+    return len(to_update) + len(to_create)
+
+
 def recalc_cart(cart):
-    """Получить общую стоимость товаров в корзине. Пересчёт стоимости"""
+    """
+    Получить общую стоимость товаров в корзине. Полный пересчёт стоимости.
+    Для изменения одной позиции используется apply_cart_delta
+    """
     cart_data = cart.products.aggregate(
         models.Sum('final_price'), models.Count('id'))
 
@@ -29,3 +87,148 @@ def recalc_cart(cart):
         cart.final_price = 0
     cart.total_products = cart_data['id__count']
     cart.save()
+
+
+def apply_cart_delta(cart, products_delta, price_delta):
+    """
+    Изменить итоги корзины на дельту одним UPDATE c F() выражениями.
+    Параллельные изменения складываются в БД, а не перезаписывают друг друга.
+    Оформленная корзина не меняется: CartAlreadyOrderedError откатывает
+    транзакцию вместе с изменением позиции
+    """
+    carts = Cart.objects.filter(pk=cart.pk, in_order=False)
+    if products_delta or price_delta:
+        carts.update(
+            total_products=F('total_products') + products_delta,
+            final_price=F('final_price') + price_delta,
+            updated_at=timezone.now())
+    # Актуальные итоги (с учётом параллельных изменений) для ответа/сессии
+    totals = carts.values_list('total_products', 'final_price').first()
+    if totals is None:
+        raise CartAlreadyOrderedError(f'Корзина №{cart.pk} уже оформлена')
+    cart.total_products, cart.final_price = totals
+
+
+def add_to_cart(cart, product):
+    """Добавить товар в корзину. Повторное добавление ничего не меняет"""
+    with transaction.atomic():
+        cart_product, created = CartProduct.objects.get_or_create(
+            user=cart.owner, cart=cart, product=product)
+        if created:
+            cart.products.add(cart_product)
+            apply_cart_delta(cart, 1, cart_product.final_price)
+        else:
+            apply_cart_delta(cart, 0, 0)
+    return cart_product
+
+
+class CartUpdateConflictError(DatabaseError):
+    """Позицию корзины не удалось изменить за CART_UPDATE_ATTEMPTS попыток"""
+
+
+def _change_cart_product(cart, product, change):
+    """
+    Изменить позицию корзины и итоги корзины в одной транзакции.
+    change(cart_product) выполняет условный UPDATE/DELETE (по прежней цене
+    позиции) и возвращает (изменено ли, дельта кол-ва, дельта цены).
+    Если позицию успели изменить параллельно - повторить с новыми данными
+    """
+    for _ in range(CART_UPDATE_ATTEMPTS):
+        with transaction.atomic():
+            cart_product = CartProduct.objects.select_for_update().get(
+                user=cart.owner, cart=cart, product=product)
+            changed, products_delta, price_delta = change(cart_product)
+            if changed:
+                apply_cart_delta(cart, products_delta, price_delta)
+                return cart_product
+    raise CartUpdateConflictError(
+        'Позиция корзины изменена параллельным запросом')
+
+
+def remove_from_cart(cart, product):
+    """Удалить товар из корзины"""
+    def change(cart_product):
+        # Удаление CartProduct удаляет и связь Cart.products
+        _, deleted = CartProduct.objects.filter(
+            pk=cart_product.pk, final_price=cart_product.final_price).delete()
+        return (deleted.get(CartProduct._meta.label),
+                -1, -cart_product.final_price)
+
+    return _change_cart_product(cart, product, change)
+
+
+def change_cart_qty(cart, product, qty):
+    """Изменить кол-во единиц товара в корзине"""
+    def change(cart_product):
+        final_price = qty * product.price
+        updated = CartProduct.objects.filter(
+            pk=cart_product.pk, final_price=cart_product.final_price).update(
+            qty=qty, final_price=final_price)
+        price_delta = final_price - cart_product.final_price
+        cart_product.qty, cart_product.final_price = qty, final_price
+        return updated, 0, price_delta
+
+    return _change_cart_product(cart, product, change)
+
+
+class CartAlreadyOrderedError(Exception):
+    """Корзина уже оформлена в заказ (например, повторная отправка формы)"""
+
+
+def place_order(order, cart):
+    """
+    Оформить заказ из корзины. order - несохранённый заказ с данными
+    покупателя, сохраняется одним INSERT. Корзина закрепляется условным
+    UPDATE (in_order: False -> True) - из двух одновременных запросов заказ
+    создаст только один, второй получит CartAlreadyOrderedError.
+    Где поддерживается (PostgreSQL), позиции корзины блокируются
+    select_for_update до конца транзакции
+    """
+    with transaction.atomic():
+        updated = Cart.objects.filter(pk=cart.pk, in_order=False).update(
+            in_order=True)
+        if not updated:
+            raise CartAlreadyOrderedError(f'Корзина №{cart.pk} уже оформлена')
+        cart.in_order = True
+
+        lines = cart.products.select_related('product').order_by('id')
+        if connection.features.has_select_for_update_of:
+            lines = lines.select_for_update(of=('self',))
+
+        order.customer = cart.owner
+        order.cart = cart
+        order.save(force_insert=True)
+        Customer.orders.through.objects.create(
+            customer_id=cart.owner_id, order_id=order.pk)
+        OrderLine.snapshot(order, cart, lines)
+    return order
+
+
+def get_keyset_page(queryset, cursor, page_size):
+    """
+    Страница по ключу (-created_at, -id) без OFFSET и COUNT(*).
+    cursor - значение из encode_keyset_cursor для последнего объекта
+    предыдущей страницы. Возвращает (объекты, курсор следующей страницы)
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        try:
+            created_at, pk = cursor.rsplit('_', 1)
+            created_at = datetime.fromisoformat(created_at)
+            pk = int(pk)
+        except ValueError:
+            pass  # неверный курсор => первая страница
+        else:
+            queryset = queryset.filter(
+                models.Q(created_at__lt=created_at)
+                | models.Q(created_at=created_at, id__lt=pk))
+    objects = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(objects) > page_size:
+        objects = objects[:page_size]
+        next_cursor = encode_keyset_cursor(objects[-1])
+    return objects, next_cursor
+
+
+def encode_keyset_cursor(obj):
+    return '{}_{}'.format(obj.created_at.isoformat(), obj.pk)
@@ -1,16 +1,30 @@
-import stripe  # система онлайн платежей
-
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
-from django.db import transaction
-from django.http import HttpResponseRedirect, JsonResponse
+from django.core.paginator import Paginator
+from django.http import (
+    Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse)
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View, DetailView
 
+from specs.facets import get_facet_index
+
+from .cache import get_categories, get_products_version
+from .cart import get_customer
+from .feeds import (
+    generate_categories_sitemap, generate_products_sitemap,
+    generate_sitemap_index, generate_yml, sitemap_shard_count)
 from .forms import LoginForm, RegistrationForm, OrderForm
 from .mixins import CartMixin
-from .models import (Category, Product, CartProduct, Customer, Order, )
-from .utils import recalc_cart
+from .models import (Cart, Category, Product, Customer, Order, )
+from .payments import (
+    PaymentGatewayError, cart_amount, enqueue_payment_event,
+    forget_payment_intent, prepare_payment_intent, wait_payment_intent)
+from .utils import (
+    ORDERS_PAGE_SIZE, CartAlreadyOrderedError, CartUpdateConflictError,
+    add_to_cart, change_cart_qty, get_keyset_page, place_order,
+    remove_from_cart)
 
 
 class LoginView(CartMixin, View):
@@ -19,7 +33,7 @@ class LoginView(CartMixin, View):
     def get(self, request, *args, **kwargs):
         """Получить форму"""
         form = LoginForm(request.POST or None)
-        categories = Category.objects.all()
+        categories = get_categories()
         context = {
             'form': form,
             'categories': categories,
@@ -49,7 +63,7 @@ class RegistrationView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
         form = RegistrationForm(request.POST or None)
-        categories = Category.objects.all()
+        categories = get_categories()
         context = {
             'form': form,
             'categories': categories,
@@ -93,11 +107,17 @@ class ProfileView(CartMixin, View):
     """Профиль пользователя"""
 
     def get(self, request, *args, **kwargs):
-        customer = Customer.objects.get(user=request.user)
-        orders = Order.objects.filter(customer=customer).order_by('-created_at')
-        categories = Category.objects.all()
+        customer = get_customer(request.user)
+        # Позиции заказа - из снимков OrderLine, кол-во запросов
+        # не зависит от кол-ва заказов на странице
+        orders = Order.objects.filter(customer=customer).select_related(
+            'customer').prefetch_related('lines__product')
+        orders, next_cursor = get_keyset_page(
+            orders, request.GET.get('before'), ORDERS_PAGE_SIZE)
+        categories = get_categories()
         context = {
             'orders': orders,
+            'next_cursor': next_cursor,
             'categories': categories,
             'cart': self.cart
         }
@@ -108,11 +128,13 @@ class BaseView(CartMixin, View):
     """Главная страница"""
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
+        categories = get_categories()
+        # Запрос выполнится только при отсутствии списка в кэше фрагментов
         products = Product.objects.all()
         context = {
             'categories': categories,
             'products': products,
+            'products_version': get_products_version(),
             'cart': self.cart,
         }
         return render(request, 'mainapp/base.html', context)
@@ -121,6 +143,8 @@ class BaseView(CartMixin, View):
 class ProductDetailView(CartMixin, DetailView):
     """Детальное представление всех классов наследующихся от Product"""
 
+    model = Product
+    queryset = Product.objects.select_related('category')
     context_object_name = 'product'
     template_name = 'mainapp/product_detail.html'
     slug_url_kwarg = 'slug'
@@ -128,10 +152,16 @@ class ProductDetailView(CartMixin, DetailView):
     def get_context_data(self, **kwargs):
         """Добавить информацию о корзине"""
         context = super().get_context_data(**kwargs)
+        context['categories'] = get_categories()
         context['cart'] = self.cart
         return context
 
 
+def format_bound(value):
+    """Граница диапазона без экспоненты: 1234567.0 -> '1234567'"""
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
 class CategoryDetailView(CartMixin, DetailView):
     """Подробный вывод категорий"""
 
@@ -141,10 +171,68 @@ class CategoryDetailView(CartMixin, DetailView):
     template_name = 'mainapp/category_detail.html'
     slug_url_kwarg = 'slug'
 
+    paginate_by = 12
+
     def get_context_data(self, **kwargs):
-        """Добавить информацию о корзине"""
+        """Добавить информацию о корзине и фильтрацию по характеристикам"""
         context = super().get_context_data(**kwargs)
+        facet_index = get_facet_index(self.object)
+        selected = facet_index.parse_query(self.request.GET)
+        ranges = facet_index.parse_ranges(self.request.GET)
+        sort = facet_index.parse_sort(self.request.GET.get('sort'))
+        product_ids, facets = facet_index.filter(selected, ranges)
+
+        # Пагинация по отсортированным id => в запрос уходит только страница
+        page = Paginator(
+            facet_index.ordered(product_ids, sort), self.paginate_by).get_page(
+            self.request.GET.get('page'))
+        positions = {product_id: i for i, product_id in enumerate(page)}
+        products = sorted(
+            Product.objects.filter(category=self.object, id__in=list(page)),
+            key=lambda product: positions[product.id])
+
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        context['categories'] = get_categories()
         context['cart'] = self.cart
+        context['category_products'] = products
+        context['page_obj'] = page
+        context['query_string'] = query.urlencode()
+        context['facets'] = [
+            {
+                'filter_name': filter_name,
+                'name': facet_index.features.get(
+                    filter_name, (filter_name, None))[0],
+                'unit': facet_index.features.get(
+                    filter_name, (filter_name, None))[1],
+                'values': [
+                    {'value': value, 'count': count,
+                     'checked': value in selected.get(filter_name, ())}
+                    for value, count in sorted(values.items())
+                ],
+            }
+            for filter_name, values in facets.items() if values
+        ]
+        context['ranges'] = [
+            {
+                'filter_name': filter_name,
+                'name': facet_index.features.get(
+                    filter_name, (filter_name, None))[0],
+                'unit': facet_index.features.get(
+                    filter_name, (filter_name, None))[1],
+                'min': format_bound(values[0]),
+                'max': format_bound(values[-1]),
+                # Принятые границы выводятся так, как их ввёл покупатель
+                'selected': [
+                    self.request.GET[filter_name + suffix].replace(',', '.')
+                    if bound is not None else ''
+                    for suffix, bound in zip(
+                        ('_min', '_max'),
+                        ranges.get(filter_name, (None, None)))],
+            }
+            for filter_name, (values, _) in sorted(facet_index.numeric.items())
+        ]
+        context['sort'] = self.request.GET.get('sort', '') if sort else ''
         return context
 
 
@@ -152,10 +240,11 @@ class CartView(CartMixin, View):
     """Корзина"""
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
+        categories = get_categories()
         context = {
             'categories': categories,
             'cart': self.cart,
+            'cart_lines': self.cart.get_lines(),
         }
         return render(request, 'mainapp/cart.html', context)
 
@@ -170,19 +259,16 @@ class AddToCartView(CartMixin, View):
         # Получить продукт
         product = Product.objects.get(slug=product_slug)
 
-        # Новый продукт, для добавления в корзину (промежуточная модель)
-        cart_product, created = CartProduct.objects.get_or_create(
-            user=self.cart.owner, cart=self.cart, product=product)
-
-        if created:  # только если товара нет в корзине
-            # Добавить товар (cart_product) в корзину (cart)
-            self.cart.products.add(cart_product)
-        # Информация о корзине сохраняется только тогда,
-        # когда в неё что-то добавляется
-        recalc_cart(self.cart)
-
-        messages.add_message(
-            request, messages.INFO, 'Товар успешно добавлен в корзину')
+        # Новый продукт, для добавления в корзину (промежуточная модель).
+        # Позиция и итоги корзины меняются в одной транзакции
+        try:
+            add_to_cart(self.cart.resolve(), product)
+        except CartAlreadyOrderedError:
+            messages.add_message(
+                request, messages.INFO, 'Этот заказ уже оформлен')
+        else:
+            messages.add_message(
+                request, messages.INFO, 'Товар успешно добавлен в корзину')
         return HttpResponseRedirect('/cart/')
 
 
@@ -194,18 +280,19 @@ class DeleteFromCartView(CartMixin, View):
 
         product = Product.objects.get(slug=product_slug)
 
-        cart_product = CartProduct.objects.get(
-            user=self.cart.owner, cart=self.cart, product=product)
-
-        # Удалить продукт из корзины (Cart)
-        self.cart.products.remove(cart_product)
-        # Удалить запись из CartProduct
-        cart_product.delete()
-
-        recalc_cart(self.cart)
-
-        messages.add_message(
-            request, messages.INFO, 'Товар успешно удалён из корзины')
+        # Удалить продукт из корзины и вычесть его из итогов корзины
+        try:
+            remove_from_cart(self.cart.resolve(), product)
+        except CartAlreadyOrderedError:
+            messages.add_message(
+                request, messages.INFO, 'Этот заказ уже оформлен')
+        except CartUpdateConflictError:
+            messages.add_message(
+                request, messages.INFO,
+                'Корзина изменена в другой вкладке, попробуйте ещё раз')
+        else:
+            messages.add_message(
+                request, messages.INFO, 'Товар успешно удалён из корзины')
         return HttpResponseRedirect('/cart/')
 
 
@@ -217,16 +304,20 @@ class ChangeQTYView(CartMixin, View):
 
         product = Product.objects.get(slug=product_slug)
 
-        cart_product = CartProduct.objects.get(
-            user=self.cart.owner, cart=self.cart, product=product)
-
         # Получить значение из form.input (name/value)
         qty = int(request.POST.get('qty'))
-        cart_product.qty = qty
-        cart_product.save()
-        recalc_cart(self.cart)
-
-        messages.add_message(request, messages.INFO, 'Кол-во успешно изменено')
+        try:
+            change_cart_qty(self.cart.resolve(), product, qty)
+        except CartAlreadyOrderedError:
+            messages.add_message(
+                request, messages.INFO, 'Этот заказ уже оформлен')
+        except CartUpdateConflictError:
+            messages.add_message(
+                request, messages.INFO,
+                'Корзина изменена в другой вкладке, попробуйте ещё раз')
+        else:
+            messages.add_message(
+                request, messages.INFO, 'Кол-во успешно изменено')
         return HttpResponseRedirect('/cart/')
 
 
@@ -234,46 +325,51 @@ class CheckoutView(CartMixin, View):
     """Оформление заказа. Вывод данных на странице"""
 
     def get(self, request, *args, **kwargs):
-        # Встраиваем систему оплаты онлайн - stripe
-        # Создать инициацию онлайн платежа
-        # Set your secret key. Remember to switch to your live secret key in production.
-        # See your keys here: https://dashboard.stripe.com/apikeys
-        stripe.api_key = "sk_test_51JOnsiC11ED4v6Z5ywujZ2DgfexY4dphHIjspYYXSQpudIJQILtZQf7cj0YNkn74mLs2ENUnhpeYT9X2qehSodIO00vuQAxNtF"
-
-        intent = stripe.PaymentIntent.create(
-            # amount - принимает только int!!!
-            amount=int(self.cart.final_price * 100),
-            currency='rub',
-            # Verify your integration in this guide by including this parameter
-            metadata={'integration_check': 'accept_a_payment'},
-        )
+        # PaymentIntent (stripe) создаётся в фоне, страница его не ждёт.
+        # client_secret скрипт оплаты получает из PaymentIntentView
+        amount = cart_amount(self.cart)
+        if amount > 0:
+            prepare_payment_intent(self.cart.id, amount)
 
-        categories = Category.objects.all()
+        categories = get_categories()
         form = OrderForm(request.POST or None)
         context = {
             'categories': categories,
             'cart': self.cart,
+            'cart_lines': self.cart.get_lines(),
             'form': form,
-            # Установить/вернуть секретный ключ, для валидации оплаты
-            'client_secret': intent.client_secret,
         }
         return render(request, 'mainapp/checkout.html', context)
 
 
+class PaymentIntentView(CartMixin, View):
+    """client_secret PaymentIntent текущей корзины для оплаты картой"""
+
+    def get(self, request, *args, **kwargs):
+        amount = cart_amount(self.cart)
+        if amount <= 0:
+            return JsonResponse({'error': 'Корзина пуста'}, status=400)
+        try:
+            intent = wait_payment_intent(self.cart.id, amount)
+        except PaymentGatewayError as error:
+            return JsonResponse({'error': str(error)}, status=502)
+        return JsonResponse({'client_secret': intent.client_secret})
+
+
 class MakeOrderView(CartMixin, View):
     """Обработка заказа. Забрать данные из полей формы"""
 
-    # transaction.atomic - если на любом этапе выполнения ф-ии "код сломается",
-    # произойдёт аткат к началу ф-ии
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
+        if self.cart.owner_id is None:
+            return HttpResponseRedirect('/login/')
+        if not self.cart.total_products:
+            # Повторная отправка формы - корзина уже оформлена и пуста
+            return HttpResponseRedirect('/cart/')
         form = OrderForm(request.POST or None)
-        customer = Customer.objects.get(user=request.user)
         if form.is_valid():
             new_order = form.save(commit=False)  # приостановить сохранение
 
             # Забрать данные из полей формы
-            new_order.customer = customer
             new_order.first_name = form.cleaned_data['first_name']
             new_order.last_name = form.cleaned_data['last_name']
             new_order.phone = form.cleaned_data['phone']
@@ -281,14 +377,15 @@ class MakeOrderView(CartMixin, View):
             new_order.buying_type = form.cleaned_data['buying_type']
             new_order.order_date = form.cleaned_data['order_date']
             new_order.comment = form.cleaned_data['comment']
-            new_order.save()
 
-            # Закрепить корзину за пользователем и очистить её
-            self.cart.in_order = True
-            self.cart.save()
-            new_order.cart = self.cart  # поместить корзину после созранения
-            customer.orders.add(new_order)
-            new_order.save()
+            # Сохранить заказ и закрепить за ним корзину
+            try:
+                place_order(new_order, self.cart.resolve())
+            except CartAlreadyOrderedError:
+                messages.add_message(
+                    request, messages.INFO, 'Этот заказ уже оформлен')
+                return HttpResponseRedirect('/')
+            forget_payment_intent(self.cart.id)
 
             messages.add_message(
                 request, messages.INFO, 'Заказ отправлен. Спасибо за покупку!')
@@ -297,29 +394,92 @@ class MakeOrderView(CartMixin, View):
 
 
 class PayedOnlineOrderView(CartMixin, View):
-    """Оплата заказа онлайн"""
+    """
+    Заказ с оплатой онлайн. Заказ создаётся со статусом 'новый' и
+    становится оплаченным только по событию платёжной системы
+    (PaymentWebhookView -> process_payment_events)
+    """
+
+    def post(self, request, *args, **kwargs):
+        customer = self.cart.owner
+        if customer is None:
+            return JsonResponse({'error': 'Требуется авторизация'}, status=403)
+        if not self.cart.total_products:
+            return JsonResponse({'error': 'Корзина пуста'}, status=409)
+        # id платежа - из БД: кэш процесса мог его потерять, а заказ без
+        # платежа process_payment_events никогда не отметит оплаченным
+        intent_id = Cart.objects.filter(pk=self.cart.id).values_list(
+            'payment_intent_id', flat=True).first()
+        if not intent_id:
+            return JsonResponse(
+                {'error': 'Платёж для корзины не найден'}, status=409)
+        new_order = Order(
+            first_name=request.user.first_name,
+            last_name=request.user.last_name,
+            phone=customer.phone,
+            address=customer.address,
+            buying_type=Order.BUYING_TYPE_SELF,
+            payment_intent_id=intent_id,
+        )
+        try:
+            place_order(new_order, self.cart.resolve())
+        except CartAlreadyOrderedError as error:
+            return JsonResponse({'error': str(error)}, status=409)
+        forget_payment_intent(self.cart.id)
+
+        return JsonResponse({'status': new_order.status})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class PaymentWebhookView(View):
+    """
+    Приём событий платёжной системы. Событие только записывается в
+    очередь - ответ не зависит от скорости обработки заказов
+    """
 
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
-        customer = Customer.objects.get(user=request.user)
-        new_order = Order()  # создать новый объект
-
-        new_order.customer = customer
-        new_order.first_name = customer.user.first_name
-        new_order.last_name = customer.user.last_name
-        new_order.phone = customer.phone
-        new_order.address = customer.address
-
-        # Данные из самого запроса
-        new_order.buying_type = Order.BUYING_TYPE_SELF
-        new_order.save()
-
-        # Закрепить корзину за пользователем и очистить её
-        self.cart.in_order = True
-        self.cart.save()
-        new_order.cart = self.cart  # поместить корзину после созранения
-        new_order.status = Order.STATUS_PAYED
-        customer.orders.add(new_order)
-        new_order.save()
-
-        return JsonResponse({'status': 'payed'})
+        payload = request.body.decode('utf-8', errors='replace')
+        signature = request.META.get('HTTP_STRIPE_SIGNATURE', '')
+        if not enqueue_payment_event(payload, signature):
+            return JsonResponse({'error': 'Неверное событие'}, status=400)
+        return JsonResponse({'status': 'queued'})
+
+
+class FeedView(View):
+    """
+    Потоковая отдача XML (sitemap, YML фид): документ генерируется
+    частями, без сборки в памяти
+    """
+
+    def generate(self, base_url, **kwargs):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        base_url = f'{request.scheme}://{request.get_host()}'
+        return StreamingHttpResponse(
+            self.generate(base_url, **kwargs),
+            content_type='application/xml; charset=utf-8')
+
+
+class SitemapIndexView(FeedView):
+    def generate(self, base_url, **kwargs):
+        return generate_sitemap_index(base_url)
+
+
+class CategoriesSitemapView(FeedView):
+    def generate(self, base_url, **kwargs):
+        return generate_categories_sitemap(base_url)
+
+
+class ProductsSitemapView(FeedView):
+    def generate(self, base_url, shard, **kwargs):
+        if not 1 <= shard <= sitemap_shard_count():
+            raise Http404
+        return generate_products_sitemap(base_url, shard)
+
+
+class YMLFeedView(FeedView):
+    """Фид товаров для Яндекс.Маркета"""
+
+    def generate(self, base_url, **kwargs):
+        return generate_yml(base_url)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,10 +46,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'mainapp.middleware.StaticFilesMiddleware',
+    'mainapp.middleware.RequestTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'mainapp.middleware.PrimaryPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -88,9 +92,80 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Постоянные соединения (сек), без переподключения на каждый запрос
+        'CONN_MAX_AGE': 60,
     }
 }
 
+# Реплики для чтения каталога (mainapp.routers.PrimaryReplicaRouter).
+# Для PostgreSQL - отдельные записи DATABASES с адресами реплик.
+# Локально: DB_REPLICAS=2 - реплики replica1, replica2 указывают на ту же БД
+DATABASE_REPLICAS = [
+    f'replica{number}'
+    for number in range(1, int(os.environ.get('DB_REPLICAS', 0)) + 1)]
+for alias in DATABASE_REPLICAS:
+    # В тестах реплика - зеркало тестовой основной БД
+    DATABASES[alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['mainapp.routers.PrimaryReplicaRouter']
+# Сколько секунд после записи клиент читает каталог с основной БД
+REPLICA_PIN_SECONDS = 5
+# Реплика с большим отставанием (сек) не используется
+REPLICA_MAX_LAG = 5
+
+# Кэш. В production указать общий для всех воркеров backend
+# (например, memcached), иначе каждый процесс кэширует отдельно
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop',
+        # Фрагменты шаблонов кэшируются по товару - по умолчанию (300)
+        # карточки вытесняли бы друг друга и остальные ключи
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
+# Замер запросов (RequestTimingMiddleware): доля замеряемых запросов
+# (0 - отключено, 1 - все), порог медленного запроса, мс, и кол-во
+# одинаковых SQL запросов, после которого выводится предупреждение о N+1
+REQUEST_TIMING_SAMPLE_RATE = 1.0 if DEBUG else 0.0
+REQUEST_TIMING_SLOW_MS = 500
+REQUEST_TIMING_N_PLUS_ONE_THRESHOLD = 5
+
+# Журнал приложения (mainapp.timing - медленные запросы и N+1,
+# mainapp.thumbnails - ошибки создания копий изображений) - в консоль
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {
+            'format': '{asctime} {levelname} {name}: {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'verbose',
+        },
+    },
+    'loggers': {
+        'mainapp': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+# Платёжный шлюз: mainapp.payments.StripeGateway либо
+# mainapp.payments.FakeGateway (без сети, для разработки и нагрузочных тестов)
+PAYMENT_GATEWAY = 'mainapp.payments.StripeGateway'
+# Кол-во фоновых потоков для запросов к платёжному шлюзу
+PAYMENT_GATEWAY_WORKERS = 4
+# Секрет подписи событий webhook (Stripe: whsec_...)
+PAYMENT_WEBHOOK_SECRET = 'whsec_local_development_secret'
+# See your keys here: https://dashboard.stripe.com/apikeys
+STRIPE_SECRET_KEY = 'sk_test_51JOnsiC11ED4v6Z5ywujZ2DgfexY4dphHIjspYYXSQpudIJQILtZQf7cj0YNkn74mLs2ENUnhpeYT9X2qehSodIO00vuQAxNtF'
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -131,10 +206,17 @@ STATIC_DIR = BASE_DIR / 'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
-STATICFILES_DIRS = (
-    STATIC_DIR,
-    BASE_DIR / 'static_dev',
-)
+# Адрес сайта для sitemap и YML фида, записываемых командой generate_feeds
+SITE_URL = os.environ.get('SITE_URL', 'http://127.0.0.1:8000')
+FEEDS_ROOT = BASE_DIR / 'feeds'
+
+# Несуществующий каталог ломает collectstatic => только существующие
+STATICFILES_DIRS = tuple(
+    path for path in (STATIC_DIR, BASE_DIR / 'static_dev') if path.is_dir())
+# collectstatic: имена с хэшем содержимого, манифест и сжатые копии .gz/.br
+# (.br - если установлен пакет brotli). Отдаёт StaticFilesMiddleware
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATICFILES_STORAGE = 'mainapp.storage.CompressedManifestStaticFilesStorage'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -148,6 +230,6 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 # Настройки REST
 # Глобальная установка пагинации, для всех вьюшек
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'mainapp.api.pagination.KeysetPagination',
     'PAGE_SIZE': 10
 }
@@ -27,6 +27,6 @@ urlpatterns = [
 # В режиме отладки используем локальные медиафайлы и статику из проекта
 if settings.DEBUG:
     urlpatterns += static(
-        settings.STATIC_URL, document_root=settings.STATICFILES_DIRS)
+        settings.STATIC_URL, document_root=settings.STATIC_DIR)
     urlpatterns += static(
         settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
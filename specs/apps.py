@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class SpecsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'specs'
-    verbose_name = 'Спец. характеристики для товаров'
\ No newline at end of file
+    verbose_name = 'Спец. характеристики для товаров'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - регистрация обработчиков
@@ -0,0 +1,195 @@
+import math
+from bisect import bisect_left, bisect_right
+
+from django.core.cache import cache
+from django.db import transaction
+
+from mainapp.models import Product
+from .models import CategoryFeature, ProductFeatures
+
+# Версия в ключе меняется при изменении структуры FacetIndex
+FACET_INDEX_CACHE_KEY = 'specs:facet_index:v2:{}'
+FACET_INDEX_CACHE_TIMEOUT = 60 * 60
+
+
+class FacetIndex:
+    """
+    Инвертированный индекс характеристик одной категории:
+    feature_filter_name -> значение -> множество id товаров.
+    Фильтрация и подсчёт фасетов выполняются пересечением множеств в памяти,
+    без JOIN-а на ProductFeatures для каждой характеристики
+    """
+
+    def __init__(self, product_ids, index, features, numeric=None):
+        self.product_ids = frozenset(product_ids)
+        self.index = index
+        # feature_filter_name -> (feature_name, unit) для вывода в шаблоне
+        self.features = features
+        # feature_filter_name -> (числовые значения по возрастанию,
+        # id товаров в том же порядке): диапазоны и сортировка
+        self.numeric = numeric or {}
+
+    @classmethod
+    def build(cls, category):
+        """Построить индекс категории за три запроса"""
+        product_ids = Product.objects.filter(
+            category=category).values_list('id', flat=True)
+        features = {
+            filter_name: (name, unit)
+            for filter_name, name, unit in CategoryFeature.objects.filter(
+                category=category).values_list(
+                'feature_filter_name', 'feature_name', 'unit')
+        }
+        index = {filter_name: {} for filter_name in features}
+        numeric = {}
+        rows = ProductFeatures.objects.filter(
+            product__category=category).values_list(
+            'feature__feature_filter_name', 'value', 'product_id',
+            'numeric_value')
+        for filter_name, value, product_id, numeric_value in rows.iterator():
+            index.setdefault(filter_name, {}).setdefault(
+                value, set()).add(product_id)
+            if numeric_value is not None:
+                numeric.setdefault(filter_name, []).append(
+                    (numeric_value, product_id))
+        for filter_name, pairs in numeric.items():
+            pairs.sort()
+            numeric[filter_name] = (
+                tuple(value for value, _ in pairs),
+                tuple(product_id for _, product_id in pairs))
+        return cls(product_ids, index, features, numeric)
+
+    def parse_query(self, query_dict):
+        """
+        Выбранные значения из query параметров (?ram=8&ram=16&brand=x).
+        Параметры, не являющиеся характеристиками категории, игнорируются
+        """
+        selected = {}
+        for filter_name in self.index:
+            values = [value for value in query_dict.getlist(filter_name)
+                      if value]
+            if values:
+                selected[filter_name] = values
+        return selected
+
+    def parse_ranges(self, query_dict):
+        """
+        Диапазоны числовых характеристик (?ram_min=8&ram_max=32), границы
+        включаются. Неверные значения игнорируются
+        """
+        ranges = {}
+        for filter_name in self.numeric:
+            bounds = []
+            for suffix in ('_min', '_max'):
+                raw = query_dict.get(filter_name + suffix, '')
+                try:
+                    bound = float(raw.replace(',', '.'))
+                except ValueError:
+                    bound = None
+                bounds.append(
+                    bound if bound is not None and math.isfinite(bound)
+                    else None)
+            if bounds != [None, None]:
+                ranges[filter_name] = tuple(bounds)
+        return ranges
+
+    def parse_sort(self, value):
+        """
+        Сортировка по числовой характеристике: ?sort=ram - по возрастанию,
+        ?sort=-ram - по убыванию. None - порядок по умолчанию
+        """
+        value = value or ''
+        filter_name = value.lstrip('-')
+        if filter_name not in self.numeric:
+            return None
+        return filter_name, value.startswith('-')
+
+    def range_ids(self, filter_name, low, high):
+        """id товаров со значением характеристики в [low, high]"""
+        values, product_ids = self.numeric[filter_name]
+        start = 0 if low is None else bisect_left(values, low)
+        end = len(values) if high is None else bisect_right(values, high)
+        return set(product_ids[start:end])
+
+    def ordered(self, product_ids, sort=None):
+        """
+        id товаров в порядке сортировки. Товары без значения
+        характеристики - в конце, по id
+        """
+        if sort is None:
+            return sorted(product_ids)
+        filter_name, descending = sort
+        ordered_ids = self.numeric[filter_name][1]
+        if descending:
+            ordered_ids = reversed(ordered_ids)
+        result, seen = [], set()
+        for product_id in ordered_ids:
+            if product_id in product_ids and product_id not in seen:
+                seen.add(product_id)
+                result.append(product_id)
+        return result + sorted(set(product_ids) - seen)
+
+    def _intersect(self, id_sets):
+        """Пересечение множеств, начиная с самого маленького"""
+        id_sets = sorted(id_sets, key=len)
+        if not id_sets:
+            return set(self.product_ids)
+        result = set(id_sets[0])
+        for ids in id_sets[1:]:
+            if not result:
+                break
+            result &= ids
+        return result
+
+    def filter(self, selected, ranges=None):
+        """
+        Вернуть id подходящих товаров и кол-во товаров для каждого значения.
+        Внутри одной характеристики значения объединяются (ИЛИ), между
+        характеристиками - пересекаются (И). Диапазон (ranges) сужает
+        выбор по своей характеристике. Кол-во для значения считается
+        без учёта фильтра по его собственной характеристике
+        """
+        matches = {}
+        for filter_name, values in selected.items():
+            values_index = self.index.get(filter_name, {})
+            ids = set()
+            for value in values:
+                ids |= values_index.get(value, set())
+            matches[filter_name] = ids
+        for filter_name, (low, high) in (ranges or {}).items():
+            ids = self.range_ids(filter_name, low, high)
+            if filter_name in matches:
+                ids &= matches[filter_name]
+            matches[filter_name] = ids
+
+        result = self._intersect(matches.values())
+
+        facets = {}
+        for filter_name, values_index in self.index.items():
+            base = self._intersect(
+                ids for name, ids in matches.items() if name != filter_name)
+            facets[filter_name] = {
+                value: len(ids & base) for value, ids in values_index.items()}
+        return result, facets
+
+
+def get_facet_index(category):
+    """Индекс категории из кэша, либо построение нового"""
+    key = FACET_INDEX_CACHE_KEY.format(category.id)
+    index = cache.get(key)
+    if index is None:
+        index = FacetIndex.build(category)
+        cache.set(key, index, FACET_INDEX_CACHE_TIMEOUT)
+    return index
+
+
+def invalidate_facet_index(*category_ids):
+    """
+    Сбросить индексы категорий (при изменении товаров и характеристик).
+    Только после коммита, иначе параллельный запрос может построить
+    и закэшировать индекс по ещё не изменённым данным
+    """
+    keys = [FACET_INDEX_CACHE_KEY.format(category_id)
+            for category_id in category_ids if category_id]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from specs.facets import invalidate_facet_index
+from specs.models import CategoryFeature, ProductFeatures
+from specs.numeric import BACKFILL_BATCH_SIZE, backfill_numeric_values
+
+
+class Command(BaseCommand):
+    """
+    Заполнение ProductFeatures.numeric_value по строковым значениям
+    (после миграции, изменения единиц характеристик либо правил разбора).
+    Пачки по id, изменяются только строки с другим результатом
+    """
+
+    help = 'Пересчитать числовые значения характеристик товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--category', action='append', default=[],
+            help='slug категории (по умолчанию - все)')
+        parser.add_argument(
+            '--batch-size', type=int, default=BACKFILL_BATCH_SIZE,
+            help='Кол-во строк в одной пачке')
+
+    def handle(self, *args, **options):
+        queryset = ProductFeatures.objects.all()
+        features = CategoryFeature.objects.all()
+        if options['category']:
+            queryset = queryset.filter(
+                feature__category__slug__in=options['category'])
+            features = features.filter(
+                category__slug__in=options['category'])
+
+        started = time.monotonic()
+        checked, changed = backfill_numeric_values(
+            queryset, options['batch_size'])
+        elapsed = max(time.monotonic() - started, 1e-6)
+        if changed:
+            invalidate_facet_index(*set(
+                features.values_list('category_id', flat=True)))
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено: {checked} ({checked / elapsed:.0f} строк/с), '
+            f'изменено: {changed}'))
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('mainapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFeature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature_name', models.CharField(max_length=100, verbose_name='Имя характеристики')),
+                ('feature_filter_name', models.CharField(max_length=50, verbose_name='Имя для фильтра')),
+                ('unit', models.CharField(blank=True, max_length=50, null=True, verbose_name='Единица измерения')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Характеристики для товара',
+                'verbose_name_plural': 'Характеристики для товаров',
+                'unique_together': {('category', 'feature_name', 'feature_filter_name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductFeatures',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=255, verbose_name='Значение')),
+                ('feature', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='specs.categoryfeature', verbose_name='Характеристика')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Характеристики товара',
+                'verbose_name_plural': 'Характеристики товаров',
+            },
+        ),
+        migrations.CreateModel(
+            name='FeatureValidator',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valid_feature_value', models.CharField(max_length=100, verbose_name='Валидное значение')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.category', verbose_name='Категория')),
+                ('feature_key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='specs.categoryfeature', verbose_name='Ключ характеристики')),
+            ],
+            options={
+                'verbose_name': 'Валидатор для спец. хар-к',
+                'verbose_name_plural': 'Валидаторы для спец. хар-к',
+            },
+        ),
+    ]
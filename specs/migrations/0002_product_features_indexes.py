@@ -0,0 +1,26 @@
+# Generated by Django 3.2.6 on 2026-10-18 21:15
+
+from django.db import migrations, models
+
+from mainapp.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY (PostgreSQL) - вне транзакции
+    atomic = False
+
+    dependencies = [
+        ('specs', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='productfeatures',
+            index=models.Index(fields=['feature', 'value'], name='features_feature_value_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productfeatures',
+            index=models.Index(fields=['product', 'feature'], name='features_product_feature_idx'),
+        ),
+    ]
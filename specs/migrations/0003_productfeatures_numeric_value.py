@@ -0,0 +1,28 @@
+# Generated by Django 3.2.6 on 2026-10-18 22:05
+
+from django.db import migrations, models
+
+from mainapp.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY (PostgreSQL) - вне транзакции.
+    # Значения заполняет команда backfill_numeric_values
+    atomic = False
+
+    dependencies = [
+        ('specs', '0002_product_features_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productfeatures',
+            name='numeric_value',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Числовое значение'),
+        ),
+        AddIndexConcurrently(
+            model_name='productfeatures',
+            index=models.Index(fields=['feature', 'numeric_value'], name='features_feature_numeric_idx'),
+        ),
+    ]
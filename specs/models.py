@@ -1,5 +1,7 @@
 from django.db import models
 
+from .numeric import parse_numeric
+
 
 class CategoryFeature(models.Model):
     """Характеристика конкретной категории"""
@@ -55,6 +57,16 @@ class ProductFeatures(models.Model):
         CategoryFeature, verbose_name='Характеристика',
         on_delete=models.CASCADE)
     value = models.CharField(verbose_name='Значение', max_length=255)
+    # Значение как число в единицах характеристики (CategoryFeature.unit):
+    # фильтры по диапазону и сортировка. Пусто для нечисловых значений
+    numeric_value = models.FloatField(
+        verbose_name='Числовое значение', null=True, blank=True,
+        editable=False)
+
+    def save(self, *args, **kwargs):
+        """Разбор числового значения"""
+        self.numeric_value = parse_numeric(self.value, self.feature.unit)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return (f'Товар - "{self.product.title}" | '
@@ -64,3 +76,13 @@ class ProductFeatures(models.Model):
     class Meta:
         verbose_name = 'Характеристики товара'
         verbose_name_plural = 'Характеристики товаров'
+        indexes = [
+            # Фильтрация товаров по значению характеристики
+            models.Index(fields=('feature', 'value'),
+                         name='features_feature_value_idx'),
+            models.Index(fields=('product', 'feature'),
+                         name='features_product_feature_idx'),
+            # Диапазоны и сортировка по числовому значению
+            models.Index(fields=('feature', 'numeric_value'),
+                         name='features_feature_numeric_idx'),
+        ]
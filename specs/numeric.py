@@ -0,0 +1,108 @@
+"""
+Числовое значение характеристики (ProductFeatures.numeric_value).
+Значение ('8', '8 ГБ', '8192 MB', '6,1"') разбирается на число и единицу
+и приводится к единице характеристики (CategoryFeature.unit).
+Используется для фильтров по диапазону и сортировки
+"""
+import re
+
+from django.db import transaction
+
+# Единица -> (величина, множитель к базовой единице величины)
+UNITS = {}
+for quantity, units in {
+    'data': {
+        ('б', 'b', 'байт', 'byte'): 1,
+        ('кб', 'kb'): 1024,
+        ('мб', 'mb'): 1024 ** 2,
+        ('гб', 'gb'): 1024 ** 3,
+        ('тб', 'tb'): 1024 ** 4,
+    },
+    'frequency': {
+        ('гц', 'hz'): 1,
+        ('кгц', 'khz'): 10 ** 3,
+        ('мгц', 'mhz'): 10 ** 6,
+        ('ггц', 'ghz'): 10 ** 9,
+    },
+    'length': {
+        ('мм', 'mm'): 0.001,
+        ('см', 'cm'): 0.01,
+        ('м', 'm'): 1,
+        ('"', '″', 'дюйм', 'дюйма', 'дюймов', 'in', 'inch'): 0.0254,
+    },
+    'mass': {
+        ('г', 'гр', 'g'): 1,
+        ('кг', 'kg'): 1000,
+    },
+    'charge': {
+        ('мач', 'mah'): 1,
+        ('ач', 'ah'): 1000,
+    },
+    'power': {
+        ('вт', 'w'): 1,
+        ('квт', 'kw'): 1000,
+    },
+}.items():
+    for names, factor in units.items():
+        for name in names:
+            UNITS[name] = (quantity, factor)
+
+# Число (допускаются группы разрядов через пробел и десятичная запятая),
+# затем необязательная единица
+NUMBER_RE = re.compile(
+    r'^\s*([-+]?\d+(?:[ \u00a0]\d{3})*(?:[.,]\d+)?)\s*(.*?)\s*$')
+BACKFILL_BATCH_SIZE = 1000
+
+
+def normalize_unit(unit):
+    return (unit or '').strip().rstrip('.').lower()
+
+
+def parse_numeric(value, unit=None):
+    """
+    Число из значения характеристики в единицах unit. None, если значение
+    не числовое либо его единицу нельзя привести к unit
+    """
+    match = NUMBER_RE.match(value or '')
+    if not match:
+        return None
+    number = float(
+        re.sub(r'[ \u00a0]', '', match.group(1)).replace(',', '.'))
+    value_unit, unit = normalize_unit(match.group(2)), normalize_unit(unit)
+    if not value_unit or value_unit == unit:
+        return number
+    value_quantity, value_factor = UNITS.get(value_unit, (None, None))
+    quantity, factor = UNITS.get(unit, (None, None))
+    if value_quantity is None or value_quantity != quantity:
+        return None
+    return round(number * value_factor / factor, 6)
+
+
+def backfill_numeric_values(queryset, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Пересчитать numeric_value для характеристик queryset пачками
+    (keyset по id, bulk_update только изменившихся).
+    Вернуть (проверено, изменено)
+    """
+    checked = changed = 0
+    last_id = 0
+    queryset = queryset.select_related('feature').only(
+        'id', 'value', 'numeric_value', 'feature__unit').order_by('id')
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return checked, changed
+        last_id = batch[-1].id
+        checked += len(batch)
+        updated = []
+        for product_feature in batch:
+            numeric_value = parse_numeric(
+                product_feature.value, product_feature.feature.unit)
+            if numeric_value != product_feature.numeric_value:
+                product_feature.numeric_value = numeric_value
+                updated.append(product_feature)
+        if updated:
+            with transaction.atomic():
+                type(product_feature).objects.bulk_update(
+                    updated, ('numeric_value',))
+            changed += len(updated)
@@ -0,0 +1,64 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from mainapp.models import Product
+from .facets import invalidate_facet_index
+from .models import CategoryFeature, ProductFeatures
+from .numeric import backfill_numeric_values
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_facets(sender, instance, **kwargs):
+    # _old_category_id - из mainapp.signals.remember_product_category
+    invalidate_facet_index(
+        instance.category_id, getattr(instance, '_old_category_id', None))
+
+
+@receiver(pre_save, sender=CategoryFeature)
+def remember_feature_unit(sender, instance, **kwargs):
+    """Запомнить прежнюю единицу, чтобы пересчитать числовые значения"""
+    instance._old_unit = None
+    if instance.pk:
+        instance._old_unit = CategoryFeature.objects.filter(
+            pk=instance.pk).values_list('unit', flat=True).first()
+
+
+@receiver(post_save, sender=CategoryFeature)
+def recalc_numeric_values(sender, instance, created, **kwargs):
+    """Значения характеристики приводятся к её единице"""
+    if not created and instance.unit != getattr(instance, '_old_unit', None):
+        backfill_numeric_values(
+            ProductFeatures.objects.filter(feature=instance))
+
+
+@receiver(post_save, sender=CategoryFeature)
+def touch_feature_products(sender, instance, created, **kwargs):
+    """Имя и единица выводятся в характеристиках товаров (ETag, кэш)"""
+    if not created:
+        Product.objects.filter(productfeatures__feature=instance).update(
+            updated_at=timezone.now())
+
+
+@receiver(post_save, sender=CategoryFeature)
+@receiver(post_delete, sender=CategoryFeature)
+def invalidate_feature_facets(sender, instance, **kwargs):
+    invalidate_facet_index(instance.category_id)
+
+
+@receiver(post_save, sender=ProductFeatures)
+@receiver(post_delete, sender=ProductFeatures)
+def touch_product(sender, instance, **kwargs):
+    """Изменение характеристик - это изменение товара (ETag, кэш)"""
+    Product.objects.filter(pk=instance.product_id).update(
+        updated_at=timezone.now())
+
+
+@receiver(post_save, sender=ProductFeatures)
+@receiver(post_delete, sender=ProductFeatures)
+def invalidate_product_features_facets(sender, instance, **kwargs):
+    # При каскадном удалении характеристика может быть уже удалена
+    category_id = CategoryFeature.objects.filter(
+        pk=instance.feature_id).values_list('category_id', flat=True).first()
+    invalidate_facet_index(category_id)
@@ -1,3 +1,178 @@
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from mainapp.models import Category, Product
+from .facets import get_facet_index
+from .models import CategoryFeature, ProductFeatures
+from .numeric import parse_numeric
+
+
+class ParseNumericTest(TestCase):
+    """Разбор значения характеристики в число в единицах характеристики"""
+
+    def test_values(self):
+        cases = [
+            ('8', 'ГБ', 8.0),
+            ('8 ГБ', 'ГБ', 8.0),
+            ('8192 MB', 'ГБ', 8.0),
+            ('6,1"', 'дюйм', 6.1),
+            ('1 000 мАч', 'мАч', 1000.0),
+            ('2.4 ГГц', 'МГц', 2400.0),
+            ('12 шт', 'шт.', 12.0),
+            ('8 GB', 'кг', None),
+            ('Intel Core i5', None, None),
+            ('1920x1080', None, None),
+        ]
+        for value, unit, expected in cases:
+            with self.subTest(value=value, unit=unit):
+                self.assertEqual(parse_numeric(value, unit), expected)
+
+
+class NumericFiltersTest(TestCase):
+    """Фильтр по диапазону и сортировка по числовой характеристике"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(
+            name='Ноутбуки', slug='notebooks')
+        self.ram = CategoryFeature.objects.create(
+            category=self.category, feature_name='Память',
+            feature_filter_name='ram', unit='ГБ')
+        self.products = {}
+        for slug, ram in (('a', '16'), ('b', '4096 МБ'), ('c', '32 ГБ'),
+                          ('d', 'нет данных')):
+            product = Product.objects.create(
+                category=self.category, title=f'Ноутбук {slug}', slug=slug,
+                price=100, image='mainapp/images/product.jpg')
+            ProductFeatures.objects.create(
+                product=product, feature=self.ram, value=ram)
+            self.products[slug] = product.id
+
+    def test_numeric_value_is_saved(self):
+        self.assertEqual(
+            ProductFeatures.objects.get(product_id=self.products['b'])
+            .numeric_value, 4.0)
+        # Смена единицы характеристики пересчитывает значения
+        self.ram.unit = 'МБ'
+        self.ram.save()
+        self.assertEqual(
+            ProductFeatures.objects.get(product_id=self.products['c'])
+            .numeric_value, 32768.0)
+
+    def test_range_and_sort(self):
+        index = get_facet_index(self.category)
+        ids = self.products
+        ranges = index.parse_ranges({'ram_min': '8', 'ram_max': 'x'})
+        self.assertEqual(ranges, {'ram': (8.0, None)})
+        product_ids, _ = index.filter({}, ranges)
+        self.assertEqual(product_ids, {ids['a'], ids['c']})
+
+        all_ids, _ = index.filter({})
+        self.assertEqual(
+            index.ordered(all_ids, index.parse_sort('-ram')),
+            [ids['c'], ids['a'], ids['b'], ids['d']])
+        self.assertIsNone(index.parse_sort('price'))
+
+    def test_category_page(self):
+        response = self.client.get(
+            self.category.get_absolute_url() + '?ram_max=16&sort=-ram')
+        self.assertEqual(
+            [product.slug for product in response.context['category_products']],
+            ['a', 'b'])
+        self.assertContains(response, 'name="ram_min"')
+
+
+class FacetIndexTest(TestCase):
+    """Фасетный фильтр: ИЛИ внутри характеристики, И между ними"""
+
+    def setUp(self):
+        cache.clear()
+        # Тесты выполняют on_commit, файлов изображений нет
+        patcher = mock.patch(
+            'mainapp.signals.generate_thumbnails_safe', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.category = Category.objects.create(
+            name='Ноутбуки', slug='notebooks')
+        self.brand = CategoryFeature.objects.create(
+            category=self.category, feature_name='Производитель',
+            feature_filter_name='brand')
+        self.ram = CategoryFeature.objects.create(
+            category=self.category, feature_name='Память',
+            feature_filter_name='ram', unit='ГБ')
+        self.products = {}
+        for slug, brand, ram in (('a', 'Apple', '8'), ('b', 'Apple', '16'),
+                                 ('c', 'Dell', '8'), ('d', 'Lenovo', '16')):
+            self.products[slug] = self.create_product(slug, brand, ram)
+
+    def create_product(self, slug, brand, ram):
+        product = Product.objects.create(
+            category=self.category, title=f'Ноутбук {slug}', slug=slug,
+            price=100, image='mainapp/images/product.jpg')
+        ProductFeatures.objects.create(
+            product=product, feature=self.brand, value=brand)
+        ProductFeatures.objects.create(
+            product=product, feature=self.ram, value=ram)
+        return product
+
+    def ids(self, *slugs):
+        return {self.products[slug].id for slug in slugs}
+
+    def test_or_within_and_across_features(self):
+        index = get_facet_index(self.category)
+        product_ids, _ = index.filter({'brand': {'Apple', 'Dell'}})
+        self.assertEqual(product_ids, self.ids('a', 'b', 'c'))
+        product_ids, _ = index.filter(
+            {'brand': {'Apple', 'Dell'}, 'ram': {'8'}})
+        self.assertEqual(product_ids, self.ids('a', 'c'))
+        product_ids, _ = index.filter({'brand': {'Lenovo'}, 'ram': {'8'}})
+        self.assertEqual(product_ids, set())
+        product_ids, _ = index.filter({})
+        self.assertEqual(product_ids, self.ids('a', 'b', 'c', 'd'))
+
+    def test_counts_ignore_own_feature(self):
+        index = get_facet_index(self.category)
+        _, facets = index.filter({'brand': {'Apple'}})
+        # Другие производители остаются доступны для выбора (ИЛИ)
+        self.assertEqual(facets['brand'], {'Apple': 2, 'Dell': 1, 'Lenovo': 1})
+        self.assertEqual(facets['ram'], {'8': 1, '16': 1})
+
+        _, facets = index.filter({'brand': {'Apple'}, 'ram': {'8'}})
+        self.assertEqual(facets['brand'], {'Apple': 1, 'Dell': 1, 'Lenovo': 0})
+        self.assertEqual(facets['ram'], {'8': 1, '16': 1})
+
+    def test_signals_invalidate_index(self):
+        get_facet_index(self.category)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products['e'] = self.create_product('e', 'Dell', '32')
+            # До коммита - прежний индекс, новый не строится по
+            # незакоммиченным данным для других запросов
+            self.assertEqual(
+                get_facet_index(self.category).filter(
+                    {'brand': {'Dell'}})[0], self.ids('c'))
+        index = get_facet_index(self.category)
+        self.assertEqual(
+            index.filter({'brand': {'Dell'}})[0], self.ids('c', 'e'))
+
+        feature = ProductFeatures.objects.get(
+            product=self.products['e'], feature=self.brand)
+        feature.value = 'Apple'
+        with self.captureOnCommitCallbacks(execute=True):
+            feature.save()
+        self.assertEqual(
+            get_facet_index(self.category).filter({'brand': {'Dell'}})[0],
+            self.ids('c'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products['a'].delete()
+        self.assertEqual(
+            get_facet_index(self.category).filter({'brand': {'Apple'}})[0],
+            self.ids('b', 'e'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ram.delete()
+        index = get_facet_index(self.category)
+        self.assertNotIn('ram', index.features)
+        self.assertNotIn('ram', index.filter({})[1])
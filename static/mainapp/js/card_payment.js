@@ -19,20 +19,33 @@ card.on('change', function (event) {
         displayError.textContent = '';
     }
 });
+// client_secret запрашивается сразу после загрузки страницы, пока
+// пользователь вводит данные карты (сервер создаёт PaymentIntent в фоне)
+const intentUrl = document.querySelector('#card-button').dataset.intentUrl;
+const clientSecret = fetch(intentUrl, {credentials: 'same-origin'})
+    .then(function (response) {
+        return response.json();
+    })
+    .then(function (data) {
+        if (data.error) {
+            throw new Error(data.error);
+        }
+        return data.client_secret;
+    });
 // Событие на кнопке 'submit' в форме
 form.addEventListener('submit', function (ev) {
     ev.preventDefault();  // отменяем базовое поведение формы
-    // Элемент с data-secret="{{ client_secret }}"
-    const clientSecret = document.querySelector('#card-button')
-    // Подтвеждение платежа
-    stripe.confirmCardPayment(clientSecret.dataset.secret, {
-        payment_method: {
-            card: card,
-            // Добавить имя в billing_details
-            billing_details: {
-                name: document.querySelector('#card-button').dataset.username
+    clientSecret.then(function (secret) {
+        // Подтвеждение платежа
+        return stripe.confirmCardPayment(secret, {
+            payment_method: {
+                card: card,
+                // Добавить имя в billing_details
+                billing_details: {
+                    name: document.querySelector('#card-button').dataset.username
+                }
             }
-        }
+        });
     }).then(function (result) {
         // После прохождения запроса получаем ошибку
         if (result.error) {
@@ -85,5 +98,8 @@ form.addEventListener('submit', function (ev) {
                 }
             }
         }
+    }).catch(function (error) {
+        // Платёжная система недоступна
+        document.querySelector('#card-errors').textContent = error.message;
     });
 });
\ No newline at end of file